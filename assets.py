@@ -0,0 +1,53 @@
+from parameters import white
+
+'''
+Image assets. The sprite images are only read from disk the first time one
+of them is asked for, and are then packed side by side into one atlas
+surface with the rect of every frame worked out once. Headless colonies
+never ask, so they run without pygame.image or any of the files.
+'''
+
+# Frames of the atlas, in the order they are packed
+SPRITES = ('ant_sprite_0', 'ant_sprite_1', 'ant_sprite_2', 'ant_sprite_food', 'ant_hill_sprite')
+
+
+class Atlas:
+    """ Images packed into one surface, built on first use """
+
+    def __init__(self, names=SPRITES, padding=1):
+        self.names = names
+        self.padding = padding  # Empty pixels between frames, so scaled frames don't bleed
+        self.surface = None
+        self.rects = {}
+        self._frames = {}
+
+    def build(self):
+        # Load every image and pack them left to right in one row. pygame is only
+        # imported here, importing this module costs nothing
+        import pygame
+        images = [pygame.image.load(name + ".png") for name in self.names]
+        x = 0
+        for name, image in zip(self.names, images):
+            self.rects[name] = pygame.Rect(x, 0, image.get_width(), image.get_height())
+            x += image.get_width() + self.padding
+
+        # The space around smaller frames is white, the colour ant images use as their colorkey
+        self.surface = pygame.Surface((max(x - self.padding, 1), max(r.height for r in self.rects.values())))
+        self.surface.fill(white)
+        for name, image in zip(self.names, images):
+            self.surface.blit(image, self.rects[name])
+
+    def image(self, name):
+        # The frame called name, as a subsurface sharing the atlas pixels
+        if self.surface is None:
+            self.build()
+        if name not in self._frames:
+            self._frames[name] = self.surface.subsurface(self.rects[name])
+        return self._frames[name]
+
+
+atlas = Atlas()
+
+
+def load_sprite(name):
+    return atlas.image(name)
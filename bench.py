@@ -0,0 +1,196 @@
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import numpy as np
+from parameters import fps, world_size
+from simclock import SimClock
+from swarm import SwarmEnvironment
+from field import HOME, FOOD
+
+'''
+Throughput benchmarks. Each scenario builds a headless colony, runs a fixed
+number of ticks and reports ticks/sec, ns per ant-tick, peak memory and the
+pheromone count as JSON. Every scenario runs in its own process so peak
+memory is not shared between them.
+
+    python bench.py                   # all scenarios
+    python bench.py sprites-100 swarm-100k-clusters
+    python bench.py --engine swarm --ants 50000 --food rings --ticks 100
+    python bench.py --checkpoint warm.antckp --ticks 100
+'''
+
+ENGINES = ('sprites', 'field', 'swarm')
+FOOD_LAYOUTS = ('none', 'scattered', 'clusters', 'rings')
+
+# name: (engine, ants, food layout, pheromones seeded before the run, ticks)
+SCENARIOS = {
+    'sprites-100': ('sprites', 100, 'none', 0, 500),
+    'sprites-100-scattered': ('sprites', 100, 'scattered', 0, 500),
+    'sprites-100-dense': ('sprites', 100, 'clusters', 5000, 200),
+    'sprites-1k-clusters': ('sprites', 1000, 'clusters', 0, 50),
+    'field-100-scattered': ('field', 100, 'scattered', 0, 500),
+    'field-1k-clusters': ('field', 1000, 'clusters', 0, 100),
+    'field-1k-dense': ('field', 1000, 'clusters', 50000, 100),
+    'swarm-1k-rings': ('swarm', 1000, 'rings', 0, 500),
+    'swarm-10k-clusters': ('swarm', 10000, 'clusters', 0, 200),
+    'swarm-10k-dense': ('swarm', 10000, 'scattered', 50000, 200),
+    'swarm-100k-clusters': ('swarm', 100000, 'clusters', 0, 50),
+    'swarm-100k-rings': ('swarm', 100000, 'rings', 0, 50),
+}
+
+
+def food_layout(layout, rng, count=2000, size=world_size):
+    # (N, 2) array of food positions for a named layout
+    w, h = size
+    if layout == 'none':
+        return np.zeros((0, 2))
+    if layout == 'scattered':
+        return rng.uniform((0, 0), (w, h), (count, 2))
+    if layout == 'clusters':
+        centres = rng.uniform((0.1 * w, 0.1 * h), (0.9 * w, 0.9 * h), (5, 2))
+        return centres[rng.integers(0, 5, count)] + rng.normal(0, 0.02 * w, (count, 2))
+    if layout == 'rings':
+        radius = rng.choice([0.2 * w, 0.35 * w], count) + rng.normal(0, 2, count)
+        angle = rng.uniform(0, 2 * np.pi, count)
+        return np.column_stack((w / 2 + radius * np.cos(angle), h / 2 + radius * np.sin(angle)))
+    raise ValueError("unknown food layout {!r}".format(layout))
+
+
+def build(engine, ants, food, pheromones, seed=0):
+    # A headless colony in the middle of the world, with food and pheromones placed
+    rng = np.random.default_rng(seed)
+    clock = SimClock(1.0 / fps)
+    centre = (world_size[0] / 2, world_size[1] / 2)
+    food = food_layout(food, rng)
+    seeded = rng.uniform((0, 0), world_size, (pheromones, 2))
+
+    if engine == 'swarm':
+        colony = SwarmEnvironment(centre, ants, clock, seed)
+        colony.add_food(food)
+        colony.field.deposit(HOME, seeded[::2])
+        colony.field.deposit(FOOD, seeded[1::2])
+        return colony
+
+    # Only sprite colonies need pygame, swarm runs and their sweep workers never import it
+    from classes import Environment
+    colony = Environment(centre, ants, clock=clock, seed=seed, headless=True,
+                         field_cell=4 if engine == 'field' else None)
+    for position in food:
+        colony.add_food(position)
+    if colony.field is not None:
+        colony.field.deposit(HOME, seeded[::2])
+        colony.field.deposit(FOOD, seeded[1::2])
+    else:
+        # Spread the lifetimes so seeded pheromones do not all expire on the same tick.
+        # The queue holds them in the order they expire
+        end = np.sort(rng.uniform(0, colony.p_time, len(seeded)))
+        colony.pheromones.extend(seeded, clock.now() + end, np.where(np.arange(len(seeded)) % 2 == 0, HOME, FOOD))
+    return colony
+
+
+def pheromone_count(colony):
+    if colony.field is not None:
+        return len(colony.field)
+    return len(colony.pheromones)
+
+
+def engine_of(colony):
+    if isinstance(colony, SwarmEnvironment):
+        return 'swarm'
+    return 'field' if colony.field is not None else 'sprites'
+
+
+def run(engine, ants, food='none', pheromones=0, ticks=100, seed=0, resume=None):
+    """
+    Build and run one scenario in this process and return its results.
+    With resume the colony is loaded from that checkpoint instead, and
+    engine and ants are taken from it.
+    """
+    if resume is not None:
+        import checkpoint
+        colony = checkpoint.load(resume)
+        engine, ants = engine_of(colony), len(colony)
+    else:
+        colony = build(engine, ants, food, pheromones, seed)
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        colony.step()
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+
+    return {
+        'engine': engine,
+        'ants': ants,
+        'food': food,
+        'pheromones_seeded': pheromones,
+        'ticks': ticks,
+        'seconds': elapsed,
+        'ticks_per_sec': ticks / elapsed,
+        'ns_per_ant_tick': elapsed * 1e9 / (ticks * ants),
+        'peak_rss_kb': peak,
+        'pheromones': pheromone_count(colony),
+    }
+
+
+def _run(args):
+    return run(*args)
+
+
+def run_isolated(engine, ants, food='none', pheromones=0, ticks=100, seed=0, resume=None):
+    # Run a scenario in a fresh process so its peak memory is its own
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        return pool.apply(_run, ((engine, ants, food, pheromones, ticks, seed, resume),))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ant colony throughput benchmarks")
+    parser.add_argument("scenarios", nargs="*", help="named scenarios to run (default: all)")
+    parser.add_argument("--list", action="store_true", help="list the named scenarios")
+    parser.add_argument("--engine", choices=ENGINES, help="run one custom scenario with this engine")
+    parser.add_argument("--ants", type=int, default=1000)
+    parser.add_argument("--food", choices=FOOD_LAYOUTS, default='none')
+    parser.add_argument("--pheromones", type=int, default=0)
+    parser.add_argument("--ticks", type=int, help="override the number of ticks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--checkpoint", help="run one scenario from this checkpoint, skipping warm-up")
+    parser.add_argument("--out", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print("{:24} engine={} ants={} food={} pheromones={} ticks={}".format(name, *scenario))
+        sys.exit(0)
+
+    if args.checkpoint:
+        todo = {'checkpoint': (None, None, None, None, args.ticks or 100)}
+    elif args.engine:
+        todo = {'custom': (args.engine, args.ants, args.food, args.pheromones, args.ticks or 100)}
+    else:
+        unknown = [name for name in args.scenarios if name not in SCENARIOS]
+        if unknown:
+            parser.error("unknown scenario(s): " + ", ".join(unknown))
+        todo = {name: SCENARIOS[name] for name in (args.scenarios or SCENARIOS)}
+
+    results = []
+    for name, (engine, ants, food, pheromones, ticks) in todo.items():
+        result = run_isolated(engine, ants, food, pheromones, args.ticks or ticks, args.seed, args.checkpoint)
+        result['scenario'] = name
+        results.append(result)
+        print("{:24} {:10.1f} ticks/s {:10.0f} ns/ant-tick".format(
+            name, result['ticks_per_sec'], result['ns_per_ant_tick']), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,67 @@
+import math
+from parameters import resolution, world_size
+
+'''
+Camera over a world that can be much bigger than the window. The camera
+maps world coordinates to screen pixels with a centre and a zoom factor,
+and gives the part of the world in view so drawing can skip the rest.
+'''
+
+
+class Camera:
+    """ Pannable, zoomable view of the world """
+
+    def __init__(self, view=resolution, world=world_size, center=None, zoom=1.0, min_zoom=0.25, max_zoom=4.0):
+        self.view = view  # Window size in pixels
+        self.world = world
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.zoom = zoom
+        if center is None:
+            center = (world[0] / 2, world[1] / 2)
+        self.x, self.y = center
+        self._clamp()
+
+    def _clamp(self):
+        # Keep the zoom in range and the centre inside the world
+        self.zoom = min(max(self.zoom, self.min_zoom), self.max_zoom)
+        self.x = min(max(self.x, 0), self.world[0])
+        self.y = min(max(self.y, 0), self.world[1])
+
+    def pan(self, dx, dy):
+        # Move the view by (dx, dy) screen pixels
+        self.x += dx / self.zoom
+        self.y += dy / self.zoom
+        self._clamp()
+
+    def zoom_at(self, factor, pixel):
+        # Zoom by factor, keeping the world point under pixel where it is on screen
+        wx, wy = self.to_world(pixel)
+        self.zoom *= factor
+        self._clamp()
+        self.x = wx - (pixel[0] - self.view[0] / 2) / self.zoom
+        self.y = wy - (pixel[1] - self.view[1] / 2) / self.zoom
+        self._clamp()
+
+    def size(self):
+        # World size of the view, in whole pixels
+        return int(math.ceil(self.view[0] / self.zoom)), int(math.ceil(self.view[1] / self.zoom))
+
+    def topleft(self):
+        # World position of the top left corner of the view, on whole pixels
+        w, h = self.size()
+        return int(math.floor(self.x - w / 2)), int(math.floor(self.y - h / 2))
+
+    def bounds(self, margin=0):
+        # (minx, miny, maxx, maxy) of the world in view, grown by margin
+        x0, y0 = self.topleft()
+        w, h = self.size()
+        return x0 - margin, y0 - margin, x0 + w + margin, y0 + h + margin
+
+    def to_world(self, pixel):
+        x0, y0 = self.topleft()
+        return x0 + pixel[0] / self.zoom, y0 + pixel[1] / self.zoom
+
+    def to_screen(self, point):
+        x0, y0 = self.topleft()
+        return (point[0] - x0) * self.zoom, (point[1] - y0) * self.zoom
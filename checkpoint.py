@@ -0,0 +1,319 @@
+import json
+import random
+import struct
+import numpy as np
+from pygame import Vector2
+from parameters import fps
+from simclock import SimClock
+from objects import Ant, Food
+from classes import Environment
+from swarm import SwarmEnvironment
+from obstacles import ObstacleMap
+
+'''
+Checkpoints of a whole colony. save writes the ants, food, pheromones and walls of
+an Environment or a SwarmEnvironment as contiguous arrays, and load builds
+the colony back from them, so a long run can be picked up where it stopped
+and benchmarks can start from a warmed up world.
+
+File layout, little endian:
+    header  b'ANTCKP', version u16, metadata length u32
+    meta    JSON: colony kind, settings, clock, and name -> (dtype, shape, offset) of every array
+    arrays  raw array data, each starting on a 64 byte boundary
+
+load memory-maps the file copy-on-write, so big arrays such as the field
+grid are only read from disk when touched and the file is never written.
+'''
+
+MAGIC = b'ANTCKP'
+VERSION = 6
+HEADER = struct.Struct('<6sHI')
+ALIGN = 64
+
+# Vector attributes of a sprite ant, saved as (N, 2) arrays
+_ANT_VECTORS = ('position', 'velocity', 'desired_direction')
+# Behaviour constants of an ant, the same names on objects.Ant and swarm.AntSwarm
+_ANT_PARAMETERS = ('max_speed', 'wander_strength', 'steer_strength', 'p_interval', 'f_radius', 'p_radius',
+                   'viewAngle', 'avoid_distance')
+
+
+def _rng_state(rng):
+    # The 625 words of a Mersenne Twister state, with gauss_next as NaN when unset
+    version, words, gauss = rng.getstate()
+    return words, np.nan if gauss is None else gauss
+
+
+def _set_rng_state(rng, words, gauss):
+    rng.setstate((3, tuple(int(w) for w in words), None if np.isnan(gauss) else float(gauss)))
+
+
+def _environment_arrays(colony):
+    # Arrays and settings of a sprite Environment
+    ants = colony.sprites.sprites()
+    n = len(ants)
+    arrays = {name: np.array([tuple(getattr(ant, name)) for ant in ants], dtype=np.float64).reshape(n, 2)
+              for name in _ANT_VECTORS}
+    arrays['target'] = np.array([tuple(ant.target) if ant.target is not None else (0.0, 0.0) for ant in ants],
+                                dtype=np.float64).reshape(n, 2)
+    arrays['has_target'] = np.array([ant.target is not None for ant in ants], dtype=bool)
+    arrays['holding_food'] = np.array([ant.holding_food for ant in ants], dtype=bool)
+    arrays['t0'] = np.array([ant.t0 for ant in ants], dtype=np.float64)
+    arrays['t_last_p'] = np.array([ant.t_last_p for ant in ants], dtype=np.float64)
+    arrays['frame'] = np.array([getattr(ant, 'index', 0) for ant in ants], dtype=np.uint8)
+    # One row per ant, sprite ants can each be given their own
+    arrays['ant_params'] = np.array([[getattr(ant, name) for name in _ANT_PARAMETERS] for ant in ants],
+                                    dtype=np.float64).reshape(n, len(_ANT_PARAMETERS))
+
+    # Seeded colonies carry one random stream per ant and one for the colony
+    if colony.seed is not None:
+        states = [_rng_state(ant.rng) for ant in ants]
+        arrays['rng'] = np.array([s[0] for s in states], dtype=np.uint32).reshape(n, 625)
+        arrays['rng_gauss'] = np.array([s[1] for s in states], dtype=np.float64)
+        words, gauss = _rng_state(colony.rng)
+        arrays['colony_rng'] = np.array(words, dtype=np.uint32)
+        arrays['colony_rng_gauss'] = np.array([gauss], dtype=np.float64)
+
+    food = colony.food.sprites()
+    arrays['food'] = np.array([tuple(f.position) for f in food], dtype=np.float64).reshape(-1, 2)
+    arrays['food_color'] = np.array([f.color for f in food], dtype=np.float64).reshape(-1, 3)
+    arrays['food_amount'] = np.array([f.amount for f in food], dtype=np.int64)
+
+    # Pheromones oldest first, the order the queue needs them back in
+    pheromones = colony.pheromones
+    arrays['pheromones'], arrays['pheromones_end'], arrays['pheromones_kind'] = pheromones.arrays()
+
+    if colony.field is not None:
+        arrays['field'] = colony.field.grid
+
+    settings = {
+        'position': tuple(colony.ant_hill.position),
+        'seed': colony.seed,
+        'field_cell': colony.field.cell_size if colony.field is not None else None,
+        'size': tuple(colony.size),
+        't0': colony.t0,
+        'p_time': colony.p_time,
+        'pheromone_sensing': colony.pheromone_sensing,
+        'pheromones': {'max_count': pheromones.max_count, 'expired': pheromones.expired,
+                       'evicted': pheromones.evicted},
+    }
+    settings.update(_field_settings(colony.field))
+    _obstacle_arrays(colony.obstacles, settings, arrays)
+    return settings, arrays
+
+
+def _swarm_arrays(colony):
+    # Arrays and settings of a SwarmEnvironment
+    ants = colony.ants
+    arrays = {name: getattr(ants, name) for name in ants.STATE}
+    arrays['field'] = colony.field.grid
+    arrays['food'] = colony.food
+
+    field = colony.field
+    settings = {
+        'position': colony.hills.tolist(),
+        'field_cell': field.cell_size,
+        'size': (field.width * field.cell_size, field.height * field.cell_size),
+        'origin': tuple(field.origin.tolist()),
+        'delivered': colony.delivered,
+        'delivered_by': colony.delivered_by.tolist(),
+        'key': ants.key,
+        'draws': ants.draws,
+        'ants_t0': ants.t0,
+        'ant_params': {name: getattr(ants, name) for name in _ANT_PARAMETERS},
+        't0': colony.t0,
+        'p_time': colony.p_time,
+    }
+    settings.update(_field_settings(field))
+    _obstacle_arrays(colony.obstacles, settings, arrays)
+    return settings, arrays
+
+
+def save(colony, path):
+    """
+    Write a checkpoint of an Environment or a SwarmEnvironment to path
+    """
+    if isinstance(colony, SwarmEnvironment):
+        kind = 'swarm'
+        settings, arrays = _swarm_arrays(colony)
+    else:
+        kind = 'sprites'
+        settings, arrays = _environment_arrays(colony)
+
+    clock = colony.clock
+    meta = {
+        'kind': kind,
+        'settings': settings,
+        'clock': {'t': clock.now(), 'tick': clock.tick, 'dt': getattr(clock, 'dt', None)},
+        'arrays': {},
+    }
+
+    # Lay the arrays out one after another on aligned offsets, counted from the
+    # start of the data section since the metadata length is not known yet
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        meta['arrays'][name] = (array.dtype.str, array.shape, offset)
+        offset += array.nbytes
+
+    blob = json.dumps(meta).encode()
+    start = -(-(HEADER.size + len(blob)) // ALIGN) * ALIGN
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(blob)))
+        f.write(blob)
+        for name, array in arrays.items():
+            f.seek(start + meta['arrays'][name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+
+
+def read(path, mmap=True):
+    """
+    Return (meta, arrays) of a checkpoint. With mmap the arrays are
+    copy-on-write views of the file, otherwise they are read into memory.
+    """
+    with open(path, 'rb') as f:
+        magic, version, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a checkpoint".format(path))
+        if version != VERSION:
+            raise ValueError("unsupported checkpoint version {}".format(version))
+        meta = json.loads(f.read(length).decode())
+
+    start = -(-(HEADER.size + length) // ALIGN) * ALIGN
+    data = np.memmap(path, dtype=np.uint8, mode='c') if mmap else np.fromfile(path, dtype=np.uint8)
+    arrays = {}
+    for name, (dtype, shape, offset) in meta['arrays'].items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        begin = start + offset
+        arrays[name] = data[begin:begin + count * dtype.itemsize].view(dtype).reshape(shape)
+    return meta, arrays
+
+
+def _field_settings(field):
+    if field is None:
+        return {}
+    return {'decay_t': field.decay_t, 'diffusion': field.diffusion}
+
+
+def _load_field(field, settings, grid):
+    field.grid = grid
+    field.set_decay(settings['decay_t'])
+    field.diffusion = settings['diffusion']
+    # Every tile is looked at once, the empty ones drop out on the first tick
+    field.touch()
+
+
+def _obstacle_arrays(obstacles, settings, arrays):
+    # Walls are saved with their distance field, so loading does not compute it again
+    if obstacles is None:
+        return
+    settings['obstacles'] = {'cell_size': obstacles.cell_size, 'reach': obstacles.reach,
+                             'origin': tuple(obstacles.origin.tolist())}
+    arrays['obstacle_mask'] = obstacles.mask
+    arrays['obstacle_distance'] = obstacles.distance
+    arrays['obstacle_normal'] = obstacles.normal
+
+
+def _load_obstacles(colony, settings, arrays):
+    saved = settings.get('obstacles')
+    if saved is None:
+        return
+    height, width = arrays['obstacle_mask'].shape
+    cs = saved['cell_size']
+    obstacles = ObstacleMap((width * cs, height * cs), cs, saved['reach'], saved['origin'])
+    obstacles.mask = arrays['obstacle_mask']
+    obstacles.distance = arrays['obstacle_distance']
+    obstacles.normal = arrays['obstacle_normal']
+    colony.obstacles = obstacles
+    colony.obstacle_cell = cs
+
+
+def _load_environment(settings, arrays, clock, shift, headless):
+    seed = settings['seed']
+    colony = Environment(settings['position'], 0, clock=clock, seed=seed, headless=headless,
+                         field_cell=settings['field_cell'], size=settings['size'])
+    colony.t0 = settings['t0'] + shift
+    colony.p_time = settings['p_time']
+    colony.pheromone_sensing = settings['pheromone_sensing']
+    if seed is not None:
+        _set_rng_state(colony.rng, arrays['colony_rng'], arrays['colony_rng_gauss'][0])
+
+    n = len(arrays['position'])
+    colony.n = n
+    for i in range(n):
+        rng = random.Random() if seed is not None else random
+        ant = Ant(Vector2(*arrays['position'][i]), clock, rng, graphics=not headless)
+        if seed is not None:
+            # After the constructor, which draws the starting velocity
+            _set_rng_state(rng, arrays['rng'][i], arrays['rng_gauss'][i])
+        ant.velocity = Vector2(*arrays['velocity'][i])
+        ant.desired_direction = Vector2(*arrays['desired_direction'][i])
+        ant.target = Vector2(*arrays['target'][i]) if arrays['has_target'][i] else None
+        ant.holding_food = bool(arrays['holding_food'][i])
+        ant.t0 = float(arrays['t0'][i]) + shift
+        ant.t_last_p = float(arrays['t_last_p'][i]) + shift
+        for name, value in zip(_ANT_PARAMETERS, arrays['ant_params'][i]):
+            setattr(ant, name, float(value))
+        if not headless:
+            ant.index = int(arrays['frame'][i])
+        ant.body.center = ant.rect.center = ant.position
+        ant.add(colony.sprites)
+
+    for (x, y), color, amount in zip(arrays['food'], arrays['food_color'], arrays['food_amount']):
+        colony.add_pile(Food(Vector2(x, y), tuple(color), shift=0, amount=int(amount)))
+
+    saved = settings['pheromones']
+    pheromones = colony.pheromones
+    pheromones.max_count = saved['max_count']
+    pheromones.extend(arrays['pheromones'], arrays['pheromones_end'] + shift, arrays['pheromones_kind'])
+    pheromones.expired = saved['expired']
+    pheromones.evicted = saved['evicted']
+
+    if colony.field is not None:
+        _load_field(colony.field, settings, arrays['field'])
+    _load_obstacles(colony, settings, arrays)
+    return colony
+
+
+def _load_swarm(settings, arrays, clock, shift):
+    colony = SwarmEnvironment(settings['position'], 0, clock, None, settings['field_cell'],
+                              settings['size'], settings['origin'])
+    _load_field(colony.field, settings, arrays['field'])
+    colony.food = arrays['food']
+    colony.delivered = settings['delivered']
+    colony.delivered_by[:] = settings['delivered_by']
+    colony.t0 = settings['t0'] + shift
+    colony.p_time = settings['p_time']
+
+    ants = colony.ants
+    for name in ants.STATE:
+        setattr(ants, name, arrays[name])
+    ants.t_last_p = ants.t_last_p + shift
+    ants.n = colony.n = len(ants.position)
+    ants.key = settings['key']
+    ants.draws = settings['draws']
+    ants.t0 = settings['ants_t0'] + shift
+    for name, value in settings['ant_params'].items():
+        setattr(ants, name, value)
+    ants._scratch()
+    _load_obstacles(colony, settings, arrays)
+    return colony
+
+
+def load(path, clock=None, headless=True, mmap=True):
+    """
+    Build the colony saved in a checkpoint. Without a clock it continues on a
+    SimClock from the saved time. With any other clock the saved times are
+    shifted to that clock's now(). headless only applies to sprite colonies.
+    """
+    meta, arrays = read(path, mmap)
+    saved = meta['clock']
+    if clock is None:
+        clock = SimClock(saved['dt'] or 1.0 / fps, saved['t'])
+        clock.tick = saved['tick']
+    shift = clock.now() - saved['t']
+
+    if meta['kind'] == 'swarm':
+        return _load_swarm(meta['settings'], arrays, clock, shift)
+    return _load_environment(meta['settings'], arrays, clock, shift, headless)
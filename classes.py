@@ -1,107 +1,284 @@
 import pygame
 from pygame import Vector2
-from objects import Pheromone, Ant, AntHill
+from objects import Ant, AntHill, Food
 from parameters import *
+from simclock import WallClock
+from datastructs import SpatialGroup, PointIndex, PointQueue
+from field import PheromoneField, HOME, FOOD
+from render import PheromoneLayer, ObstacleLayer
+from obstacles import ObstacleMap
+from streams import ant_random, seed_key
+from time import perf_counter
+import numpy as np
+import random
 import math
+import itertools
 
 PI = math.pi
 
 
-def ant_detect_food(ant, food):
-    # Food is a circle with position and radius
-    # Ant "collides" (detects) food if it is in its search 'cone' in direction its facing
-    ant_pos = ant.position.copy()
-    food_pos = food.position.copy()
+def vectors(items, n):
+    # (n, 2) array of n Vector2s, read without making a tuple per vector
+    return np.fromiter(itertools.chain.from_iterable(items), np.float64, 2 * n).reshape(n, 2)
 
-    distance = ant_pos.distance_to(food_pos)
 
-    if distance > ant.f_radius:
-        return False
+def rect_box(rect, margin):
+    # Bounds of a rect grown by margin on every side
+    return rect.left - margin, rect.top - margin, rect.right + margin, rect.bottom + margin
 
-    dir_to = food_pos - ant_pos
-    dir_to.normalize_ip()
-    angle = dir_to.angle_to(ant.velocity)
 
-    if angle < -180:
-        angle = 360 + angle
-    if angle > 180:
-        angle = 360 - angle
+def touches_food(ant, food):
+    # Ants pick up food with their body, not their image rect
+    return ant.body.colliderect(food.rect)
 
-    return -ant.viewAngle <= angle <= ant.viewAngle
 
-
-def ant_detect_pheromone(ant, pheromone):
-    # Food is a circle with position and radius
-    # Ant "collides" (detects) food if it is in its search 'cone' in direction its facing
-    ant_pos = ant.position.copy()
-    p_pos = pheromone.position.copy()
-
-    distance = ant_pos.distance_to(p_pos)
-
-    if distance > ant.p_radius:
-        return False
-
-    dir_to = p_pos - ant_pos
-    dir_to.normalize_ip()
-    angle = dir_to.angle_to(ant.velocity)
-
-    if angle < -180:
-        angle = 360 + angle
-    if angle > 180:
-        angle = 360 - angle
-
-    return -ant.viewAngle <= angle <= ant.viewAngle
+def in_hill(ant, hill):
+    # pygame.sprite.collide_circle, on the centres of the bodies
+    dx = ant.body.centerx - hill.body.centerx
+    dy = ant.body.centery - hill.body.centery
+    return dx * dx + dy * dy <= (ant.radius + hill.radius) ** 2
 
 
 class Environment:
 
-    def __init__(self, position, num_ants):
+    def __init__(self, position, num_ants, clock=None, seed=None, headless=False, field_cell=None, size=world_size):
         super().__init__()
 
+        # Simulation clock. Defaults to real time, pass a SimClock to step by a fixed dt
+        self.clock = clock if clock is not None else WallClock()
+        # Seeded runs give every ant its own stream so they repeat exactly
+        self.seed = seed
+        self.rng = random.Random(seed_key(seed)) if seed is not None else random
+        # Headless runs skip all images and rotation
+        self.headless = headless
+
         # Ant Hill features
         self.n = num_ants
         self.radius = 15
-        self.ant_hill = AntHill(Vector2(position[0], position[1]))
+        self.ant_hill = AntHill(Vector2(position[0], position[1]), graphics=not headless)
         self.ant_hills = pygame.sprite.GroupSingle()
         self.ant_hill.add(self.ant_hills)
 
-        # Sprite group of Ant objects
-        self.sprites = pygame.sprite.Group()
+        # Sprite groups are indexed on a grid the size of the sensing radius
+        self.cell_size = 25
+        self.size = size
+
+        # Sprite group of Ant objects. Ants are re-filed in the index after every
+        # update, so drawing only has to look at the ants in view
+        self.sprites = SpatialGroup(self.cell_size)
         for i in range(self.n):
-            new_ant = Ant(Vector2(position[0], position[1]))
+            rng = ant_random(seed, i) if seed is not None else random
+            new_ant = Ant(Vector2(position[0], position[1]), self.clock, rng, graphics=not headless)
             new_ant.add(self.sprites)
 
-        # Sprite groups of Food and Pheromones
-        self.food = pygame.sprite.Group()
+        # Sprite group of Food, kept in piles on a grid of pile_size cells, each
+        # holding an amount, found by cell in piles
+        self.food = SpatialGroup(self.cell_size)
+        self.pile_size = 4
+        self.piles = {}
+        self.food_version = 0  # Counts piles added and removed, so copies of the food can tell when they are out of date
         self.p_time = 10.0  # time in seconds that pheromones last on screen
-        self.pheromones_home = pygame.sprite.Group()
-        self.pheromones_food = pygame.sprite.Group()
+
+        # Pheromones of both kinds, tagged HOME or FOOD, in the order they were placed.
+        # They all last p_time, so that is also the order they expire in, and how faded
+        # they are is worked out from their end time when sensed or drawn. Past
+        # pheromones.max_count the oldest are dropped. With graphics they are also
+        # indexed by cell, so drawing only reads the ones in view
+        self.pheromones = PointQueue(max_count=50000, index_cell=None if headless else self.cell_size)
+        self.pheromone_sensing = 'centroid'  # How ants pick a pheromone to follow, or 'nearest'
+
+        # With field_cell set, pheromones are stored in a dense grid with cells of
+        # that size instead, and the queue above stays empty
+        self.field = None
+        if field_cell is not None:
+            self.field = PheromoneField(size, field_cell, self.p_time)
+        self.t0 = self.clock.now()
+
+        # Walls, an obstacles.ObstacleMap with cells of obstacle_cell made on the first one placed
+        self.obstacles = None
+        self.obstacle_cell = 2
+
+        # All pheromones are drawn through one surface, made on the first show.
+        # Zoomed views are drawn on view first
+        self.layer = None
+        self.view = None
+        self.obstacle_layer = ObstacleLayer(orange)
+
+        # Set to a profiler.Profiler to time each phase of update and show
+        self.profiler = None
+
+        # Set to a record.Recorder to log every step and food placement for replay
+        self.recorder = None
+
+        # Set to a trajectory.TrajectoryRecorder to stream ant positions to disk after each update
+        self.trajectory = None
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def pile_key(self, position):
+        # Pile grid cell of a position
+        return int(math.floor(position[0] / self.pile_size)), int(math.floor(position[1] / self.pile_size))
+
+    def add_pile(self, pile):
+        # Add a Food pile, in place of any pile already in its cell
+        key = self.pile_key(pile.position)
+        old = self.piles.get(key)
+        if old is not None:
+            old.kill()
+        self.piles[key] = pile
+        pile.add(self.food)
+        self.food_version += 1
+
+    def add_food(self, position, color=green, amount=1):
+        """
+        Add amount of food to the pile under position, starting a new pile in
+        the middle of its cell if there is none. Goes through the recorder so
+        runs can be replayed.
+        """
+        if self.recorder is not None:
+            self.recorder.food(position[0], position[1], amount)
+        key = self.pile_key(position)
+        pile = self.piles.get(key)
+        if pile is None:
+            centre = Vector2((key[0] + 0.5) * self.pile_size, (key[1] + 0.5) * self.pile_size)
+            pile = Food(centre, color, self.rng, amount=0)
+            self.add_pile(pile)
+        pile.amount += amount
+        return pile
+
+    def add_food_map(self, amounts, origin=(0, 0), color=green):
+        """
+        Load a whole food map in one call. amounts is a 2D array indexed
+        [row, column] of food per pile cell, with its top left cell at origin.
+        See foodmap.food_map to make one from an image.
+        """
+        rows, cols = np.nonzero(amounts)
+        for r, c, amount in zip(rows, cols, amounts[rows, cols]):
+            x = origin[0] + (c + 0.5) * self.pile_size
+            y = origin[1] + (r + 0.5) * self.pile_size
+            self.add_food((x, y), color, int(amount))
+
+    def take_food(self, pile):
+        # Take one piece of food from a pile, removing the pile once it is empty
+        pile.amount -= 1
+        if pile.amount <= 0:
+            del self.piles[self.pile_key(pile.position)]
+            self.food.remove(pile)
+            self.food_version += 1
+
+    def obstacle_map(self):
+        # The ObstacleMap over the world, made if there is none yet
+        if self.obstacles is None:
+            self.obstacles = ObstacleMap(self.size, self.obstacle_cell)
+        return self.obstacles
+
+    def paint_obstacle(self, position, radius, solid=True):
+        """
+        Make a disc of the world a wall, or open it again with solid=False.
+        Goes through the recorder so runs can be replayed.
+        """
+        if self.recorder is not None:
+            self.recorder.obstacle(position[0], position[1], radius, solid)
+        self.obstacle_map().paint(position, radius, solid)
+
+    def add_obstacle_map(self, mask, origin=(0, 0)):
+        """
+        Load walls in one call. mask is a 2D bool array indexed [row, column]
+        of obstacle cells, with its top left cell at origin. See
+        foodmap.load_mask to make one from an image.
+        """
+        if self.recorder is not None:
+            self.recorder.obstacle_mask(origin[0], origin[1], mask)
+        self.obstacle_map().paint_mask(mask, origin)
 
     def place_pheromone(self, ant):
         if ant.time_to_place_pheromone():
-            ant.t_last_p = pygame.time.get_ticks() / 1000.0
+            ant.t_last_p = self.clock.now()
 
-            if ant.holding_food:
-                pheromone = Pheromone(ant.position, red, self.p_time)
-                pheromone.add(self.pheromones_food)
+            kind = FOOD if ant.holding_food else HOME
+            if self.field is not None:
+                self.field.deposit(kind, ant.position)
             else:
-                pheromone = Pheromone(ant.position, blue, self.p_time)
-                pheromone.add(self.pheromones_home)
+                self.pheromones.push(ant.position, ant.t_last_p + self.p_time, kind)
 
         else:
             pass
 
+    def sense(self, ants):
+        """
+        Sense food and pheromones for all ants in one batch. Returns a dict of
+        (targets, found) arrays keyed by HOME, FOOD and 'food', where ants
+        holding food only sense HOME and the others only FOOD and 'food'.
+        Ants see the nearest pile, and either the strongest field cell or the
+        centre of the pheromones in view weighted by what is left of them.
+        """
+        n = len(ants)
+        position = vectors((ant.position for ant in ants), n)
+        velocity = vectors((ant.velocity for ant in ants), n)
+        p_radius = np.fromiter((ant.p_radius for ant in ants), np.float64, n)
+        f_radius = np.fromiter((ant.f_radius for ant in ants), np.float64, n)
+        view_angle = np.fromiter((ant.viewAngle for ant in ants), np.float64, n)
+        holding = np.fromiter((ant.holding_food for ant in ants), bool, n)
+
+        # Points are indexed on a finer grid than the sprite groups, so fewer out of reach get tested
+        cell = self.cell_size / 2
+        now = self.clock.now()
+        sensed = {}
+        for kind, ask in ((HOME, holding), (FOOD, ~holding), ('food', ~holding)):
+            idx = np.flatnonzero(ask)
+            radius = f_radius[idx] if kind == 'food' else p_radius[idx]
+            if kind == 'food':
+                index = PointIndex(vectors((pile.position for pile in self.food), len(self.food)), cell)
+                found = index.query_cone(position[idx], velocity[idx], radius, view_angle[idx])[:2]
+            elif self.field is not None:
+                found = self.field.sense(kind, position[idx], velocity[idx], radius, view_angle[idx])
+            else:
+                points, end = self.pheromones.items(kind)
+                index = PointIndex(points, cell, (end - now) / self.p_time)
+                found = index.query_cone(position[idx], velocity[idx], radius, view_angle[idx],
+                                         self.pheromone_sensing)[:2]
+
+            # Spread back out to one row per ant
+            targets = np.zeros((n, 2))
+            seen = np.zeros(n, dtype=bool)
+            targets[idx], seen[idx] = found
+            sensed[kind] = (targets, seen)
+        return sensed
+
+    def sensed_target(self, i, kind):
+        # Position sensed by the i-th ant for kind (HOME, FOOD or 'food'), or None
+        targets, found = self.sensed[kind]
+        return Vector2(*targets[i]) if found[i] else None
+
     def update(self):
         # Update driver for the simulation. Update all ants
-        for ant in self.sprites:
+        prof = self.profiler
+        t = perf_counter() if prof else 0.0
+
+        # The clock has moved on since the last update, so pheromones that ran out are
+        # dropped before sensing, where they would weigh in with a negative weight.
+        # Only the expired ones at the head of the queue are looked at
+        self.pheromones.expire(self.clock.now())
+        if prof:
+            t = prof.lap('decay', t)
+
+        ants = self.sprites.sprites()
+        self.sensed = self.sense(ants)
+        if prof:
+            t = prof.lap('sensing', t)
+
+        for i, ant in enumerate(ants):
             # Place pheromones
             self.place_pheromone(ant)
+            if prof:
+                t = prof.lap('pheromones', t)
 
             # Update ant desired direction
             # If holding food, target blue pheromones, then home, then wander.
             if ant.holding_food:
                 # Check if ant is inside ant hill
-                intersect_hill = pygame.sprite.collide_circle(ant, self.ant_hill)
+                intersect_hill = in_hill(ant, self.ant_hill)
                 if intersect_hill:
                     # Drop the food, and target centre of hill
                     ant.holding_food = False
@@ -109,46 +286,119 @@ class Environment:
 
                 else:
                     # Otherwise target next closest blue pheromone
-                    pheromone = pygame.sprite.spritecollideany(ant, self.pheromones_home, collided=ant_detect_pheromone)
+                    pheromone = self.sensed_target(i, HOME)
                     if pheromone is not None:
-                        ant.target = pheromone.position.copy()
+                        ant.target = pheromone
 
             else:
                 # If not targetting food, and not holding food, try targetting food
-                food = pygame.sprite.spritecollideany(ant, self.food, collided=ant_detect_food)
-                if food is not None:
-                    ant.target = food.position.copy()
-                else:
-                    ant.target = None
+                ant.target = self.sensed_target(i, 'food')
 
                 if ant.target is None:
                     # Target next closest pheromone
-                    pheromone = pygame.sprite.spritecollideany(ant, self.pheromones_food, collided=ant_detect_pheromone)
+                    pheromone = self.sensed_target(i, FOOD)
                     if pheromone is not None:
-                        ant.target = pheromone.position.copy()
+                        ant.target = pheromone
                     else:
                         ant.target = None
 
-                food_collide = pygame.sprite.spritecollideany(ant, self.food)
+                # Food rects are 4x4 around their position
+                food_collide = self.food.collideany(ant, rect_box(ant.body, 2), touches_food)
                 if food_collide is not None:
                     ant.holding_food = True
-                    self.food.remove(food_collide)
+                    self.take_food(food_collide)
+
+            if prof:
+                t = prof.lap('sensing', t)
 
             # Update ant position by following a target or wandering
             if ant.target is not None:
-                ant.follow_target()
+                ant.follow_target(self.obstacles)
             else:
-                ant.wander()
+                ant.wander(self.obstacles)
+
+            if prof:
+                t = prof.lap('steering', t)
 
         # Update sprite images
         self.sprites.update()
-        self.pheromones_food.update()
-        self.pheromones_home.update()
-
-    def show(self, screen):
-        self.pheromones_food.draw(screen)
-        self.pheromones_home.draw(screen)
-        self.food.draw(screen)
-        self.sprites.draw(screen)
-        self.ant_hills.draw(screen)
-
+        self.sprites.refresh()
+        if prof:
+            t = prof.lap('sprites', t)
+
+        now = self.clock.now()
+        if self.field is not None:
+            self.field.decay(now - self.t0)
+        self.t0 = now
+        if prof:
+            prof.lap('decay', t)
+
+        if self.trajectory is not None:
+            self.trajectory.capture(self)
+
+    def step(self, dt=None):
+        # Advance the clock by dt seconds and run one update
+        if self.recorder is not None:
+            self.recorder.step(dt if dt is not None else self.clock.dt)
+        self.clock.step(dt)
+        self.update()
+
+    def show(self, screen, camera=None):
+        """
+        Draw the part of the world seen by camera, or the world from (0, 0)
+        at full size without one. Only sprites and pheromones in view are looked at.
+        """
+        prof = self.profiler
+        t = perf_counter() if prof else 0.0
+
+        if camera is None:
+            zoom = 1.0
+            size = screen.get_size()
+            origin = (0, 0)
+        else:
+            zoom = camera.zoom
+            size = camera.size()
+            origin = camera.topleft()
+
+        # Away from zoom 1 the view is drawn at world scale, then scaled onto the screen
+        target = screen
+        if zoom != 1.0:
+            if self.view is None or self.view.get_size() != size:
+                self.view = pygame.Surface(size)
+            target = self.view
+            target.fill(bckgrnd)
+
+        if self.layer is None or self.layer.size != size:
+            self.layer = PheromoneLayer(size)
+
+        # Sprites are found by position, and their images reach this far past it
+        x0, y0 = origin
+        x1, y1 = x0 + size[0], y0 + size[1]
+        margin = self.cell_size
+        bounds = (x0 - margin, y0 - margin, x1 + margin, y1 + margin)
+
+        def visible(group):
+            return group.query_bounds(*bounds)
+
+        self.layer.clear()
+        if self.field is not None:
+            self.layer.add_field(self.field, origin)
+        else:
+            now = self.clock.now()
+            for kind in (FOOD, HOME):
+                points, end = self.pheromones.query_bounds(*bounds, tag=kind)
+                self.layer.add_trail(kind, points, end, now, self.p_time, origin)
+        self.layer.draw(target)
+        if self.obstacles is not None:
+            self.obstacle_layer.draw(target, self.obstacles, origin)
+
+        offset = (-x0, -y0)
+        target.blits([(s.image, s.rect.move(offset)) for s in visible(self.food)], doreturn=False)
+        target.blits([(s.image, s.rect.move(offset)) for s in visible(self.sprites)], doreturn=False)
+        target.blit(self.ant_hill.image, self.ant_hill.rect.move(offset))
+
+        if target is not screen:
+            pygame.transform.scale(target, screen.get_size(), screen)
+
+        if prof:
+            prof.lap('show', t)
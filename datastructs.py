@@ -149,60 +149,126 @@ class Box:
         return x_overlap and y_overlap
 
 
-# this is because dict.setdefault does not work.
-def dict_setdefault(D, k, d):
-    # D.setdefault(k[,d]) -&gt; D.get(k,d), also set D[k]=d if k not in D
-    r = D.get(k,d)
-    if k not in D:
-        D[k] = d
-    return r
-
-
 class HashMap(object):
     """
     Hashmap is a spatial index which can be used for a broad-phase
     collision detection strategy.
+
+    Items are stored by handle: add returns an int that is later used to
+    move or remove the item. Each cell keeps a list of its items and a
+    parallel list of their handles, so removal swaps the last item into the
+    gap instead of searching, and cells are dropped once empty. Queries
+    only read, they never create cells.
     """
 
     def __init__(self, cell_size):
         self.cell_size = cell_size
-        self.grid = {}
+        self.grid = {}  # (column, row) -> [items, handles]
+
+        # Item, cell and position in the cell of every handle. Free handles are reused
+        self.items = []
+        self.cells = []
+        self.slots = []
+        self.free = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
 
     def key(self, point):
+        # Cell (column, row) of point
         cell_size = self.cell_size
-        return (
-            int((math.floor(point[0] / cell_size)) * cell_size),
-            int((math.floor(point[1] / cell_size)) * cell_size)
-        )
+        return int(math.floor(point[0] / cell_size)), int(math.floor(point[1] / cell_size))
+
+    def _file(self, h, key):
+        cell = self.grid.get(key)
+        if cell is None:
+            cell = self.grid[key] = [[], []]
+        self.cells[h] = key
+        self.slots[h] = len(cell[1])
+        cell[0].append(self.items[h])
+        cell[1].append(h)
+
+    def _unfile(self, h):
+        key = self.cells[h]
+        items, handles = self.grid[key]
+        slot = self.slots[h]
+        last = handles.pop()
+        item = items.pop()
+        if last != h:
+            items[slot] = item
+            handles[slot] = last
+            self.slots[last] = slot
+        elif not handles:
+            del self.grid[key]
+
+    def add(self, item, point):
+        """
+        File item at point and return its handle
+        """
+        if self.free:
+            h = self.free.pop()
+            self.items[h] = item
+        else:
+            h = len(self.items)
+            self.items.append(item)
+            self.cells.append(None)
+            self.slots.append(0)
+        self._file(h, self.key(point))
+        self.count += 1
+        return h
+
+    def remove(self, handle):
+        self._unfile(handle)
+        self.items[handle] = None
+        self.cells[handle] = None
+        self.free.append(handle)
+        self.count -= 1
+
+    def move(self, handle, point):
+        """
+        Re-file an item after it moved. Nothing changes while it stays in its cell
+        """
+        key = self.key(point)
+        if key != self.cells[handle]:
+            self._unfile(handle)
+            self._file(handle, key)
+
+    def clear(self):
+        self.__init__(self.cell_size)
 
-    def insert(self, point: Vector2):
+    def insert(self, point: Vector2, item=None):
         """
-        Insert point into the hashmap.
+        Insert point into the hashmap. If item is given it is stored in the
+        cell of point instead of the point itself. Returns its handle.
         """
-        # self.grid.setdefault(self.key(point), []).append(point)
-        self.grid.setdefault(self.key((point.x, point.y)), []).append(point)
+        return self.add(point if item is None else item, (point.x, point.y))
 
-    def delete(self, point: Vector2):
+    def delete(self, point: Vector2, item=None):
         """
-        Delete point in the hashmap
+        Delete point in the hashmap, or the item stored at point
         """
-        points = self.grid.setdefault(self.key((point.x, point.y)), [])
-        for i, p in enumerate(points):
-            if p == point:
-                del points[i]
-                break
+        cell = self.grid.get(self.key((point.x, point.y)))
+        if cell is None:
+            return False
+        for p, h in zip(*cell):
+            if (p is item) if item is not None else (p == point):
+                self.remove(h)
+                return True
+        return False
 
     def query_vec(self, point: Vector2):
         """
         Return all objects in the cell specified by point.
         """
-        return self.grid.setdefault(self.key((point.x, point.y)), [])
+        return self.query_point((point.x, point.y))
 
     def query_point(self, point: tuple):
         """
         Return all objects in the cell specified by point
         """
-        return self.grid.setdefault(self.key(point), [])
+        cell = self.grid.get(self.key(point))
+        return list(cell[0]) if cell is not None else []
 
     def query_box(self, boundary: Box):
         """
@@ -210,184 +276,710 @@ class HashMap(object):
         """
         top_left = boundary.top_left
         bot_right = boundary.bot_right
+        return self.query_bounds(top_left.x, top_left.y, bot_right.x, bot_right.y)
 
-        # Generate spatial index keys for all box corners
-        top_left_key = self.key((top_left.x, top_left.y))
-        bot_right_key = self.key((bot_right.x, bot_right.y))
-
-        # Iterate over all possible keys within the box, and add their contained points to the list
-        minx, miny = top_left_key
-        maxx, maxy = bot_right_key
+    def query_bounds(self, x0, y0, x1, y1):
+        """
+        Same as query_box, with the box given as its min and max coordinates
+        """
+        # Cell coordinates of the box corners
+        cell_size = self.cell_size
+        minx = math.floor(x0 / cell_size)
+        miny = math.floor(y0 / cell_size)
+        maxx = math.floor(x1 / cell_size)
+        maxy = math.floor(y1 / cell_size)
 
+        # Boxes covering more cells than are filled walk the filled cells instead
+        grid = self.grid
         points = []
-        for i in range(minx, maxx+1):
-            for j in range(miny, maxy+1):
-                # print(self.key((i, j)))
-                points = points + self.query_point((i, j))
-
+        if (maxx - minx + 1) * (maxy - miny + 1) > len(grid):
+            for (i, j), cell in grid.items():
+                if minx <= i <= maxx and miny <= j <= maxy:
+                    points.extend(cell[0])
+            return points
+
+        # Iterate over all cells within the box, and add their contained points to the list
+        get = grid.get
+        for i in range(minx, maxx + 1):
+            for j in range(miny, maxy + 1):
+                cell = get((i, j))
+                if cell is not None:
+                    points.extend(cell[0])
         return points
 
     def query_radius(self, centre, radius):
-        minx = centre.x - radius
-        miny = centre.y - radius
-        maxx = centre.x + radius
-        maxy = centre.y + radius
-        points = self.query_box(Box(Vector(minx, miny), Vector(maxx, maxy)))
-
+        points = self.query_bounds(centre.x - radius, centre.y - radius, centre.x + radius, centre.y + radius)
         return [p for p in points if centre.distance_to(p) <= radius]
 
 
-class QTree:
-    """ A class implementing a Quad Tree. """
+class SpatialGroup(pygame.sprite.Group):
+    """
+    Sprite group that also keeps its sprites in a HashMap by position, so
+    collision checks only look at sprites in nearby cells. Sprites that
+    move must be re-filed with refresh before the index is queried.
+    """
 
-    def __init__(self, boundary: Box):
-        self.max_points = 10
+    def __init__(self, cell_size, *sprites):
+        self.index = HashMap(cell_size)
+        self.handles = {}  # Sprite -> its handle in index
+        super().__init__(*sprites)
 
-        # This QTree nodes boundary
-        self.box = boundary
+    def add_internal(self, sprite, layer=None):
+        self.handles[sprite] = self.index.add(sprite, sprite.position)
+        super().add_internal(sprite)
 
-        # List of point objects contained in this QTree node. Maximum of node_capacity
-        self.points = []
-        self.divided = False
+    def remove_internal(self, sprite):
+        self.index.remove(self.handles.pop(sprite))
+        super().remove_internal(sprite)
 
-    def search(self, p):
-        # Find if point p exists in this quadtree
-        if not self.box.contains(p):
-            return False
+    def refresh(self):
+        # Move sprites that left their cell since they were filed
+        move = self.index.move
+        for sprite, h in self.handles.items():
+            move(h, sprite.position)
 
-        # Check all points in this quadtree
-        if len(self.points) > 0:
-            for d in self.points:
-                if d.x == p.x and d.y == p.y:
-                    return True
+    def query_box(self, boundary: Box):
+        return self.index.query_box(boundary)
 
-        # Check all points in sub trees
-        if self.divided:
-            return (self.nw.search(p) or
-                    self.ne.search(p) or
-                    self.sw.search(p) or
-                    self.se.search(p))
+    def query_bounds(self, x0, y0, x1, y1):
+        return self.index.query_bounds(x0, y0, x1, y1)
 
-        # No point found
-        else:
-            return False
+    def collideany(self, sprite, bounds, collided=None):
+        """
+        Same as pygame.sprite.spritecollideany, but only checks sprites in
+        the cells overlapping bounds, given as (minx, miny, maxx, maxy)
+        """
+        if not self.spritedict:
+            return None
+
+        for other in self.index.query_bounds(*bounds):
+            if collided is None:
+                if sprite.rect.colliderect(other.rect):
+                    return other
+            elif collided(sprite, other):
+                return other
+        return None
+
+
+def _radix_argsort(ids, limit):
+    # Stable argsort of ints in [0, limit), 16 bits at a time. NumPy sorts
+    # 16 bit keys with a radix sort, so every pass is linear
+    order = np.argsort((ids & 0xFFFF).astype(np.uint16), kind='stable')
+    shift = 16
+    while limit > 1 << shift:
+        order = order[np.argsort(((ids[order] >> shift) & 0xFFFF).astype(np.uint16), kind='stable')]
+        shift += 16
+    return order
+
+
+class PointIndex:
+    """
+    Fixed set of points bucketed by grid cell in flat arrays, the NumPy
+    counterpart of HashMap for queries from many ants in one batch. Build a
+    new one when the points change, which is a counting sort over the cells
+    the points cover and fast enough to do every tick.
+    """
 
-    def insert(self, point):
-        # ignore points that cannot be placed in this QTree
-        if not self.box.contains(point) or self.search(point):
-            return False
+    def __init__(self, points, cell_size, weights=None):
+        self.cell_size = cell_size
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cx = np.floor(points[:, 0] / cell_size).astype(np.int64)
+        cy = np.floor(points[:, 1] / cell_size).astype(np.int64)
+
+        # Cells are numbered row by row over the block of cells the points cover
+        if len(points):
+            self.lo = np.array([cx.min(), cy.min()])
+            self.shape = np.array([cx.max(), cy.max()]) - self.lo + 1
+        else:
+            self.lo = np.zeros(2, dtype=np.int64)
+            self.shape = np.zeros(2, dtype=np.int64)
+        ids = (cy - self.lo[1]) * self.shape[0] + (cx - self.lo[0])
+
+        # Points sorted by cell, so each cell is one run of the arrays, with the run of
+        # cell i at starts[i]:starts[i + 1]. Sparse points keep only the sorted ids and
+        # find runs by binary search instead of a table the size of the block.
+        # order maps a sorted point back to its row in points
+        cell_count = int(self.shape[0] * self.shape[1])
+        self.order = _radix_argsort(ids, cell_count)
+        if cell_count <= 16 * len(points) + (1 << 16):
+            self.starts = np.zeros(cell_count + 1, dtype=np.intp)
+            np.cumsum(np.bincount(ids, minlength=cell_count), out=self.starts[1:])
+            self.ids = None
+        else:
+            self.starts = None
+            self.ids = ids[self.order]
+        self.xs = points[self.order, 0]
+        self.ys = points[self.order, 1]
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)[self.order]
 
-        # If there is still space in this QTree, add it
-        if len(self.points) < self.max_points:
-            self.points.append(point)
-            return True
+    def __len__(self):
+        return len(self.order)
+
+    def _runs(self, cx, cy):
+        # First sorted point and point count of each cell (cx, cy), for arrays of cells
+        x, y = cx - self.lo[0], cy - self.lo[1]
+        inside = (x >= 0) & (x < self.shape[0]) & (y >= 0) & (y < self.shape[1])
+        ids = np.where(inside, y * self.shape[0] + x, 0)
+        if self.starts is not None:
+            first = self.starts[ids]
+            counts = self.starts[ids + 1] - first
+        else:
+            first = np.searchsorted(self.ids, ids, 'left')
+            counts = np.searchsorted(self.ids, ids, 'right') - first
+        return first, np.where(inside, counts, 0)
 
-        # No room: divide into sub-trees if possible
-        if self.divided is False:
-            self.subdivide()
+    def query_bounds(self, x0, y0, x1, y1):
+        """
+        Rows in points of the points in cells intersecting the box
+        """
+        if len(self.order) == 0:
+            return np.zeros(0, dtype=np.intp)
+        cs = self.cell_size
+        cx, cy = np.meshgrid(np.arange(math.floor(x0 / cs), math.floor(x1 / cs) + 1),
+                             np.arange(math.floor(y0 / cs), math.floor(y1 / cs) + 1))
+        first, counts = self._runs(cx.ravel(), cy.ravel())
+        total = int(counts.sum())
+        ends = np.cumsum(counts)
+        return self.order[np.repeat(first - (ends - counts), counts) + np.arange(total)]
+
+    def _stencil(self, radius):
+        # Cell offsets that can hold a point within radius of a point in the centre cell
+        k = int(math.ceil(radius / self.cell_size))
+        dy, dx = np.mgrid[-k:k + 1, -k:k + 1]
+        reach = (np.maximum(np.abs(dx) - 1, 0) ** 2 + np.maximum(np.abs(dy) - 1, 0) ** 2) * self.cell_size ** 2
+        keep = reach <= radius * radius
+        return dx[keep], dy[keep]
+
+    def query_cone(self, positions, velocities, radius, view_angle, mode='nearest'):
+        """
+        For every ant find the points within radius and inside the view cone
+        of +-view_angle degrees around its velocity. radius and view_angle
+        are scalars or one value per ant.
+
+        mode 'nearest' picks the closest point, 'centroid' the average of
+        the points weighted by weights. Returns (targets, found, index): the
+        (N, 2) targets, a mask of the ants that saw anything, and the row in
+        points each ant picked, or -1 for none and in centroid mode.
+        """
+        if mode not in ('nearest', 'centroid'):
+            raise ValueError("unknown mode {!r}".format(mode))
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 2)
+        n = positions.shape[0]
+
+        targets = np.zeros((n, 2))
+        found = np.zeros(n, dtype=bool)
+        index = np.full(n, -1, dtype=np.intp)
+        if n == 0 or len(self.order) == 0:
+            return targets, found, index
+
+        # Per ant constants of the tests: squared radius, and |v|^2 cos|cos| of the view angle
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), (n,))
+        c = np.cos(np.radians(np.broadcast_to(np.asarray(view_angle, dtype=np.float64), (n,))))
+        r2 = radius * radius
+        cone = np.einsum('ij,ij->i', velocities, velocities) * c * np.abs(c)
+
+        dx, dy = self._stencil(float(radius.max()))
+        cx, cy = np.floor(positions / self.cell_size).astype(np.int64).T
+
+        # Work in chunks so the (ants x cells) temporaries stay small
+        chunk = max(1, (1 << 16) // dx.size)
+        for start in range(0, n, chunk):
+            ants = np.arange(start, min(start + chunk, n))
+            first, counts = self._runs((cx[ants, None] + dx).ravel(), (cy[ants, None] + dy).ravel())
+            total = int(counts.sum())
+            if total == 0:
+                continue
+
+            # One (ant, point) pair per point in the cells of each ant, grouped by ant.
+            # Ant values are repeated rather than gathered since the ants come in runs
+            per_ant = counts.reshape(ants.size, dx.size).sum(axis=1)
+            ends = np.cumsum(counts)
+            q = np.repeat(first - (ends - counts), counts) + np.arange(total)
+            a = np.repeat(ants, per_ant)
+
+            # Distance test on squares first, then the cone test on the pairs left,
+            # both without sqrt or trig
+            ddx = self.xs[q] - np.repeat(positions[ants, 0], per_ant)
+            ddy = self.ys[q] - np.repeat(positions[ants, 1], per_ant)
+            dist2 = ddx * ddx + ddy * ddy
+            near = np.flatnonzero(dist2 <= np.repeat(r2[ants], per_ant))
+            a, q, ddx, ddy, dist2 = a[near], q[near], ddx[near], ddy[near], dist2[near]
+
+            # The projection on the heading must be at least |d| cos(view_angle),
+            # compared on squares with the sign kept. A point right under the ant
+            # has no direction, and would pass since 0 >= 0
+            proj = ddx * velocities[a, 0] + ddy * velocities[a, 1]
+            visible = np.flatnonzero((proj * np.abs(proj) >= dist2 * cone[a]) & (dist2 > 0))
+            if visible.size == 0:
+                continue
+            a, q = a[visible], q[visible]
+
+            if mode == 'nearest':
+                # The first pair at its ant's smallest distance, found without sorting
+                dist2 = dist2[visible]
+                runs = np.flatnonzero(np.r_[True, a[1:] != a[:-1]])
+                nearest = np.minimum.reduceat(dist2, runs)
+                hit = np.flatnonzero(dist2 == np.repeat(nearest, np.diff(np.r_[runs, a.size])))
+                hit = hit[np.r_[True, a[hit[1:]] != a[hit[:-1]]]]
+                a, q = a[hit], q[hit]
+                targets[a, 0] = self.xs[q]
+                targets[a, 1] = self.ys[q]
+                index[a] = self.order[q]
+                found[a] = True
+            else:
+                w = self.weights[q] if self.weights is not None else np.ones(q.size)
+                local = a - start
+                total_w = np.bincount(local, w, ants.size)
+                seen = total_w > 0
+                sx = np.bincount(local, w * self.xs[q], ants.size)
+                sy = np.bincount(local, w * self.ys[q], ants.size)
+                targets[ants[seen], 0] = sx[seen] / total_w[seen]
+                targets[ants[seen], 1] = sy[seen] / total_w[seen]
+                found[ants[seen]] = True
+
+        return targets, found, index
+
+
+class PointQueue:
+    """
+    Points that expire, kept in a ring buffer in the order they expire in.
+    Points must be pushed in order of their expiry time, so the expired
+    ones are always a run at the head and expire only looks at those. With
+    max_count set, pushing onto a full queue drops the oldest point first.
+    Each point carries a small integer tag, such as a pheromone kind.
+
+    With index_cell set the points are also filed in a HashMap of that cell
+    size, so query_bounds only reads the points in cells under the box.
+    """
 
-        # Try inserting into sub-trees
-        return (self.ne.insert(point) or
-                self.nw.insert(point) or
-                self.se.insert(point) or
-                self.sw.insert(point))
+    def __init__(self, max_count=None, capacity=1024, index_cell=None):
+        self.max_count = max_count
+        if max_count is not None:
+            capacity = min(capacity, max_count)
+        capacity = max(capacity, 1)
+        self.points = np.zeros((capacity, 2))
+        self.end = np.zeros(capacity)
+        self.tags = np.zeros(capacity, dtype=np.int8)
+        self.head = 0  # Slot of the oldest point
+        self.count = 0
+
+        # Points are filed in the index by their number in push order, which unlike
+        # their slot does not change when the buffer grows. first is that of the oldest
+        self.index = HashMap(index_cell) if index_cell is not None else None
+        self.handles = np.zeros(capacity, dtype=np.intp)
+        self.first = 0
+
+        # Points that ran out of time, and points dropped to stay under max_count
+        self.expired = 0
+        self.evicted = 0
 
     def __len__(self):
-        sub_len = 0
-        if self.divided:
-            sub_len = len(self.nw) + len(self.ne) + len(self.sw) + len(self.se)
-        return len(self.points) + sub_len
+        return self.count
+
+    def _slots(self):
+        # Slots of the points from oldest to newest
+        return (self.head + np.arange(self.count)) % len(self.end)
+
+    def _grow(self, needed):
+        # Move the points to bigger arrays, oldest first from slot 0
+        capacity = max(2 * len(self.end), needed)
+        if self.max_count is not None:
+            capacity = min(capacity, self.max_count)
+        slots = self._slots()
+        for name in ('points', 'end', 'tags', 'handles'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[slots]
+            setattr(self, name, new)
+        self.head = 0
+
+    def _drop(self, k):
+        # Remove the k oldest points
+        if self.index is not None:
+            for slot in (self.head + np.arange(k)) % len(self.end):
+                self.index.remove(int(self.handles[slot]))
+        self.head = (self.head + k) % len(self.end)
+        self.count -= k
+        self.first += k
+
+    def push(self, point, end, tag=0):
+        # Add a point expiring at time end
+        if self.max_count is not None and self.count >= self.max_count:
+            k = self.count - self.max_count + 1
+            self._drop(k)
+            self.evicted += k
+        if self.count == len(self.end):
+            self._grow(self.count + 1)
+        i = (self.head + self.count) % len(self.end)
+        self.points[i] = point[0], point[1]
+        self.end[i] = end
+        self.tags[i] = tag
+        if self.index is not None:
+            self.handles[i] = self.index.add(self.first + self.count, (point[0], point[1]))
+        self.count += 1
+
+    def extend(self, points, end, tags=0):
+        # Add an (N, 2) array of points at once, oldest first
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n = len(points)
+        end = np.broadcast_to(end, (n,))
+        tags = np.broadcast_to(tags, (n,))
+        if self.max_count is not None:
+            if n > self.max_count:
+                self.evicted += n - self.max_count
+                points, end, tags = points[-self.max_count:], end[-self.max_count:], tags[-self.max_count:]
+                n = self.max_count
+            k = max(self.count + n - self.max_count, 0)
+            self._drop(k)
+            self.evicted += k
+        if self.count + n > len(self.end):
+            self._grow(self.count + n)
+        slots = (self.head + self.count + np.arange(n)) % len(self.end)
+        self.points[slots] = points
+        self.end[slots] = end
+        self.tags[slots] = tags
+        if self.index is not None:
+            add = self.index.add
+            first = self.first + self.count
+            self.handles[slots] = [add(first + j, point) for j, point in enumerate(points.tolist())]
+        self.count += n
+
+    def expire(self, now):
+        """
+        Drop the points with end <= now. They are a run at the head, found
+        by binary search in the part before and after the buffer wraps.
+        Returns how many were dropped.
+        """
+        capacity = len(self.end)
+        first = min(self.count, capacity - self.head)
+        k = int(np.searchsorted(self.end[self.head:self.head + first], now, side='right'))
+        if k == first and self.count > first:
+            k += int(np.searchsorted(self.end[:self.count - first], now, side='right'))
+        self._drop(k)
+        self.expired += k
+        return k
+
+    def arrays(self):
+        # Copies of the points, their end times and tags from oldest to newest
+        slots = self._slots()
+        return self.points[slots], self.end[slots], self.tags[slots]
+
+    def items(self, tag=None):
+        # Copies of the points and their end times from oldest to newest, only those with tag if given
+        slots = self._slots()
+        if tag is not None:
+            slots = slots[self.tags[slots] == tag]
+        return self.points[slots], self.end[slots]
+
+    def query_bounds(self, x0, y0, x1, y1, tag=None):
+        """
+        Like items, but only the points in the box given by its min and max
+        coordinates. With an index only the cells under the box are read, so
+        points of those cells just outside the box are returned too. Without
+        one, or when the box covers more cells than hold points, every point
+        is looked at.
+        """
+        index = self.index
+        if index is not None:
+            cs = index.cell_size
+            cells = (math.floor(x1 / cs) - math.floor(x0 / cs) + 1) * (math.floor(y1 / cs) - math.floor(y0 / cs) + 1)
+            if cells >= len(index.grid):
+                index = None
+        if index is None:
+            slots = self._slots()
+            p = self.points[slots]
+            slots = slots[(p[:, 0] >= x0) & (p[:, 0] <= x1) & (p[:, 1] >= y0) & (p[:, 1] <= y1)]
+        else:
+            found = index.query_bounds(x0, y0, x1, y1)
+            numbers = np.sort(np.fromiter(found, dtype=np.int64, count=len(found)))
+            slots = (self.head + numbers - self.first) % len(self.end)
+        if tag is not None:
+            slots = slots[self.tags[slots] == tag]
+        return self.points[slots], self.end[slots]
+
+    def clear(self):
+        if self.index is not None:
+            self.index.clear()
+        self.head = 0
+        self.first += self.count
+        self.count = 0
+
+
+def _coords(p):
+    # (x, y) of a Vector, Vector2, tuple or array, as plain floats
+    if hasattr(p, 'x'):
+        return float(p.x), float(p.y)
+    return float(p[0]), float(p[1])
+
+
+class QNode:
+    """ One node of a QTree. Leaves hold point handles, inner nodes four children """
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'mx', 'my', 'depth', 'parent', 'items', 'children')
+
+    def __init__(self, x0, y0, x1, y1, depth, parent):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.mx = (x0 + x1) / 2
+        self.my = (y0 + y1) / 2
+        self.depth = depth
+        self.parent = parent
+        self.items = []
+        self.children = None  # (nw, ne, sw, se) once divided
+
+    def quadrant(self, x, y):
+        # Index into children of the quadrant holding (x, y)
+        return (x >= self.mx) + 2 * (y >= self.my)
 
-    def empty(self):
-        return len(self) == 0
+    def subdivide(self):
+        x0, y0, x1, y1, mx, my = self.x0, self.y0, self.x1, self.y1, self.mx, self.my
+        d = self.depth + 1
+        self.children = (QNode(x0, y0, mx, my, d, self), QNode(mx, y0, x1, my, d, self),
+                         QNode(x0, my, mx, y1, d, self), QNode(mx, my, x1, y1, d, self))
+        return self.children
 
-    def delete(self, point):
-        # If the point is not in this box then
-        if not self.box.contains(point):
-            return False
 
-        for i, d in enumerate(self.points):
-            if d.x == point.x and d.y == point.y:
-                # We have found the point
-                del self.points[i]
-                return True
+class QTree:
+    """
+    A class implementing a Quad Tree.
 
-        if self.divided:
-            deleted = (self.nw.delete(point) or
-                       self.ne.delete(point) or
-                       self.sw.delete(point) or
-                       self.se.delete(point))
+    Points are stored by handle: insert returns an int that is later used to
+    move or delete the point, and queries return handles. Coordinates live in
+    flat lists on the tree, nodes only keep lists of handles.
+    """
 
-            # Check if all children are now empty
-            if self.nw.empty() and self.ne.empty() and self.sw.empty() and self.se.empty():
-                self.divided = False
-                del self.nw
-                del self.ne
-                del self.sw
-                del self.se
+    def __init__(self, boundary: Box, capacity=10, max_depth=16):
+        self.max_points = capacity  # Points a leaf holds before it is divided
+        self.max_depth = max_depth
 
-            return deleted
+        # This QTree boundary
+        self.box = boundary
+        self.root = QNode(boundary.top_left.x, boundary.top_left.y,
+                          boundary.bot_right.x, boundary.bot_right.y, 0, None)
 
-        else:
-            # We checked all the points and none are the one we are looking for
-            return False
+        # Coordinates and leaf of every handle. Free handles are reused
+        self.xs = []
+        self.ys = []
+        self.leaf = []
+        self.free = []
+        self.count = 0
 
-    def subdivide(self):
-        # Get the x and y steps from center to edges
-        step_x = (self.box.center.x - self.box.top_left.x)
-        step_y = (self.box.center.y - self.box.top_left.y)
+        # Node stack reused by the queries
+        self._stack = []
 
-        # Create new boundary points
-        center_bottom = Vector(self.box.center.x, self.box.center.y+step_y)
-        center_top    = Vector(self.box.center.x, self.box.center.y-step_y)
-        center_left   = Vector(self.box.center.x-step_x, self.box.center.y)
-        center_right  = Vector(self.box.center.x+step_x, self.box.center.y)
+    @classmethod
+    def from_points(cls, points, boundary: Box = None, capacity=10, max_depth=16):
+        """
+        Build a tree from an (N, 2) array of points in one pass. The handle
+        of each point is its row in points.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if boundary is None:
+            lo = points.min(axis=0) if len(points) else np.zeros(2)
+            hi = points.max(axis=0) if len(points) else np.ones(2)
+            boundary = Box(Vector(lo[0], lo[1]), Vector(hi[0], hi[1]))
+
+        tree = cls(boundary, capacity, max_depth)
+        x0, y0 = tree.root.x0, tree.root.y0
+        x1, y1 = tree.root.x1, tree.root.y1
+        inside = ((points[:, 0] >= x0) & (points[:, 0] <= x1) &
+                  (points[:, 1] >= y0) & (points[:, 1] <= y1))
+        if not inside.all():
+            raise ValueError("points outside the boundary")
+
+        tree.xs = points[:, 0].tolist()
+        tree.ys = points[:, 1].tolist()
+        tree.leaf = [None] * len(points)
+        tree.count = len(points)
+
+        # Split index sets top down until they fit in a leaf
+        stack = [(tree.root, np.arange(len(points)))]
+        while stack:
+            node, idx = stack.pop()
+            if len(idx) > capacity and node.depth < max_depth:
+                p = points[idx]
+                quad = (p[:, 0] >= node.mx) + 2 * (p[:, 1] >= node.my)
+                for q, child in enumerate(node.subdivide()):
+                    stack.append((child, idx[quad == q]))
+            else:
+                node.items = idx.tolist()
+                for h in node.items:
+                    tree.leaf[h] = node
+
+        return tree
 
-        # Create the new boundaries and QTree nodes
-        self.nw = QTree(Box(self.box.top_left, self.box.center))
-        self.ne = QTree(Box(center_top, center_right))
-        self.se = QTree(Box(self.box.center, self.box.bot_right))
-        self.sw = QTree(Box(center_left, center_bottom))
+    def __len__(self):
+        return self.count
 
-        self.divided = True
+    def empty(self):
+        return self.count == 0
+
+    def contains(self, x, y):
+        root = self.root
+        return root.x0 <= x <= root.x1 and root.y0 <= y <= root.y1
+
+    def position(self, handle):
+        return self.xs[handle], self.ys[handle]
+
+    def _find_leaf(self, x, y):
+        node = self.root
+        while node.children is not None:
+            node = node.children[node.quadrant(x, y)]
+        return node
+
+    def _add(self, node, h):
+        # Put handle h in leaf node, dividing the leaf if it overflows
+        node.items.append(h)
+        self.leaf[h] = node
+        while len(node.items) > self.max_points and node.depth < self.max_depth:
+            children = node.subdivide()
+            items, node.items = node.items, []
+            for i in items:
+                child = children[node.quadrant(self.xs[i], self.ys[i])]
+                child.items.append(i)
+                self.leaf[i] = child
+            # Keep dividing only if everything landed in one child
+            node = self.leaf[h]
+            if len(node.items) != len(items):
+                break
+
+    def _remove(self, h):
+        node = self.leaf[h]
+        node.items.remove(h)
+        self.leaf[h] = None
 
-    def query_circle(self, boundary, centre, radius, found_points):
-        """Find the points in the quadtree that lie within radius of centre.
+        # Merge children back into their parent once they fit in one leaf
+        parent = node.parent
+        while parent is not None:
+            children = parent.children
+            if any(c.children is not None for c in children):
+                break
+            if sum(len(c.items) for c in children) > self.max_points:
+                break
+            for c in children:
+                for i in c.items:
+                    self.leaf[i] = parent
+                parent.items.extend(c.items)
+            parent.children = None
+            parent = parent.parent
 
-        boundary is a Box object (a square) that bounds the search circle.
-        There is no need to call this method directly: use query_radius.
+    def search(self, p):
+        # Find if point p exists in this quadtree
+        x, y = _coords(p)
+        if not self.contains(x, y):
+            return False
+        xs, ys = self.xs, self.ys
+        return any(xs[h] == x and ys[h] == y for h in self._find_leaf(x, y).items)
+
+    def insert(self, point):
         """
+        Insert point and return its handle, or None if it is outside the tree
+        """
+        x, y = _coords(point)
+        if not self.contains(x, y):
+            return None
+
+        if self.free:
+            h = self.free.pop()
+            self.xs[h] = x
+            self.ys[h] = y
+        else:
+            h = len(self.xs)
+            self.xs.append(x)
+            self.ys.append(y)
+            self.leaf.append(None)
 
-        if not self.box.intersects(boundary):
-            # If the domain of this node does not intersect the search
-            # region, we don't need to look in it for points.
+        self._add(self._find_leaf(x, y), h)
+        self.count += 1
+        return h
+
+    def delete(self, handle):
+        if self.leaf[handle] is None:
             return False
+        self._remove(handle)
+        self.free.append(handle)
+        self.count -= 1
+        return True
 
-        # Search this node's points to see if they lie within boundary
-        # and also lie within a circle of given radius around the centre point.
-        for point in self.points:
-            if (boundary.contains(point) and
-                    point.distance_to(centre) <= radius):
-                found_points.append(point)
+    def move(self, handle, point):
+        """
+        Move a point. Stays in place if it is still inside its leaf. A point
+        moved outside the tree is deleted and False is returned.
+        """
+        x, y = _coords(point)
+        node = self.leaf[handle]
+        # Half open like quadrant(), a point on a split line belongs to the right or lower
+        # leaf. Only leaves on the far edge of the tree also hold their x1 or y1
+        root = self.root
+        if ((node.x0 <= x < node.x1 or x == node.x1 == root.x1) and
+                (node.y0 <= y < node.y1 or y == node.y1 == root.y1)):
+            self.xs[handle] = x
+            self.ys[handle] = y
+            return True
 
-        # Recurse the search into this node's children.
-        if self.divided:
-            self.nw.query_circle(boundary, centre, radius, found_points)
-            self.ne.query_circle(boundary, centre, radius, found_points)
-            self.se.query_circle(boundary, centre, radius, found_points)
-            self.sw.query_circle(boundary, centre, radius, found_points)
+        self._remove(handle)
+        if not self.contains(x, y):
+            self.free.append(handle)
+            self.count -= 1
+            return False
 
-        return found_points
+        self.xs[handle] = x
+        self.ys[handle] = y
+        self._add(self._find_leaf(x, y), handle)
+        return True
 
-    def query_radius(self, centre, radius, found_points):
-        """Find the points in the quadtree that lie within radius of centre."""
+    def query_radius(self, centre, radius, found_points=None):
+        """
+        Find the handles of the points that lie within radius of centre.
+        Results are appended to found_points if given.
+        """
+        return self.query_cone(centre, None, radius, 180, found_points)
 
-        # First find the square that bounds the search circle as a Rect object.
-        top_left = Vector(centre.x - radius, centre.y - radius)
-        bot_right = Vector(centre.x + radius, centre.y + radius)
-        boundary = Box(top_left, bot_right)
+    def query_cone(self, centre, direction, radius, view_angle, found_points=None):
+        """
+        Find the handles of the points within radius of centre and at most
+        view_angle degrees away from direction. Uses dot products instead
+        of angles, and walks the tree with a reused stack.
+        """
+        if found_points is None:
+            found_points = []
+
+        cx, cy = _coords(centre)
+        r2 = radius * radius
+        cone = direction is not None and view_angle < 180
+        if cone:
+            ux, uy = _coords(direction)
+            c = math.cos(math.radians(view_angle))
+            cc = c * abs(c) * (ux * ux + uy * uy)
+
+        xs, ys = self.xs, self.ys
+        x0, y0, x1, y1 = cx - radius, cy - radius, cx + radius, cy + radius
+
+        stack = self._stack
+        stack.append(self.root)
+        while stack:
+            node = stack.pop()
+            if node.x1 < x0 or node.x0 > x1 or node.y1 < y0 or node.y0 > y1:
+                continue
+            if node.children is not None:
+                stack.extend(node.children)
+                continue
+
+            for h in node.items:
+                dx = xs[h] - cx
+                dy = ys[h] - cy
+                d2 = dx * dx + dy * dy
+                if d2 > r2:
+                    continue
+                if cone:
+                    proj = dx * ux + dy * uy
+                    if proj * abs(proj) < d2 * cc:
+                        continue
+                found_points.append(h)
 
-        return self.query_circle(boundary, centre, radius, found_points)
+        return found_points
 
 
 # hmap = HashMap(1.0)
@@ -0,0 +1,276 @@
+import math
+import numpy as np
+
+'''
+Dense pheromone store. Instead of one sprite per drop, pheromone intensity
+lives in a float32 grid per channel. Deposits add to a cell, and sensing
+samples the cells inside the ant's view cone.
+
+Every tick pheromones evaporate and, with a diffusion rate, spread to the
+neighbouring cells. The grid is split into square tiles and only tiles
+holding something above the threshold are updated, together with their
+neighbours when pheromones spread. Cells that fade below the threshold are
+cleared, and tiles left empty are skipped until something is deposited in
+them again, so the cost of a tick follows the area of the trails rather
+than the size of the map.
+'''
+
+HOME = 0
+FOOD = 1
+
+
+def channel(colony, kind):
+    # Channel of a pheromone kind (HOME or FOOD) of a colony, when several colonies share a field
+    return 2 * colony + kind
+
+
+class PheromoneField:
+    """ Home and food pheromone intensity on a regular grid """
+
+    def __init__(self, size, cell_size=4, decay_t=10.0, threshold=0.01, channels=2, origin=(0, 0),
+                 diffusion=0.0, tile=16):
+        self.cell_size = cell_size
+        self.origin = np.asarray(origin, dtype=np.float64)  # World position of the grid's top left corner
+        self.width = int(math.ceil(size[0] / cell_size))
+        self.height = int(math.ceil(size[1] / cell_size))
+
+        # Intensity per channel, indexed [channel, row (y), column (x)]
+        self.grid = np.zeros((channels, self.height, self.width), dtype=np.float32)
+
+        # A deposit of 1.0 fades below threshold after decay_t seconds,
+        # and cells below threshold are treated as empty
+        self.threshold = threshold
+        self.set_decay(decay_t)
+
+        # How fast pheromones spread, in world units squared per second
+        self.diffusion = diffusion
+
+        # Tiles of tile x tile cells that hold pheromones and need updating.
+        # When more than dense_fraction of them do, the whole grid is updated at once
+        self.tile = tile
+        self.active = np.zeros((-(-self.height // tile), -(-self.width // tile)), dtype=bool)
+        self.dense_fraction = 0.5
+
+        # Cell offsets of the sensing stencil, cached per radius
+        self._stencils = {}
+
+    def set_decay(self, decay_t):
+        self.decay_t = decay_t
+        self.rate = math.log(self.threshold) / decay_t
+
+    def __len__(self):
+        # Number of cells holding a pheromone
+        return int(np.count_nonzero(self.grid >= self.threshold))
+
+    def clear(self):
+        self.grid.fill(0.0)
+        self.active.fill(False)
+
+    def touch(self, rows=slice(None), cols=slice(None)):
+        # Mark the tiles under a block of cells for updating, after writing to grid directly
+        y0, y1, _ = rows.indices(self.height)
+        x0, x1, _ = cols.indices(self.width)
+        if y1 > y0 and x1 > x0:
+            t = self.tile
+            self.active[y0 // t:(y1 - 1) // t + 1, x0 // t:(x1 - 1) // t + 1] = True
+
+    def cells(self, positions):
+        # Grid columns and rows of an (N, 2) array of positions, and which are inside the grid
+        ij = np.floor((np.asarray(positions, dtype=np.float64) - self.origin) / self.cell_size).astype(np.intp)
+        inside = ((ij[:, 0] >= 0) & (ij[:, 0] < self.width) &
+                  (ij[:, 1] >= 0) & (ij[:, 1] < self.height))
+        return ij[:, 0], ij[:, 1], inside
+
+    def deposit(self, channel, positions, amount=1.0):
+        """
+        Add amount of pheromone at each position. positions is a single
+        (x, y) point or an (N, 2) array, channel one channel or one per
+        position. Points outside the grid are dropped.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        ix, iy, inside = self.cells(positions)
+        ix, iy = ix[inside], iy[inside]
+        if np.ndim(channel) == 0:
+            np.add.at(self.grid[channel], (iy, ix), amount)
+        else:
+            np.add.at(self.grid, (np.asarray(channel)[inside], iy, ix), amount)
+        self.active[iy // self.tile, ix // self.tile] = True
+
+    def decay(self, dt):
+        """
+        Evaporate and spread the pheromones over dt seconds, in the active
+        tiles only
+        """
+        # Explicit diffusion is only stable up to a quarter of the difference
+        # per step, so long steps are split
+        k = self.diffusion * dt / self.cell_size ** 2
+        steps = max(1, int(math.ceil(k / 0.2)))
+        k /= steps
+        f = math.exp(self.rate * dt / steps)
+
+        for _ in range(steps):
+            tiles = self.active
+            if k > 0:
+                # Pheromones spread into the tiles around active ones
+                tiles = tiles.copy()
+                tiles[1:] |= self.active[:-1]
+                tiles[:-1] |= self.active[1:]
+                rows = tiles.copy()
+                tiles[:, 1:] |= rows[:, :-1]
+                tiles[:, :-1] |= rows[:, 1:]
+
+            count = np.count_nonzero(tiles)
+            if count == 0:
+                return
+            if count > self.dense_fraction * tiles.size:
+                self._step_dense(k, f)
+            else:
+                self._step_tiles(np.nonzero(tiles), k, f)
+
+    def _spread(self, block, k, f):
+        # One step on blocks with a one cell border, returns the inside of the blocks
+        inner = block[..., 1:-1, 1:-1]
+        if k > 0:
+            inner = inner + np.float32(k) * (block[..., :-2, 1:-1] + block[..., 2:, 1:-1] +
+                                             block[..., 1:-1, :-2] + block[..., 1:-1, 2:] - 4 * inner)
+        return inner * np.float32(f)
+
+    def _step_dense(self, k, f):
+        # Update the whole grid. Edge cells are repeated outwards so nothing leaks off the map
+        if k > 0:
+            self.grid[...] = self._spread(np.pad(self.grid, ((0, 0), (1, 1), (1, 1)), mode='edge'), k, f)
+        else:
+            self.grid *= np.float32(f)
+
+        # Clear the cells that faded out, and find the tiles still holding something
+        self.grid[self.grid < self.threshold] = 0
+        t = self.tile
+        strongest = self.grid.max(axis=0)
+        strongest = np.maximum.reduceat(strongest, np.arange(0, self.height, t), axis=0)
+        strongest = np.maximum.reduceat(strongest, np.arange(0, self.width, t), axis=1)
+        self.active = strongest >= self.threshold
+
+    def _step_tiles(self, tiles, k, f):
+        # Update the given tiles, each read with a one cell border from its neighbours
+        t = self.tile
+        ty, tx = tiles
+        span = np.arange(-1, t + 1)
+        rows = ty[:, None] * t + span
+        cols = tx[:, None] * t + span
+        # Borders off the map repeat the edge cells, like _step_dense
+        block = self.grid[:, np.clip(rows, 0, self.height - 1)[:, :, None],
+                          np.clip(cols, 0, self.width - 1)[:, None, :]]
+        inner = self._spread(block, k, f)
+
+        # Tiles on the right and bottom edges can hang off the map
+        rows, cols = rows[:, 1:-1, None], cols[:, 1:-1, None].transpose(0, 2, 1)
+        valid = (rows < self.height) & (cols < self.width)
+
+        # Cells that faded below the threshold are cleared, cell by cell so the result
+        # does not depend on where the tile borders are. Tiles left empty go inactive
+        inner[inner < self.threshold] = 0
+        self.active[ty, tx] = np.where(valid, inner, 0).max(axis=(0, 2, 3)) >= self.threshold
+
+        self.grid[:, np.broadcast_to(rows, valid.shape)[valid], np.broadcast_to(cols, valid.shape)[valid]] = \
+            inner[:, valid]
+
+    def reach(self, radius):
+        # How many cells away from an ant's cell sensing within radius can look
+        return int(math.ceil(radius / self.cell_size)) + 1
+
+    def _stencil(self, radius):
+        # All cell offsets that can hold a cell centre within radius of a point
+        # in the centre cell. The ant's own cell is left out
+        if radius not in self._stencils:
+            k = self.reach(radius)
+            dy, dx = np.mgrid[-k:k + 1, -k:k + 1]
+            reach = (np.maximum(np.abs(dx) - 1, 0) ** 2 + np.maximum(np.abs(dy) - 1, 0) ** 2) * self.cell_size ** 2
+            keep = (reach <= radius * radius) & ((dx != 0) | (dy != 0))
+            self._stencils[radius] = (dx[keep], dy[keep])
+        return self._stencils[radius]
+
+    def sense(self, channel, positions, velocities, radius, view_angle):
+        """
+        For every ant find the strongest cell of channel whose centre lies
+        within radius and inside the view cone of +-view_angle degrees
+        around the ant's velocity. channel, radius and view_angle are
+        scalars or one value per ant.
+
+        Returns (targets, found): the (N, 2) centres of the chosen cells and
+        a mask of the ants that sensed anything above the threshold.
+        """
+        if np.ndim(channel) == 0:
+            return self.sense_grid(self.grid[channel], positions, velocities, radius, view_angle, self.threshold)
+        return self.sense_grid(self.grid, positions, velocities, radius, view_angle, self.threshold, channel)
+
+    def sense_grid(self, grid, positions, velocities, radius, view_angle, threshold, layers=None):
+        # Same as sense, for any grid with the shape of one channel. With layers,
+        # grid has a leading channel axis and each ant reads its own layer
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 2)
+        n = positions.shape[0]
+
+        targets = np.zeros((n, 2))
+        found = np.zeros(n, dtype=bool)
+        if n == 0:
+            return targets, found
+
+        cs = self.cell_size
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), (n,))
+        cos_view = np.cos(np.radians(np.broadcast_to(np.asarray(view_angle, dtype=np.float64), (n,))))
+        sx, sy = self._stencil(float(radius.max()))
+
+        # Pad the grid so every stencil cell of an ant up to k cells outside the grid
+        # can be read with one flat index, and skip ants further out
+        k = int(max(np.abs(sx).max(), np.abs(sy).max()))
+        pad = 2 * k
+        if layers is None:
+            padded = np.pad(grid, pad)
+            base = np.zeros(n, dtype=np.intp)
+        else:
+            # Only the layers some ant reads are padded, stacked so one flat index reaches all of them
+            used, inverse = np.unique(np.broadcast_to(layers, (n,)), return_inverse=True)
+            padded = np.pad(grid[used], ((0, 0), (pad, pad), (pad, pad)))
+            base = inverse.reshape(n) * (padded.shape[1] * padded.shape[2])
+        pw = padded.shape[-1]
+        offsets = (sy + pad) * pw + (sx + pad)
+
+        ix, iy = np.floor((positions - self.origin) / cs).astype(np.intp).T
+        near = (ix >= -k) & (ix < self.width + k) & (iy >= -k) & (iy < self.height + k)
+        idx = np.nonzero(near)[0]
+
+        # Work in chunks so the (ants x stencil) temporaries stay small
+        chunk = max(1, (1 << 20) // sx.size)
+        for start in range(0, idx.size, chunk):
+            ants = idx[start:start + chunk]
+            values = padded.ravel().take((base[ants] + iy[ants] * pw + ix[ants])[:, None] + offsets)
+
+            # Only cells holding enough of something need the geometry tests
+            row, col = np.nonzero(values >= threshold)
+            if row.size == 0:
+                continue
+            a = ants[row]
+
+            # Vector from each ant to each candidate cell centre
+            dx = (ix[a] + sx[col] + 0.5) * cs + self.origin[0] - positions[a, 0]
+            dy = (iy[a] + sy[col] + 0.5) * cs + self.origin[1] - positions[a, 1]
+            dist2 = dx * dx + dy * dy
+
+            # Cone test without trig: the projection on the heading must be at least
+            # |d| cos(view_angle), compared on squares with the sign kept
+            vx, vy = velocities[a, 0], velocities[a, 1]
+            c = cos_view[a]
+            proj = dx * vx + dy * vy
+            visible = (dist2 <= radius[a] ** 2) & (
+                    proj * np.abs(proj) >= dist2 * (vx * vx + vy * vy) * c * np.abs(c))
+
+            best_values = np.zeros(values.shape, dtype=values.dtype)
+            best_values[row[visible], col[visible]] = values[row[visible], col[visible]]
+            best = np.argmax(best_values, axis=1)
+            rows = np.arange(ants.size)
+
+            found[ants] = best_values[rows, best] >= threshold
+            targets[ants, 0] = (ix[ants] + sx[best] + 0.5) * cs + self.origin[0]
+            targets[ants, 1] = (iy[ants] + sy[best] + 0.5) * cs + self.origin[1]
+
+        return targets, found
@@ -0,0 +1,49 @@
+import numpy as np
+import pygame
+
+'''
+Food maps. A food map is a 2D integer array of food per pile cell, indexed
+[row, column], that Environment.add_food_map and SwarmEnvironment.add_food_map
+load in one call. food_map makes one from an image or from an array.
+load_mask reads the walls of add_obstacle_map from an image the same way.
+'''
+
+
+def _blocks(a, cell, reduce):
+    # Reduce a [row, column] array over cell x cell blocks, dropping partial blocks at the edges
+    h, w = a.shape[0] // cell * cell, a.shape[1] // cell * cell
+    return reduce(a[:h, :w].reshape(h // cell, cell, w // cell, cell), axis=(1, 3))
+
+
+def food_map(source, max_amount=100, cell=1):
+    """
+    Food amounts from an image file, a pygame Surface or an array, with one
+    pile cell per cell x cell pixels.
+
+    Images are read by brightness: a white block is a pile of max_amount and
+    black is no food, and transparent pixels count as black. Arrays are
+    taken as amounts per pixel and summed over each block.
+    """
+    if isinstance(source, (str, bytes)):
+        source = pygame.image.load(source)
+
+    if isinstance(source, pygame.Surface):
+        # surfarray is indexed [x, y], food maps [row, column]
+        brightness = pygame.surfarray.array3d(source).mean(axis=2).T / 255.0
+        if source.get_flags() & pygame.SRCALPHA:
+            brightness *= pygame.surfarray.array_alpha(source).T / 255.0
+        amounts = np.rint(_blocks(brightness, cell, np.mean) * max_amount)
+    else:
+        amounts = _blocks(np.asarray(source), cell, np.sum)
+
+    return np.maximum(amounts, 0).astype(np.int64)
+
+
+def load_mask(source, cell=1):
+    """
+    Solid cells from an image file, a pygame Surface or an array, with one
+    cell per cell x cell pixels. Bright blocks are solid, dark and
+    transparent ones are open.
+    """
+    # A food map of at most 1 per block rounds the brightness to 0 or 1
+    return food_map(source, max_amount=1, cell=cell) > 0
@@ -0,0 +1,79 @@
+import argparse
+import time
+from parameters import fps
+from simclock import SimClock
+from classes import Environment
+from profiler import Profiler, PHASES
+import checkpoint
+from trajectory import TrajectoryRecorder
+
+'''
+Run the colony without a window, stepping a fixed dt per tick
+'''
+
+
+def build(num_ants=100, position=(250, 250), dt=1.0 / fps, seed=0, resume=None):
+    # With resume, continue the colony in that checkpoint instead of starting a new one
+    if resume is not None:
+        return checkpoint.load(resume)
+    return Environment(position, num_ants, clock=SimClock(dt), seed=seed, headless=True)
+
+
+def run(ticks, colony, profiler=None, trajectory=None):
+    colony.profiler = profiler
+    colony.trajectory = trajectory
+    for _ in range(ticks):
+        colony.step()
+        if profiler is not None:
+            profiler.end_frame()
+    return colony
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless ant colony simulation")
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--ants", type=int, default=100)
+    parser.add_argument("--dt", type=float, default=1.0 / fps)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", action="store_true", help="print per-phase timings")
+    parser.add_argument("--profile-csv", help="stream per-phase timings of every tick to this file")
+    parser.add_argument("--resume", help="continue from this checkpoint instead of a new colony")
+    parser.add_argument("--save", help="write a checkpoint of the colony here when done")
+    parser.add_argument("--trajectory", help="stream ant positions of every tick to this file")
+    parser.add_argument("--trajectory-ticks", type=int, default=1000,
+                        help="ticks the trajectory file holds before it wraps around")
+    args = parser.parse_args()
+
+    colony = build(args.ants, dt=args.dt, seed=args.seed, resume=args.resume)
+
+    profiler = None
+    if args.profile or args.profile_csv:
+        if not isinstance(colony, Environment):
+            parser.error("{} holds a swarm, --profile only times the sprite engine".format(args.resume))
+        profiler = Profiler(window=args.ticks, csv_path=args.profile_csv)
+
+    # Sized from the colony, a resumed one keeps the ant count it was saved with
+    trajectory = None
+    if args.trajectory:
+        trajectory = TrajectoryRecorder(args.trajectory, len(colony), args.trajectory_ticks)
+
+    start = time.perf_counter()
+    colony = run(args.ticks, colony, profiler=profiler, trajectory=trajectory)
+    elapsed = time.perf_counter() - start
+    if args.save:
+        checkpoint.save(colony, args.save)
+    if trajectory is not None:
+        trajectory.close()
+    # A resumed checkpoint can hold a swarm, which keeps its pheromones in the field only
+    if isinstance(colony, Environment):
+        pheromones = "{} pheromones, {} dropped over the limit".format(len(colony.pheromones),
+                                                                      colony.pheromones.evicted)
+    else:
+        pheromones = "{} pheromone cells, {} food delivered".format(len(colony.field), colony.delivered)
+    print("{} ticks in {:.2f}s ({:.0f} ticks/s), {}".format(args.ticks, elapsed, args.ticks / elapsed, pheromones))
+
+    if profiler is not None:
+        profiler.close()
+        print("{:11}{:>8}{:>8}{:>8}{:>8}".format('phase (ms)', 'mean', 'p50', 'p95', 'p99'))
+        for phase in PHASES:
+            print("{:11}{:8.3f}{:8.3f}{:8.3f}{:8.3f}".format(phase, *profiler.stats(phase)))
@@ -1,8 +1,17 @@
+import random
 import pygame
 from pygame.math import Vector2
 from parameters import *
-from objects import Food
+from simclock import SimClock
 from classes import Environment
+from profiler import Profiler
+from scheduler import Scheduler
+from camera import Camera
+from foodmap import food_map, load_mask
+from record import Recorder
+from pipeline import SimThread
+from render import SnapshotRenderer
+import checkpoint
 
 '''
 Sam Johnston
@@ -16,10 +25,51 @@ clock = pygame.time.Clock()
 
 pause = False
 
+# The simulation runs on its own clock, stepped at a fixed rate. With a seed
+# and a record_path the run is written to disk and can be replayed with record.py
+seed = None
+record_path = None
+if record_path is not None and seed is None:
+    seed = random.randrange(2 ** 31)
+
 # Sprite Groups
 n = 100
-colony_x, colony_y = 250, 250
-colony = Environment((colony_x, colony_y), n)
+colony_x, colony_y = world_size[0] / 2, world_size[1] / 2
+colony = Environment((colony_x, colony_y), n, clock=SimClock(1.0 / sim_hz), seed=seed)
+if record_path is not None:
+    Recorder.attach(colony, record_path, (colony_x, colony_y))
+
+# Set food_map_path to an image to start with its food, brighter is more food
+food_map_path = None
+if food_map_path is not None:
+    colony.add_food_map(food_map(food_map_path, cell=colony.pile_size))
+
+# Set obstacle_map_path to an image to start with its walls, bright pixels are walls
+obstacle_map_path = None
+if obstacle_map_path is not None:
+    colony.add_obstacle_map(load_mask(obstacle_map_path, cell=colony.obstacle_cell))
+
+# The colony steps at sim_hz and is drawn at the display rate. F toggles fast mode,
+# fast_speed times real time drawing every fast_render_every-th state
+scheduler = Scheduler(colony)
+fast_speed = 8
+fast_render_every = 4
+
+# With threaded set the colony steps on a worker thread instead, and the window
+# draws the newest snapshot of it while the next steps run
+threaded = False
+sim = None
+renderer = None
+if threaded:
+    sim = SimThread(colony).start()
+    renderer = SnapshotRenderer(colony.cell_size)
+
+# The window looks at the world through a camera. Arrow keys or dragging with the
+# right mouse button pan, the mouse wheel zooms
+camera = Camera(resolution, world_size)
+pan_speed = 300  # Screen pixels per second
+dragging = False
+
 # for i in range(n):
 #     ant = Ant(Vector2(colony_x, colony_y))
 #     ant.add(colony)
@@ -30,13 +80,21 @@ food_point = Vector2(-1, -1)
 pheromone_group_0 = pygame.sprite.Group()
 pheromone_group_1 = pygame.sprite.Group()
 
+# Dragging with the left mouse button places food, or paints walls after Enter.
+# Holding shift while painting walls erases them
 draw = False
 draw_food_mode = True
+brush_radius = 8
+
+# Per-phase timings, toggled with P. Set profile_csv to a path to also stream them to disk
+profile_csv = None
+
+# S saves the colony to checkpoint_path, L loads it back
+checkpoint_path = 'colony.antckp'
 
 run = True
 while run:
     if not pause:
-        screen.fill(bckgrnd)
         delta_time = clock.tick(fps)
 
         frame_rate = int(clock.get_fps())
@@ -49,25 +107,111 @@ while run:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RETURN:
                     draw_food_mode = not draw_food_mode
+                if event.key == pygame.K_p:
+                    if colony.profiler is None:
+                        colony.profiler = Profiler(csv_path=profile_csv)
+                    else:
+                        colony.profiler.close()
+                        colony.profiler = None
+                    if renderer is not None:
+                        renderer.profiler = colony.profiler
+                if event.key == pygame.K_s:
+                    if sim is not None:
+                        sim.submit(checkpoint.save, checkpoint_path)
+                    else:
+                        checkpoint.save(colony, checkpoint_path)
+                if event.key == pygame.K_l:
+                    if sim is not None:
+                        sim.stop()
+                    # A loaded colony is not the recorded run any more, so recording stops
+                    if colony.recorder is not None:
+                        colony.recorder.close()
+                    profiler = colony.profiler
+                    colony = checkpoint.load(checkpoint_path, headless=False)
+                    colony.profiler = profiler
+                    scheduler = Scheduler(colony, speed=scheduler.speed, render_every=scheduler.render_every)
+                    if sim is not None:
+                        sim = SimThread(colony, speed=sim.speed).start()
+                if event.key == pygame.K_f:
+                    if scheduler.speed == 1:
+                        scheduler.set_speed(fast_speed, fast_render_every)
+                    else:
+                        scheduler.set_speed(1)
+                    if sim is not None:
+                        sim.set_speed(scheduler.speed)
 
             if event.type == pygame.MOUSEBUTTONDOWN:
-                draw = True
+                if event.button == 1:
+                    draw = True
+                if event.button == 3:
+                    dragging = True
 
             if event.type == pygame.MOUSEBUTTONUP:
-                draw = False
+                if event.button == 1:
+                    draw = False
+                if event.button == 3:
+                    dragging = False
+
+            if event.type == pygame.MOUSEMOTION and dragging:
+                camera.pan(-event.rel[0], -event.rel[1])
+
+            if event.type == pygame.MOUSEWHEEL:
+                camera.zoom_at(1.1 ** event.y, pygame.mouse.get_pos())
+
+        keys = pygame.key.get_pressed()
+        step = pan_speed * delta_time / 1000.0
+        camera.pan((keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * step,
+                   (keys[pygame.K_DOWN] - keys[pygame.K_UP]) * step)
 
         if draw and draw_food_mode:
-            x, y = pygame.mouse.get_pos()
+            x, y = camera.to_world(pygame.mouse.get_pos())
             if x != food_point.x or y != food_point.y:
-                new_food = Food(Vector2(x, y), green)
-                new_food.add(colony.food)
+                if sim is not None:
+                    sim.call('add_food', (x, y))
+                else:
+                    colony.add_food((x, y))
                 food_point.x = x
                 food_point.y = y
 
-        colony.update()
-        food_group.draw(screen)
-        colony.show(screen)
+        if draw and not draw_food_mode:
+            x, y = camera.to_world(pygame.mouse.get_pos())
+            if x != food_point.x or y != food_point.y:
+                solid = not pygame.key.get_mods() & pygame.KMOD_SHIFT
+                if sim is not None:
+                    sim.call('paint_obstacle', (x, y), brush_radius, solid)
+                else:
+                    colony.paint_obstacle((x, y), brush_radius, solid)
+                food_point.x = x
+                food_point.y = y
+
+        if sim is not None:
+            # The worker keeps its own time, every frame draws the newest snapshot
+            screen.fill(bckgrnd)
+            renderer.draw(screen, sim.latest(), camera)
+
+            if colony.profiler is not None:
+                colony.profiler.draw(screen)
+
+            pygame.display.flip()
+        else:
+            scheduler.advance(delta_time / 1000.0)
+            if scheduler.ready():
+                screen.fill(bckgrnd)
+                food_group.draw(screen)
+                scheduler.show(screen, camera)
+
+                if colony.profiler is not None:
+                    colony.profiler.draw(screen)
+
+                pygame.display.flip()
 
-        pygame.display.flip()
+        if colony.profiler is not None:
+            colony.profiler.end_frame()
 
+if sim is not None:
+    sim.stop()
+if colony.profiler is not None:
+    colony.profiler.close()
+if colony.recorder is not None:
+    colony.recorder.close()
 pygame.quit()
\ No newline at end of file
@@ -1,4 +1,6 @@
 from parameters import *
+from assets import load_sprite
+from simclock import WallClock
 import pygame.sprite
 from pygame import Vector2
 import random
@@ -7,21 +9,74 @@ import math
 PI = math.pi
 
 
+class RotationCache:
+    """
+    Rotated copies of the ant images, keyed by (animation frame, holding food,
+    angle bucket). Angles are rounded to one of a fixed number of buckets so
+    every ant shares the same few hundred surfaces.
+    """
+
+    def __init__(self, buckets=rotation_buckets):
+        self.buckets = buckets
+        self.step = 360.0 / buckets
+        self.images = {}
+
+    def bucket(self, angle):
+        return int(round(angle / self.step)) % self.buckets
+
+    def get(self, image, frame, holding_food, angle):
+        # Rotated copy of image, made the first time its key is asked for
+        key = (frame, holding_food, self.bucket(angle))
+        rotated = self.images.get(key)
+        if rotated is None:
+            rotated = pygame.transform.rotate(image, -key[2] * self.step)
+            rotated.set_colorkey(white)
+            self.images[key] = rotated
+        return rotated
+
+    def build(self, images, food_image):
+        # Fill the whole cache up front instead of on first use
+        for b in range(self.buckets):
+            angle = b * self.step
+            for frame, image in enumerate(images):
+                self.get(image, frame, False, angle)
+            self.get(food_image, 0, True, angle)
+
+
 class Ant(pygame.sprite.Sprite):
-    def __init__(self, position: Vector2):
+    # Rotated images shared by all ants
+    rotations = RotationCache()
+
+    def __init__(self, position: Vector2, clock=None, rng=random, graphics=True):
         super().__init__()
 
-        self.images = []
-        self.images.append(ant_sprite_0)
-        self.images.append(ant_sprite_1)
-        self.images.append(ant_sprite_0)
-        self.images.append(ant_sprite_2)
-        self.index = 0
+        # Simulation clock and random number source
+        self.clock = clock if clock is not None else WallClock()
+        self.rng = rng
+        self.graphics = graphics
 
-        self.food_image = ant_sprite_f
+        self.radius = 6  # Collision radius
 
-        self.image = self.images[self.index]
-        self.rect = self.image.get_rect(center=position)
+        # Square of 2 * radius around position that every collision uses, so the simulation
+        # does not depend on the size of the rotated image. Headless ants use it as their rect
+        self.body = pygame.Rect(0, 0, 2 * self.radius, 2 * self.radius)
+        self.body.center = position
+
+        if self.graphics:
+            self.images = []
+            self.images.append(load_sprite("ant_sprite_0"))
+            self.images.append(load_sprite("ant_sprite_1"))
+            self.images.append(load_sprite("ant_sprite_0"))
+            self.images.append(load_sprite("ant_sprite_2"))
+            self.index = 0
+
+            self.food_image = load_sprite("ant_sprite_food")
+
+            self.image = self.images[self.index]
+            self.rect = self.image.get_rect(center=position)
+        else:
+            # Headless ants have no image, only the body
+            self.rect = self.body
 
         self.width = self.rect.width
         self.height = self.rect.height
@@ -30,70 +85,105 @@ class Ant(pygame.sprite.Sprite):
 
         # Position, speed and direction
         self.position = position
-        self.velocity = Vector2(random.uniform(-1.0, 1.0),
-                                random.uniform(-1.0, 1.0))
+        self.velocity = Vector2(self.rng.uniform(-1.0, 1.0),
+                                self.rng.uniform(-1.0, 1.0))
 
         # Wandering parameters
-        self.desired_direction = Vector2(random.uniform(-1.0, 1.0),
-                                         random.uniform(-1.0, 1.0))
+        self.desired_direction = Vector2(self.rng.uniform(-1.0, 1.0),
+                                         self.rng.uniform(-1.0, 1.0))
         self.desired_direction.scale_to_length(self.max_speed)
         self.wander_strength = 10 # Maximum degrees of change possible for updating desired direction
         self.steer_strength = 1.5
 
         # Last time updated
-        self.t0 = pygame.time.get_ticks() / 100.0
+        self.t0 = self.clock.now()
         # Last time placed a pheromone
-        self.t_last_p = pygame.time.get_ticks() / 1000.0
+        self.t_last_p = self.clock.now()
         self.p_interval = 0.25  # Time between each pheromone drop
 
         # For grabbing food from the map
         self.target = None
         self.holding_food = False
-        self.radius = 6  # Collision radius
         self.f_radius = 25  # Food detection radius
         self.p_radius = 25  # Pheromone detection radius
         self.viewAngle = 60  # Food detection view angle
+        self.avoid_distance = 10  # Ants steer away from walls closer than this
 
     def time_to_place_pheromone(self):
-        dt = pygame.time.get_ticks() / 1000.0 - self.t_last_p
+        dt = self.clock.now() - self.t_last_p
         return dt >= self.p_interval
 
-    def update_position(self):
-        dt = pygame.time.get_ticks() / 100.0 - self.t0
-        self.t0 = pygame.time.get_ticks() / 100.0
+    def update_position(self, obstacles=None):
+        # Motion is scaled in tenths of a second. obstacles is an obstacles.ObstacleMap or None
+        t = self.clock.now()
+        dt = (t - self.t0) * 10.0
+        self.t0 = t
+
+        # slerp(velocity, 0) is the desired direction itself, and raises when the two are opposite.
+        # Without a desired direction the ant keeps its velocity, clamp_magnitude raises on zero
+        if self.desired_direction.length_squared() > 0:
+            desired_steering_force = self.desired_direction * self.steer_strength
+            acceleration = desired_steering_force.clamp_magnitude(0, self.max_speed)
+        else:
+            acceleration = Vector2(0, 0)
 
-        desired_steering_force = self.desired_direction.slerp(self.velocity, 0) * self.steer_strength
-        acceleration = desired_steering_force.clamp_magnitude(0, self.max_speed)
+        if obstacles is not None:
+            # Steer away from walls in range, harder the closer they are
+            distance, nx, ny = obstacles.sample(self.position)
+            if distance < self.avoid_distance:
+                acceleration += Vector2(nx, ny) * (self.max_speed * (1 - distance / self.avoid_distance))
 
         self.velocity = self.velocity + acceleration * dt
         self.velocity.clamp_magnitude_ip(self.max_speed)
-        self.position = self.position + self.velocity * dt
+        position = self.position + self.velocity * dt
+
+        if obstacles is not None:
+            distance, nx, ny = obstacles.sample(position)
+            if distance < 0:
+                # Walking into a wall, stay put and bounce off it. Deep inside a wall there is no normal, so turn back
+                normal = Vector2(nx, ny)
+                if normal.length_squared() == 0:
+                    self.velocity = -self.velocity
+                    self.desired_direction = -self.desired_direction
+                else:
+                    if self.velocity.dot(normal) < 0:
+                        self.velocity.reflect_ip(normal)
+                    if self.desired_direction.dot(normal) < 0:
+                        self.desired_direction.reflect_ip(normal)
+                return
+        self.position = position
 
-    def wander(self):
+    def wander(self, obstacles=None):
         # Update desired direction by rotating by a random angle, range set by wander strength
-        angle = random.uniform(-self.wander_strength, self.wander_strength)
+        angle = self.rng.uniform(-self.wander_strength, self.wander_strength)
         self.desired_direction.rotate_ip(angle)
-        self.update_position()
+        self.update_position(obstacles)
 
-    def follow_target(self):
+    def follow_target(self, obstacles=None):
         # Update desired direction by rotating by a random angle, range set by wander strength
-        self.desired_direction = self.target - self.position
-        self.update_position()
+        # Standing on the target gives no direction, so keep the old one
+        direction = self.target - self.position
+        if direction.length_squared() > 0:
+            self.desired_direction = direction
+        self.update_position(obstacles)
 
     def update(self):
+        self.body.center = self.position
+        if not self.graphics:
+            return
+
+        # move image rectangle to position, and update rotation to match velocity
+        angle = self.velocity.as_polar()[1] + 90
+
         if not self.holding_food:
             self.index += 1
             if self.index >= len(self.images):
                 self.index = 0
-            self.image = self.images[self.index]
+            self.image = self.rotations.get(self.images[self.index], self.index, False, angle)
         else:
-            self.image = self.food_image
+            self.image = self.rotations.get(self.food_image, 0, True, angle)
 
-        # move image rectangle to position, and update rotation to match velocity
-        angle = self.velocity.as_polar()[1] + 90
-        self.image = pygame.transform.rotate(self.image, -angle)
-        self.image.set_colorkey(white)
-        self.rect = self.image.get_rect(center=self.rect.center)
+        self.rect.size = self.image.get_size()
         self.rect.center = self.position
 
     # def update_dir(self, food_tree, pheromone_tree):
@@ -209,8 +299,11 @@ class Ant(pygame.sprite.Sprite):
 
 
 class Food(pygame.sprite.Sprite):
-    def __init__(self, position, color):
+    """ A pile of food, ants take one piece of its amount at a time """
+
+    def __init__(self, position, color, rng=random, shift=50, amount=1):
         super().__init__()
+        self.amount = amount
         self.image = pygame.Surface([4, 4])
         self.image.fill(bckgrnd)
         self.image.set_colorkey(bckgrnd)
@@ -218,50 +311,35 @@ class Food(pygame.sprite.Sprite):
         self.radius = 2
         self.position = position
 
-        s = 50
-        r_shift = random.uniform(-s, s)
-        g_shift = random.uniform(-s, s)
-        b_shift = random.uniform(-s, s)
+        # Every piece gets a random shade of color, shift=0 keeps color as given
+        s = shift
+        if s:
+            r_shift = rng.uniform(-s, s)
+            g_shift = rng.uniform(-s, s)
+            b_shift = rng.uniform(-s, s)
+        else:
+            r_shift = g_shift = b_shift = 0
 
         new_r = min(max(color[0]+r_shift, 0), 255)
         new_g = min(max(color[1]+g_shift, 0), 255)
         new_b = min(max(color[2]+b_shift, 0), 255)
-        color_shift = (new_r, new_g, new_b)
-
-        pygame.draw.circle(self.image, color_shift, (2, 2), self.radius)
-
-
-class Pheromone(pygame.sprite.Sprite):
-    def __init__(self, position, color, decay_t):
-        super().__init__()
-        self.image = pygame.Surface([4, 4])
-        self.image.fill(bckgrnd)
-        self.image.set_colorkey(bckgrnd)
-        self.rect = self.image.get_rect(center=position)
-        self.radius = 2
-        self.position = position
-
-        self.decay_t = decay_t
-        self.end_t = pygame.time.get_ticks() / 1000.0 + decay_t
-        self.color = pygame.Color(color[0], color[1], color[2], 255)
+        self.color = (new_r, new_g, new_b)
 
         pygame.draw.circle(self.image, self.color, (2, 2), self.radius)
 
-    def update(self):
-        dist = self.end_t - pygame.time.get_ticks() / 1000.0
-        if dist <= 0:
-            self.kill()
-        else:
-            a = int(min((dist / self.decay_t)*255, 255))
-            self.image.set_alpha(a)
-
 
 class AntHill(pygame.sprite.Sprite):
-    def __init__(self, position):
+    def __init__(self, position, graphics=True):
         super().__init__()
 
-        self.image = ant_hill_sprite
-        self.image.set_colorkey(white)
-        self.rect = self.image.get_rect(center=position)
         self.radius = 15
+        # Collision square, the same with or without graphics like Ant.body
+        self.body = pygame.Rect(0, 0, 2 * self.radius, 2 * self.radius)
+        self.body.center = position
+        if graphics:
+            self.image = load_sprite("ant_hill_sprite")
+            self.image.set_colorkey(white)
+            self.rect = self.image.get_rect(center=position)
+        else:
+            self.rect = self.body
         self.position = position
@@ -0,0 +1,157 @@
+import math
+import numpy as np
+
+'''
+Obstacles. Terrain is a bitmask of solid cells on a regular grid, with a
+signed distance field and its gradient precomputed from it, so an ant only
+needs one lookup to know whether it hits a wall, how far away the nearest
+wall is and which way is away from it.
+
+Distances are clipped at reach, which keeps every change local: painting a
+block of cells only changes the distances within reach of it, and only that
+part of the fields is computed again.
+'''
+
+
+class ObstacleMap:
+    """ Solid cells with a signed distance and its gradient for every cell """
+
+    def __init__(self, size, cell_size=2, reach=32, origin=(0, 0)):
+        self.cell_size = cell_size
+        self.origin = np.asarray(origin, dtype=np.float64)  # World position of the grid's top left corner
+        self.width = int(math.ceil(size[0] / cell_size))
+        self.height = int(math.ceil(size[1] / cell_size))
+        self.reach = reach
+
+        # Solid cells, indexed [row (y), column (x)]
+        self.mask = np.zeros((self.height, self.width), dtype=bool)
+        # Distance from each cell centre to the nearest wall in world units, negative
+        # inside walls and clipped to +-reach, and the unit direction it grows in,
+        # which points away from the nearest wall. normal is indexed [row, column, (x, y)]
+        self.distance = np.full((self.height, self.width), float(reach), dtype=np.float32)
+        self.normal = np.zeros((self.height, self.width, 2), dtype=np.float32)
+
+        self._k = int(math.ceil(reach / cell_size))  # reach in cells
+
+        # Blocks of cells changed since render.ObstacleLayer last drew the map, as (y0, y1, x0, x1)
+        self.dirty = [(0, self.height, 0, self.width)]
+        # Counts changes, so copies of the map can tell when they are out of date
+        self.version = 0
+
+    def __len__(self):
+        # Number of solid cells
+        return int(np.count_nonzero(self.mask))
+
+    def cells(self, positions):
+        # Grid columns and rows of an (N, 2) array of positions, and which are inside the grid
+        ij = np.floor((np.asarray(positions, dtype=np.float64) - self.origin) / self.cell_size).astype(np.intp)
+        inside = ((ij[:, 0] >= 0) & (ij[:, 0] < self.width) &
+                  (ij[:, 1] >= 0) & (ij[:, 1] < self.height))
+        return ij[:, 0], ij[:, 1], inside
+
+    def paint(self, position, radius, solid=True):
+        # Make the cells with their centre within radius of position solid, or open them again
+        c = (np.asarray(position, dtype=np.float64) - self.origin) / self.cell_size - 0.5
+        r = radius / self.cell_size
+        x0, x1 = max(int(math.ceil(c[0] - r)), 0), min(int(math.floor(c[0] + r)) + 1, self.width)
+        y0, y1 = max(int(math.ceil(c[1] - r)), 0), min(int(math.floor(c[1] + r)) + 1, self.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        y, x = np.ogrid[y0:y1, x0:x1]
+        inside = (x - c[0]) ** 2 + (y - c[1]) ** 2 <= r * r
+        block = self.mask[y0:y1, x0:x1]
+        block[inside] = solid
+        self._update(y0, y1, x0, x1)
+
+    def paint_mask(self, mask, origin=(0, 0)):
+        """
+        Replace a block of cells with mask, a 2D bool array indexed [row,
+        column] with its top left cell at the world position origin. See
+        foodmap.load_mask to make one from an image.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        col, row = np.floor((np.asarray(origin, dtype=np.float64) - self.origin) / self.cell_size).astype(int)
+        y0, x0 = max(row, 0), max(col, 0)
+        y1, x1 = min(row + mask.shape[0], self.height), min(col + mask.shape[1], self.width)
+        if x1 <= x0 or y1 <= y0:
+            return
+        self.mask[y0:y1, x0:x1] = mask[y0 - row:y1 - row, x0 - col:x1 - col]
+        self._update(y0, y1, x0, x1)
+
+    def _update(self, y0, y1, x0, x1):
+        # Recompute the fields around a changed block of cells. Distances change
+        # up to reach away from it, and the gradient one cell further
+        k = self._k
+        dy0, dy1 = max(y0 - k, 0), min(y1 + k, self.height)
+        dx0, dx1 = max(x0 - k, 0), min(x1 + k, self.width)
+        outside = self._nearest(True, dy0, dy1, dx0, dx1)
+        inside = self._nearest(False, dy0, dy1, dx0, dx1)
+        solid = self.mask[dy0:dy1, dx0:dx1]
+        distance = np.where(solid, 0.5 - inside, outside - 0.5) * self.cell_size
+        self.distance[dy0:dy1, dx0:dx1] = np.clip(distance, -self.reach, self.reach)
+
+        gy0, gy1 = max(dy0 - 1, 0), min(dy1 + 1, self.height)
+        gx0, gx1 = max(dx0 - 1, 0), min(dx1 + 1, self.width)
+        by0, by1 = max(gy0 - 1, 0), min(gy1 + 1, self.height)
+        bx0, bx1 = max(gx0 - 1, 0), min(gx1 + 1, self.width)
+        block = self.distance[by0:by1, bx0:bx1]
+        gy = np.gradient(block, axis=0) if block.shape[0] > 1 else np.zeros_like(block)
+        gx = np.gradient(block, axis=1) if block.shape[1] > 1 else np.zeros_like(block)
+        normal = np.stack((gx, gy), axis=-1)[gy0 - by0:gy1 - by0, gx0 - bx0:gx1 - bx0]
+        norm = np.hypot(normal[..., 0], normal[..., 1])
+        np.divide(normal, norm[..., None], out=normal, where=norm[..., None] > 0)
+        self.normal[gy0:gy1, gx0:gx1] = normal
+
+        self.dirty.append((y0, y1, x0, x1))
+        self.version += 1
+
+    def _nearest(self, solid, y0, y1, x0, x1):
+        # Distance in cells from every cell of a block to the nearest solid (or
+        # open) cell, or k + 0.5 past k cells. Cells off the grid never count
+        k = self._k
+        h, w = y1 - y0, x1 - x0
+        padded = np.zeros((h + 2 * k, w + 2 * k), dtype=bool)
+        sy0, sy1 = max(y0 - k, 0), min(y1 + k, self.height)
+        sx0, sx1 = max(x0 - k, 0), min(x1 + k, self.width)
+        padded[sy0 - y0 + k:sy1 - y0 + k, sx0 - x0 + k:sx1 - x0 + k] = self.mask[sy0:sy1, sx0:sx1] == solid
+
+        if not padded.any():
+            return np.full((h, w), k + 0.5, dtype=np.float32)
+
+        # Exact distances in two passes: the nearest target along each row,
+        # then the nearest of those over the rows within reach
+        idx = np.arange(padded.shape[1], dtype=np.float64)
+        left = np.maximum.accumulate(np.where(padded, idx, -np.inf), axis=1)
+        right = np.minimum.accumulate(np.where(padded, idx, np.inf)[:, ::-1], axis=1)[:, ::-1]
+        across = np.minimum(idx - left, right - idx)[:, k:k + w] ** 2
+        d2 = np.full((h, w), np.inf)
+        for dy in range(-k, k + 1):
+            np.minimum(d2, across[k + dy:k + dy + h] + dy * dy, out=d2)
+        found = np.sqrt(d2).astype(np.float32)
+        found[found > k] = k + 0.5
+        return found
+
+    def blocked(self, positions):
+        # Whether each of an (N, 2) array of positions is inside a wall. The world beyond the grid is open
+        ix, iy, inside = self.cells(positions)
+        out = np.zeros(ix.shape, dtype=bool)
+        out[inside] = self.mask[iy[inside], ix[inside]]
+        return out
+
+    def lookup(self, positions):
+        # Distance to the nearest wall and the direction away from it at each of an (N, 2) array of positions
+        ix, iy, inside = self.cells(positions)
+        distance = np.full(ix.shape, float(self.reach))
+        normal = np.zeros((ix.size, 2))
+        distance[inside] = self.distance[iy[inside], ix[inside]]
+        normal[inside] = self.normal[iy[inside], ix[inside]]
+        return distance, normal
+
+    def sample(self, position):
+        # lookup for a single (x, y) position, as (distance, nx, ny)
+        ix = int(math.floor((position[0] - self.origin[0]) / self.cell_size))
+        iy = int(math.floor((position[1] - self.origin[1]) / self.cell_size))
+        if 0 <= ix < self.width and 0 <= iy < self.height:
+            nx, ny = self.normal[iy, ix]
+            return float(self.distance[iy, ix]), float(nx), float(ny)
+        return float(self.reach), 0.0, 0.0
@@ -1,14 +1,10 @@
-from pygame import image
-
-ant_sprite_0 = image.load("ant_sprite_0.png")
-ant_sprite_1 = image.load("ant_sprite_1.png")
-ant_sprite_2 = image.load("ant_sprite_2.png")
-ant_sprite_f = image.load("ant_sprite_food.png")
-ant_hill_sprite = image.load("ant_hill_sprite.png")
-
 # Module Parameters
 fps = 90
-resolution = (500, 500)
+sim_hz = 60  # Simulation steps per simulated second, independent of fps
+max_catch_up = 5  # Most simulation steps run in one frame before time is dropped
+resolution = (500, 500)  # Window size
+world_size = (500, 500)  # Size of the world, can be bigger than the window and is seen through a Camera
+rotation_buckets = 72  # Number of pre-rotated angles kept for each ant image
 bckgrnd = (26, 28, 41)
 black = (0, 0, 0)
 white = (255, 255, 255)
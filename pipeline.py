@@ -0,0 +1,466 @@
+import copy
+import multiprocessing
+import queue
+import threading
+import time
+from operator import methodcaller
+import numpy as np
+from parameters import sim_hz, max_catch_up, green
+from field import HOME, FOOD
+
+'''
+Simulation and drawing in parallel. A worker thread or process steps the
+colony at its fixed rate and, after every batch of steps, copies what is
+drawn into a Snapshot of plain arrays. Snapshots go through a buffer of a
+few slots, and the window draws the newest finished one with
+render.SnapshotRenderer while the next steps are already running.
+
+Nothing but the worker touches the colony while it runs. Input such as
+placing food or walls is sent to it with call or submit and runs between
+two steps, in order.
+
+With three slots the worker never waits: it fills the slot that is neither
+being drawn nor the newest. With two it waits for the window to take the
+newest before it can fill the other, like classic double buffering.
+'''
+
+
+def _fill(old, new, dtype=None):
+    # Copy new into old's memory when the shape fits, else into a new array. The result is read-only
+    new = np.asarray(new, dtype=dtype)
+    if old is None or old.shape != new.shape or old.dtype != new.dtype:
+        old = np.array(new)
+    else:
+        old.flags.writeable = True
+        np.copyto(old, new)
+    old.flags.writeable = False
+    return old
+
+
+def _walls(obstacles):
+    # Copy of an ObstacleMap for drawing, which only reads the mask
+    walls = copy.copy(obstacles)
+    walls.mask = obstacles.mask.copy()
+    walls.distance = walls.normal = None
+    walls.dirty = []
+    return walls
+
+
+def _field_view(field, grid):
+    # Copy of a PheromoneField holding grid, for drawing, which only reads the grid and its geometry
+    view = copy.copy(field)
+    view.grid = grid
+    view.active = None
+    view._stencils = {}
+    return view
+
+
+class Snapshot:
+    """ What is drawn of a colony at one step, as read-only arrays """
+
+    def __init__(self):
+        self.tick = 0
+        self.t = 0.0  # Simulation time
+        self.dt = 0.0
+        self.speed = 1.0
+        self.wall = 0.0  # time.perf_counter() when it was published
+        self.leftover = 0.0  # Simulated seconds the stepper was already past t when published
+
+        self.hills = None  # (H, 2)
+        self.radius = 15
+
+        # Ants, previous is the position before the last step
+        self.position = None  # (N, 2)
+        self.previous = None  # (N, 2)
+        self.angle = None  # (N,) image rotation in degrees
+        self.frame = None  # (N,) animation frame
+        self.holding = None  # (N,)
+
+        self.food = None  # (M, 2)
+        self.food_color = None  # (M, 3)
+        self.food_version = None
+
+        # Pheromones as a field, or as points with their expiry times per kind
+        self.field = None
+        self.pheromones = {HOME: (None, None), FOOD: (None, None)}
+        self.p_time = 10.0
+
+        self.walls = None
+
+    def alpha(self, now=None):
+        # How far the display is between previous and position, from 0 to 1
+        if now is None:
+            now = time.perf_counter()
+        return min((self.leftover + (now - self.wall) * self.speed) / self.dt, 1.0) if self.dt else 1.0
+
+
+def capture(colony, snapshot=None, previous=None):
+    """
+    Copy what is drawn of an Environment or a SwarmEnvironment into
+    snapshot, reusing its arrays where they fit, or into a new Snapshot.
+    previous is an (N, 2) array of ant positions before the last step.
+    """
+    if snapshot is None:
+        snapshot = Snapshot()
+    s = snapshot
+    s.tick = colony.clock.tick
+    s.t = colony.clock.now()
+    s.radius = colony.radius
+    s.p_time = colony.p_time
+
+    if hasattr(colony, 'ants'):
+        _capture_swarm(colony, s)
+    else:
+        _capture_sprites(colony, s)
+
+    if previous is None or previous.shape != s.position.shape:
+        previous = s.position
+    s.previous = _fill(s.previous, previous)
+
+    if colony.obstacles is None:
+        s.walls = None
+    elif s.walls is None or s.walls.version != colony.obstacles.version:
+        s.walls = _walls(colony.obstacles)
+    return s
+
+
+def _ant_positions(colony):
+    # (N, 2) positions of the ants of either kind of colony
+    if hasattr(colony, 'ants'):
+        return colony.ants.position.copy()
+    from classes import vectors
+    ants = colony.sprites.sprites()
+    return vectors((ant.position for ant in ants), len(ants))
+
+
+def _capture_sprites(colony, s):
+    from classes import vectors
+    ants = colony.sprites.sprites()
+    n = len(ants)
+    s.hills = _fill(s.hills, [tuple(colony.ant_hill.position)], np.float64)
+    s.position = _fill(s.position, vectors((ant.position for ant in ants), n))
+    velocity = vectors((ant.velocity for ant in ants), n)
+    s.angle = _fill(s.angle, np.degrees(np.arctan2(velocity[:, 1], velocity[:, 0])) + 90)
+    # Headless ants are not animated, they step through the frames with the clock instead
+    frames = np.fromiter((getattr(ant, 'index', -1) for ant in ants), np.int8, n)
+    frames[frames < 0] = s.tick % 4
+    s.frame = _fill(s.frame, frames)
+    s.holding = _fill(s.holding, np.fromiter((ant.holding_food for ant in ants), bool, n))
+
+    # Piles only change when one is added or emptied
+    if s.food_version != colony.food_version:
+        piles = colony.food.sprites()
+        s.food = _fill(None, vectors((p.position for p in piles), len(piles)))
+        s.food_color = _fill(None, np.array([p.color for p in piles], dtype=np.float64).reshape(-1, 3), np.uint8)
+        s.food_version = colony.food_version
+
+    if colony.field is not None:
+        grid = _fill(s.field.grid if s.field is not None else None, colony.field.grid)
+        s.field = _field_view(colony.field, grid)
+    else:
+        s.field = None
+        for kind in (HOME, FOOD):
+            points, end = colony.pheromones.items(kind)
+            old_points, old_end = s.pheromones[kind]
+            s.pheromones[kind] = (_fill(old_points, points), _fill(old_end, end))
+
+
+def _capture_swarm(colony, s):
+    ants = colony.ants
+    s.hills = _fill(s.hills, colony.hills)
+    s.position = _fill(s.position, ants.position)
+    s.angle = _fill(s.angle, np.degrees(np.arctan2(ants.velocity[:, 1], ants.velocity[:, 0])) + 90)
+    s.frame = _fill(s.frame, np.full(len(ants), s.tick % 4, dtype=np.int8))
+    s.holding = _fill(s.holding, ants.holding_food)
+
+    # Food is a count per field cell, drawn as one piece in the middle of every cell holding some
+    field = colony.field
+    rows, cols = np.nonzero(colony.food)
+    s.food = _fill(s.food, np.column_stack(((cols + 0.5) * field.cell_size + field.origin[0],
+                                            (rows + 0.5) * field.cell_size + field.origin[1])))
+    s.food_color = _fill(s.food_color, np.broadcast_to(green, (rows.size, 3)), np.uint8)
+
+    # Every colony's home and food channels are drawn together
+    grid = field.grid.reshape(-1, 2, field.height, field.width).max(axis=0)
+    grid = _fill(s.field.grid if s.field is not None else None, grid)
+    s.field = _field_view(field, grid)
+
+
+class SnapshotBuffer:
+    """ The newest published snapshot and the one being drawn, out of a few slots """
+
+    def __init__(self, slots=3):
+        if slots < 2:
+            raise ValueError("a snapshot buffer needs at least two slots")
+        self.slots = [Snapshot() for _ in range(slots)]
+        self.newest = None
+        self.drawn = None
+        self.published = 0  # Snapshots published so far
+        self._cond = threading.Condition()
+
+    def back(self, timeout=None):
+        # A slot that is neither drawn nor the newest, to fill next. Waits for one with two slots
+        with self._cond:
+            free = lambda: [s for s in self.slots if s is not self.newest and s is not self.drawn]
+            if not self._cond.wait_for(free, timeout):
+                return None
+            return free()[0]
+
+    def publish(self, snapshot):
+        with self._cond:
+            self.newest = snapshot
+            self.published += 1
+            self._cond.notify_all()
+
+    def latest(self):
+        # The newest snapshot, kept as it is until the next call. None before the first one
+        with self._cond:
+            self.drawn = self.newest
+            self._cond.notify_all()
+            return self.drawn
+
+
+class _Stepper:
+    # Steps a colony in real time at speed and publishes a snapshot after every batch of steps
+
+    def __init__(self, colony, hz, max_steps, speed):
+        self.colony = colony
+        self.dt = 1.0 / hz
+        self.max_steps = max_steps
+        self.speed = speed
+        self.accumulator = 0.0
+        self.dropped = 0.0
+
+    def handle(self, message):
+        # Run one message from the window, returns False on stop
+        cmd, payload = message
+        if cmd == 'call':
+            func, args = payload
+            func(self.colony, *args)
+        elif cmd == 'speed':
+            self.speed = payload
+        elif cmd == 'stop':
+            return False
+        return True
+
+    def run(self, receive, publish):
+        # receive(timeout) returns the next message or None, publish(colony, previous) sends a snapshot
+        last = time.perf_counter()
+        while True:
+            # Wait for messages until the next step is due
+            wait = (self.dt - self.accumulator) / self.speed if self.speed > 0 else self.dt
+            message = receive(max(wait, 0.0))
+            while message is not None:
+                if not self.handle(message):
+                    return
+                message = receive(0.0)
+
+            now = time.perf_counter()
+            self.accumulator += (now - last) * self.speed
+            last = now
+
+            steps = min(int(self.accumulator / self.dt), int(self.max_steps * max(self.speed, 1.0)))
+            if steps == 0:
+                continue
+            for i in range(steps):
+                # Only the last step is drawn between where the ants were and where they are
+                if i == steps - 1:
+                    previous = _ant_positions(self.colony)
+                self.colony.step(self.dt)
+            self.accumulator -= steps * self.dt
+
+            # Too far behind, let the time go like Scheduler does
+            if self.accumulator >= self.dt:
+                self.dropped += self.accumulator - self.accumulator % self.dt
+                self.accumulator %= self.dt
+
+            publish(previous)
+
+
+class SimThread:
+    """
+    Steps colony on a worker thread. Use as a context manager, or call
+    start() and stop(). Most NumPy work and pygame blits let go of the GIL,
+    so drawing overlaps the array parts of a step.
+    """
+
+    def __init__(self, colony, hz=sim_hz, max_steps=max_catch_up, speed=1.0, slots=3):
+        self.colony = colony
+        self.buffer = SnapshotBuffer(slots)
+        self._stepper = _Stepper(colony, hz, max_steps, speed)
+        self._inbox = queue.Queue()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def speed(self):
+        return self._stepper.speed
+
+    def start(self):
+        # The first snapshot is published before the worker starts, so there is always one to draw
+        self.buffer.publish(capture(self.colony, self.buffer.back()))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _receive(self, timeout):
+        try:
+            return self._inbox.get(timeout=timeout) if timeout > 0 else self._inbox.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _publish(self, previous):
+        snapshot = None
+        while snapshot is None:
+            # With two slots, wait for the window to take the newest one, but keep up with messages
+            snapshot = self.buffer.back(timeout=0.1)
+            if snapshot is None and not self._inbox.empty():
+                return
+        capture(self.colony, snapshot, previous)
+        snapshot.dt = self._stepper.dt
+        snapshot.speed = self._stepper.speed
+        snapshot.leftover = self._stepper.accumulator
+        snapshot.wall = time.perf_counter()
+        self.buffer.publish(snapshot)
+
+    def _run(self):
+        self._stepper.run(self._receive, self._publish)
+
+    def submit(self, func, *args):
+        # Run func(colony, *args) on the worker between two steps
+        self._inbox.put(('call', (func, args)))
+
+    def call(self, name, *args):
+        # Call the colony's method name with args on the worker between two steps
+        self.submit(methodcaller(name, *args))
+
+    def set_speed(self, speed):
+        self._inbox.put(('speed', speed))
+
+    def latest(self):
+        return self.buffer.latest()
+
+    def stop(self):
+        # Stop stepping after the messages sent so far, and return the colony
+        if self._thread is not None:
+            self._inbox.put(('stop', None))
+            self._thread.join()
+            self._thread = None
+        return self.colony
+
+
+def _process_worker(inbox, outbox, factory, args, hz, max_steps, speed):
+    # Builds and steps a colony until told to stop. Walls are only sent when they change
+    colony = factory(*args)
+    stepper = _Stepper(colony, hz, max_steps, speed)
+    snapshot = Snapshot()
+    sent = {'walls': None}
+
+    def receive(timeout):
+        return inbox.recv() if inbox.poll(timeout) else None
+
+    def publish(previous):
+        capture(colony, snapshot, previous)
+        snapshot.dt = stepper.dt
+        snapshot.speed = stepper.speed
+        snapshot.leftover = stepper.accumulator
+        snapshot.wall = time.perf_counter()
+        walls = snapshot.walls
+        if walls is not sent['walls']:
+            outbox.send(('walls', walls))
+            sent['walls'] = walls
+        snapshot.walls = None
+        outbox.send(('snapshot', snapshot))
+        snapshot.walls = walls
+
+    publish(None)
+    stepper.run(receive, publish)
+    outbox.send(('stopped', None))
+
+
+class SimProcess:
+    """
+    Steps the colony made by factory(*args) in a worker process, like
+    SimThread but without sharing the GIL. factory and the functions given
+    to submit must be picklable, such as classes and module level functions.
+    The colony stays in the worker.
+    """
+
+    def __init__(self, factory, *args, hz=sim_hz, max_steps=max_catch_up, speed=1.0, slots=3):
+        self.buffer = SnapshotBuffer(slots)
+        self.speed = speed
+        self._settings = (factory, args, hz, max_steps, speed)
+        self._outbox = None
+        self._worker = None
+        self._receiver = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        # Messages to the worker and snapshots back go through separate one way pipes
+        inbox, self._outbox = multiprocessing.Pipe(duplex=False)
+        snapshots, outbox = multiprocessing.Pipe(duplex=False)
+        self._worker = multiprocessing.Process(target=_process_worker, daemon=True,
+                                               args=(inbox, outbox) + self._settings)
+        self._worker.start()
+
+        # Snapshots are taken off the pipe as they come, so the worker never waits for the window
+        self._receiver = threading.Thread(target=self._receive, args=(snapshots,), daemon=True)
+        self._receiver.start()
+        return self
+
+    def _receive(self, conn):
+        walls = None
+        while True:
+            try:
+                cmd, payload = conn.recv()
+            except EOFError:
+                return
+            if cmd == 'walls':
+                walls = payload
+            elif cmd == 'snapshot':
+                payload.walls = walls
+                self.buffer.publish(payload)
+            elif cmd == 'stopped':
+                return
+
+    def submit(self, func, *args):
+        self._outbox.send(('call', (func, args)))
+
+    def call(self, name, *args):
+        self.submit(methodcaller(name, *args))
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self._outbox.send(('speed', speed))
+
+    def latest(self):
+        return self.buffer.latest()
+
+    def wait(self, timeout=None):
+        # Block until the first snapshot has arrived, returns whether it did
+        end = None if timeout is None else time.perf_counter() + timeout
+        while self.buffer.published == 0:
+            if not self._worker.is_alive() or (end is not None and time.perf_counter() > end):
+                return False
+            time.sleep(0.001)
+        return True
+
+    def stop(self):
+        if self._worker is not None:
+            try:
+                self._outbox.send(('stop', None))
+            except (BrokenPipeError, OSError):
+                pass
+            self._receiver.join(timeout=5)
+            self._worker.join(timeout=5)
+            self._worker = None
@@ -0,0 +1,83 @@
+import csv
+from collections import deque
+from time import perf_counter
+import numpy as np
+import pygame
+
+'''
+Per-phase timers for Environment.update and Environment.show. Phase times
+are summed over a frame, kept in a rolling window for averages and
+percentiles, drawn as an overlay and optionally streamed to CSV.
+'''
+
+PHASES = ('pheromones', 'sensing', 'steering', 'sprites', 'decay', 'show')
+
+
+class Profiler:
+    """ Rolling per-phase frame timings """
+
+    def __init__(self, window=120, csv_path=None):
+        self.window = window
+        self.totals = dict.fromkeys(PHASES, 0.0)  # Seconds spent in the current frame
+        self.history = {phase: deque(maxlen=window) for phase in PHASES}
+        self.frame = 0
+
+        self.csv_file = None
+        self.writer = None
+        if csv_path is not None:
+            self.csv_file = open(csv_path, 'w', newline='')
+            self.writer = csv.writer(self.csv_file)
+            self.writer.writerow(('frame',) + tuple(p + '_ms' for p in PHASES))
+
+        self.font = None
+
+    def lap(self, phase, t0):
+        # Add the time since t0 to phase and return the current time for the next lap
+        t = perf_counter()
+        self.totals[phase] += t - t0
+        return t
+
+    def end_frame(self):
+        # Push the current frame into the history and start a new one
+        for phase, total in self.totals.items():
+            self.history[phase].append(total)
+            self.totals[phase] = 0.0
+
+        if self.writer is not None:
+            self.writer.writerow([self.frame] + ['{:.4f}'.format(self.history[p][-1] * 1000) for p in PHASES])
+            if self.frame % 100 == 0:
+                self.csv_file.flush()
+        self.frame += 1
+
+    def stats(self, phase):
+        # Mean, p50, p95 and p99 of phase over the window, in milliseconds
+        times = np.fromiter(self.history[phase], dtype=float) * 1000
+        if times.size == 0:
+            return 0.0, 0.0, 0.0, 0.0
+        p50, p95, p99 = np.percentile(times, (50, 95, 99))
+        return times.mean(), p50, p95, p99
+
+    def summary(self):
+        return {phase: self.stats(phase) for phase in PHASES}
+
+    def draw(self, screen, position=(5, 5)):
+        # Table of phase timings in the corner of the screen
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.SysFont('monospace', 12)
+
+        lines = ['{:11}{:>7}{:>7}{:>7}'.format('phase (ms)', 'mean', 'p95', 'p99')]
+        for phase, (mean, p50, p95, p99) in self.summary().items():
+            lines.append('{:11}{:7.2f}{:7.2f}{:7.2f}'.format(phase, mean, p95, p99))
+
+        x, y = position
+        for line in lines:
+            text = self.font.render(line, True, (255, 255, 255), (0, 0, 0))
+            screen.blit(text, (x, y))
+            y += text.get_height()
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.writer = None
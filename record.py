@@ -0,0 +1,158 @@
+import struct
+import numpy as np
+from simclock import SimClock
+from classes import Environment
+
+'''
+Recording and replay of a run. A recording holds the settings needed to
+rebuild the colony, then one record per step (its dt) and per food
+placement and wall painted, in the order they happened. Replaying a recording on a SimClock
+gives exactly the same trajectory as the recorded run.
+
+File layout, little endian:
+    header  b'ANTREC', version u16, seed i64, ants u32, hill x f64, hill y f64, field cell f64 (0 for sprites)
+    records kind u8 followed by dt f64 (STEP), x f64, y f64, amount u32 (FOOD),
+            x f64, y f64, radius f64, solid u8 (OBSTACLE) or x f64, y f64, rows u32,
+            columns u32 and the rows x columns mask as packed bits (OBSTACLE_MASK)
+'''
+
+MAGIC = b'ANTREC'
+VERSION = 3
+HEADER = struct.Struct('<6sHqIddd')
+STEP = 0
+FOOD = 1
+OBSTACLE = 2
+OBSTACLE_MASK = 3
+_STEP = struct.Struct('<Bd')
+_FOOD = struct.Struct('<BddI')
+_OBSTACLE = struct.Struct('<Bddd?')
+_OBSTACLE_MASK = struct.Struct('<BddII')
+
+
+class Recorder:
+    """ Streams the inputs of a run to a file """
+
+    def __init__(self, path, seed, num_ants, position, field_cell=None):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, num_ants, position[0], position[1], field_cell or 0.0))
+        self.ticks = 0
+
+    @classmethod
+    def attach(cls, colony, path, position):
+        # Start recording an Environment. It must be seeded and not have stepped yet
+        if colony.seed is None:
+            raise ValueError("only seeded colonies can be recorded")
+        field_cell = colony.field.cell_size if colony.field is not None else None
+        colony.recorder = cls(path, colony.seed, colony.n, position, field_cell)
+        return colony.recorder
+
+    def step(self, dt):
+        self.file.write(_STEP.pack(STEP, dt))
+        self.ticks += 1
+
+    def food(self, x, y, amount=1):
+        self.file.write(_FOOD.pack(FOOD, x, y, amount))
+
+    def obstacle(self, x, y, radius, solid=True):
+        self.file.write(_OBSTACLE.pack(OBSTACLE, x, y, radius, solid))
+
+    def obstacle_mask(self, x, y, mask):
+        mask = np.asarray(mask, dtype=bool)
+        self.file.write(_OBSTACLE_MASK.pack(OBSTACLE_MASK, x, y, mask.shape[0], mask.shape[1]))
+        self.file.write(np.packbits(mask).tobytes())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read(path):
+    """
+    Return (header, records) of a recording. header is a dict of the colony
+    settings, records a list of (STEP, dt), (FOOD, x, y, amount),
+    (OBSTACLE, x, y, radius, solid) and (OBSTACLE_MASK, x, y, mask) tuples.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, version, seed, num_ants, x, y, field_cell = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("{} is not a recording".format(path))
+    if version != VERSION:
+        raise ValueError("unsupported recording version {}".format(version))
+    header = {'seed': seed, 'num_ants': num_ants, 'position': (x, y), 'field_cell': field_cell or None}
+
+    records = []
+    offset = HEADER.size
+    while offset < len(data):
+        kind = data[offset]
+        if kind == STEP:
+            records.append(_STEP.unpack_from(data, offset))
+            offset += _STEP.size
+        elif kind == FOOD:
+            records.append(_FOOD.unpack_from(data, offset))
+            offset += _FOOD.size
+        elif kind == OBSTACLE:
+            records.append(_OBSTACLE.unpack_from(data, offset))
+            offset += _OBSTACLE.size
+        elif kind == OBSTACLE_MASK:
+            _, mx, my, rows, cols = _OBSTACLE_MASK.unpack_from(data, offset)
+            offset += _OBSTACLE_MASK.size
+            size = (rows * cols + 7) // 8
+            bits = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset)
+            records.append((OBSTACLE_MASK, mx, my, np.unpackbits(bits, count=rows * cols).astype(bool).reshape(rows, cols)))
+            offset += size
+        else:
+            raise ValueError("corrupt recording at byte {}".format(offset))
+    return header, records
+
+
+def replay(path, ticks=None, headless=True, profiler=None):
+    """
+    Rebuild the recorded colony and run it through the recorded inputs, up
+    to ticks steps if given. Returns the Environment.
+    """
+    header, records = read(path)
+    colony = Environment(header['position'], header['num_ants'], clock=SimClock(), seed=header['seed'],
+                         headless=headless, field_cell=header['field_cell'])
+    colony.profiler = profiler
+
+    done = 0
+    for record in records:
+        if record[0] == FOOD:
+            colony.add_food((record[1], record[2]), amount=record[3])
+            continue
+        if record[0] == OBSTACLE:
+            colony.paint_obstacle((record[1], record[2]), record[3], record[4])
+            continue
+        if record[0] == OBSTACLE_MASK:
+            colony.add_obstacle_map(record[3], (record[1], record[2]))
+            continue
+        if ticks is not None and done >= ticks:
+            break
+        colony.step(record[1])
+        done += 1
+        if profiler is not None:
+            profiler.end_frame()
+    return colony
+
+
+if __name__ == '__main__':
+    import argparse
+    from profiler import Profiler, PHASES
+
+    parser = argparse.ArgumentParser(description="Replay a recorded ant colony run")
+    parser.add_argument("path")
+    parser.add_argument("--ticks", type=int, help="stop after this many steps")
+    parser.add_argument("--profile", action="store_true", help="print per-phase timings of the replay")
+    args = parser.parse_args()
+
+    profiler = Profiler(window=1 << 30) if args.profile else None
+    colony = replay(args.path, args.ticks, profiler=profiler)
+    print("replayed {} ticks, t = {:.2f}s, {} ants holding food, {} food left".format(
+        colony.clock.tick, colony.clock.now(), sum(ant.holding_food for ant in colony.sprites), sum(pile.amount for pile in colony.food)))
+    if profiler is not None:
+        print("{:11}{:>8}{:>8}{:>8}{:>8}".format('phase (ms)', 'mean', 'p50', 'p95', 'p99'))
+        for phase in PHASES:
+            print("{:11}{:8.3f}{:8.3f}{:8.3f}{:8.3f}".format(phase, *profiler.stats(phase)))
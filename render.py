@@ -0,0 +1,276 @@
+import math
+from time import perf_counter
+import numpy as np
+import pygame
+from parameters import blue, red, white, black, orange, bckgrnd
+from field import HOME, FOOD
+from assets import load_sprite
+from objects import Ant
+
+'''
+Pheromone and wall rendering. All pheromones are written into one RGBA
+surface with NumPy and drawn with a single blit, instead of one sprite per
+pheromone. Walls are kept in a surface at one pixel per obstacle cell and
+scaled up where they are seen. SnapshotRenderer draws a pipeline.Snapshot
+the way Environment.show draws a live colony.
+'''
+
+
+def dot_stencil(radius):
+    # Pixel offsets covered by a pheromone dot, a filled circle of radius in a 2 * radius square
+    size = 2 * radius
+    image = pygame.Surface([size, size])
+    pygame.draw.circle(image, (255, 255, 255), (radius, radius), radius)
+    mask = pygame.surfarray.array2d(image) != 0
+    dx, dy = np.nonzero(mask)
+    return dx, dy
+
+
+class PheromoneLayer:
+    """ One RGBA surface holding every pheromone, blitted once per frame """
+
+    def __init__(self, size, radius=2):
+        self.size = size
+        self.surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+        self.colors = {HOME: blue, FOOD: red}
+
+        # Alpha of each channel, indexed [channel, x, y] like surfarray
+        self.alpha = np.zeros((2, size[0], size[1]), dtype=np.uint8)
+        self.radius = radius
+        self.stencil = dot_stencil(radius)
+
+        # Pixel to cell lookups for drawing a field, kept for the last view
+        self._cells = {}
+
+    def clear(self):
+        self.alpha.fill(0)
+
+    def add_points(self, channel, topleft, alpha):
+        """
+        Draw dots with their top left corner at the (N, 2) integer array
+        topleft, with alpha in [0, 255]. Overlapping dots keep the largest alpha.
+        """
+        w, h = self.size
+        out = self.alpha[channel]
+
+        # Write in order of increasing alpha so the strongest dot lands last
+        order = np.argsort(alpha, kind='stable')
+        alpha = np.asarray(alpha, dtype=np.uint8)[order]
+        topleft = topleft[order]
+        for dx, dy in zip(*self.stencil):
+            x = topleft[:, 0] + dx
+            y = topleft[:, 1] + dy
+            inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+            out[x[inside], y[inside]] = np.maximum(out[x[inside], y[inside]], alpha[inside])
+
+    def add_trail(self, channel, points, end, now, decay_t, origin=(0, 0)):
+        """
+        Draw pheromones at an (N, 2) array of points, faded by the time they
+        have left until end. Each dot is placed like the image of a sprite
+        centred on its point. origin is the world position of the layer's top
+        left pixel.
+        """
+        if not len(points):
+            return
+        # Rect centres round halves away from zero
+        topleft = np.trunc(points + np.copysign(0.5, points)).astype(np.intp) - self.radius - origin
+        w, h = self.size
+        d = 2 * self.radius
+        inside = ((topleft[:, 0] > -d) & (topleft[:, 0] < w) & (topleft[:, 1] > -d) & (topleft[:, 1] < h))
+        alpha = np.clip((end[inside] - now) / decay_t * 255, 0, 255)
+        self.add_points(channel, topleft[inside], alpha)
+
+    def add_field(self, field, origin=(0, 0)):
+        # Draw both channels of a PheromoneField, one cell per cell_size pixels.
+        # origin is the world position of the layer's top left pixel
+        key = (field.cell_size, tuple(field.origin), field.width, field.height, tuple(origin))
+        if key not in self._cells:
+            w, h = self.size
+            self._cells = {key: (self._axis(np.arange(w) + origin[0] - field.origin[0], field.cell_size, field.width),
+                                 self._axis(np.arange(h) + origin[1] - field.origin[1], field.cell_size, field.height))}
+        (ix, x0, x1), (iy, y0, y1) = self._cells[key]
+
+        # Only the block of cells under the layer is read, plus one blank
+        # row and column for pixels off the grid
+        for channel in (HOME, FOOD):
+            cells = np.zeros((x1 - x0 + 1, y1 - y0 + 1), dtype=np.uint8)
+            cells[:-1, :-1] = np.clip(field.grid[channel, y0:y1, x0:x1].T * 255, 0, 255)
+            self.alpha[channel] = cells[ix[:, None], iy[None, :]]
+
+    @staticmethod
+    def _axis(pixels, cell_size, cells):
+        # Cell of each pixel along one axis, counted from the first cell in view,
+        # with pixels off the grid sent to the blank cell after the last one
+        i = np.floor(pixels / cell_size).astype(np.intp)
+        off = (i < 0) | (i >= cells)
+        on = i[~off]
+        first, last = (int(on.min()), int(on.max()) + 1) if on.size else (0, 0)
+        i -= first
+        i[off] = last - first
+        return i, first, last
+
+    def draw(self, screen, dest=(0, 0)):
+        # Home pheromones are drawn over food pheromones where both are present
+        home = self.alpha[HOME]
+        food = self.alpha[FOOD]
+        on_top = home >= food
+
+        rgb = pygame.surfarray.pixels3d(self.surface)
+        for i in range(3):
+            rgb[..., i] = np.where(on_top, self.colors[HOME][i], self.colors[FOOD][i])
+        del rgb
+
+        a = pygame.surfarray.pixels_alpha(self.surface)
+        np.maximum(home, food, out=a)
+        del a
+
+        screen.blit(self.surface, dest)
+
+
+class ObstacleLayer:
+    """ The walls of an obstacles.ObstacleMap, one pixel per cell """
+
+    def __init__(self, color):
+        self.color = color
+        self.key = black if tuple(color) != black else white  # Open cells, drawn as transparent
+        self.surface = None
+        self.obstacles = None
+
+    def draw(self, screen, obstacles, origin=(0, 0)):
+        # Draw the walls with screen's top left pixel at the world position origin
+        if obstacles is not self.obstacles or self.surface is None:
+            self.obstacles = obstacles
+            self.surface = pygame.Surface((obstacles.width, obstacles.height))
+            self.surface.set_colorkey(self.key)
+            obstacles.dirty = [(0, obstacles.height, 0, obstacles.width)]
+
+        # Copy the blocks painted since the last draw, surfarray is indexed [x, y]
+        if obstacles.dirty:
+            rgb = pygame.surfarray.pixels3d(self.surface)
+            for y0, y1, x0, x1 in obstacles.dirty:
+                rgb[x0:x1, y0:y1] = np.where(obstacles.mask[y0:y1, x0:x1].T[..., None], self.color, self.key)
+            del rgb
+            obstacles.dirty = []
+
+        # Only the cells under the screen are scaled up, one cell_size square per cell
+        cs = obstacles.cell_size
+        left = (origin[0] - obstacles.origin[0]) / cs
+        top = (origin[1] - obstacles.origin[1]) / cs
+        w, h = screen.get_size()
+        x0, y0 = max(int(math.floor(left)), 0), max(int(math.floor(top)), 0)
+        x1 = min(int(math.ceil(left + w / cs)), obstacles.width)
+        y1 = min(int(math.ceil(top + h / cs)), obstacles.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        block = self.surface.subsurface((x0, y0, x1 - x0, y1 - y0))
+        scaled = pygame.transform.scale(block, ((x1 - x0) * cs, (y1 - y0) * cs))
+        screen.blit(scaled, (round((x0 - left) * cs), round((y0 - top) * cs)))
+
+
+class SnapshotRenderer:
+    """ Draws pipeline Snapshots, from a window that does not own the colony """
+
+    def __init__(self, cell_size=25):
+        self.margin = cell_size  # How far past the view ant and food images can reach
+        self.layer = None
+        self.view = None
+        self.obstacle_layer = ObstacleLayer(orange)
+        self.images = None
+        self.food_images = {}  # Colour -> food piece image
+
+        # Set to a profiler.Profiler to time drawing as the show phase
+        self.profiler = None
+
+    def _load(self):
+        # Ant images, in the order of their animation frames like Ant.images
+        s0, s1, s2 = load_sprite("ant_sprite_0"), load_sprite("ant_sprite_1"), load_sprite("ant_sprite_2")
+        self.images = [s0, s1, s0, s2]
+        self.food_image = load_sprite("ant_sprite_food")
+        self.hill_image = load_sprite("ant_hill_sprite")
+        self.hill_image.set_colorkey(white)
+
+    def _food_image(self, color):
+        # A food piece drawn like Food draws its image
+        color = tuple(int(c) for c in color)
+        image = self.food_images.get(color)
+        if image is None:
+            image = pygame.Surface([4, 4])
+            image.fill(bckgrnd)
+            image.set_colorkey(bckgrnd)
+            pygame.draw.circle(image, color, (2, 2), 2)
+            self.food_images[color] = image
+        return image
+
+    def draw(self, screen, snapshot, camera=None, alpha=None):
+        """
+        Draw snapshot seen by camera, with the ants alpha of the way from
+        their previous positions, by default as far as real time has moved on
+        """
+        prof = self.profiler
+        t = perf_counter() if prof else 0.0
+        if self.images is None:
+            self._load()
+
+        if camera is None:
+            zoom, size, origin = 1.0, screen.get_size(), (0, 0)
+        else:
+            zoom, size, origin = camera.zoom, camera.size(), camera.topleft()
+
+        target = screen
+        if zoom != 1.0:
+            if self.view is None or self.view.get_size() != size:
+                self.view = pygame.Surface(size)
+            target = self.view
+            target.fill(bckgrnd)
+
+        if self.layer is None or self.layer.size != size:
+            self.layer = PheromoneLayer(size)
+
+        x0, y0 = origin
+        x1, y1 = x0 + size[0], y0 + size[1]
+        m = self.margin
+
+        def visible(points):
+            return np.nonzero((points[:, 0] >= x0 - m) & (points[:, 0] < x1 + m) &
+                              (points[:, 1] >= y0 - m) & (points[:, 1] < y1 + m))[0]
+
+        s = snapshot
+        self.layer.clear()
+        if s.field is not None:
+            self.layer.add_field(s.field, origin)
+        else:
+            for kind in (FOOD, HOME):
+                points, end = s.pheromones[kind]
+                if points is not None:
+                    self.layer.add_trail(kind, points, end, s.t, s.p_time, origin)
+        self.layer.draw(target)
+        if s.walls is not None:
+            self.obstacle_layer.draw(target, s.walls, origin)
+
+        blits = []
+        for i in visible(s.food):
+            x, y = s.food[i]
+            blits.append((self._food_image(s.food_color[i]), (int(x) - 2 - x0, int(y) - 2 - y0)))
+
+        if alpha is None:
+            alpha = s.alpha()
+        position = s.previous + (s.position - s.previous) * alpha
+        rotations = Ant.rotations
+        for i in visible(position):
+            if s.holding[i]:
+                image = rotations.get(self.food_image, 0, True, s.angle[i])
+            else:
+                frame = int(s.frame[i])
+                image = rotations.get(self.images[frame], frame, False, s.angle[i])
+            rect = image.get_rect(center=(position[i, 0] - x0, position[i, 1] - y0))
+            blits.append((image, rect))
+
+        for x, y in s.hills:
+            blits.append((self.hill_image, self.hill_image.get_rect(center=(x - x0, y - y0))))
+        target.blits(blits, doreturn=False)
+
+        if target is not screen:
+            pygame.transform.scale(target, screen.get_size(), screen)
+
+        if prof:
+            prof.lap('show', t)
@@ -0,0 +1,84 @@
+from parameters import sim_hz, max_catch_up
+
+'''
+Fixed timestep scheduling. The colony is stepped at its own rate of hz
+steps per second of simulated time, however long each display frame takes.
+Frame time is gathered in an accumulator and spent in whole steps, and
+drawing places each ant between its last two positions by the time left
+over, so motion looks smooth at any display rate.
+
+At speed N every real second runs N seconds of simulation. With
+render_every k only every k-th simulation state is drawn, so fast runs do
+not spend their time drawing frames nobody can follow.
+'''
+
+
+class Scheduler:
+    """ Steps a colony at a fixed rate and draws it interpolated """
+
+    def __init__(self, colony, hz=sim_hz, max_steps=max_catch_up, speed=1.0, render_every=1):
+        self.colony = colony
+        self.dt = 1.0 / hz
+        self.max_steps = max_steps  # Most steps run per frame at speed 1, to avoid spiralling behind
+        self.speed = speed
+        self.render_every = render_every
+
+        self.accumulator = 0.0
+        self.pending = 0  # Steps run since the last draw
+        self.dropped = 0.0  # Simulated seconds skipped because frames fell too far behind
+        self.previous = {}  # Ant -> position before the last step
+
+    def set_speed(self, speed, render_every=1):
+        self.speed = speed
+        self.render_every = render_every
+
+    def advance(self, seconds):
+        """
+        Add seconds of real time and run the whole steps that fit.
+        Returns the number of steps run.
+        """
+        self.accumulator += seconds * self.speed
+        limit = int(self.max_steps * max(self.speed, 1.0))
+
+        steps = 0
+        while self.accumulator >= self.dt and steps < limit:
+            # Positions are replaced, not changed in place, so keeping references is enough
+            self.previous = {ant: ant.position for ant in self.colony.sprites}
+            self.colony.step(self.dt)
+            self.accumulator -= self.dt
+            steps += 1
+
+        # Too far behind, let the time go instead of catching up over the next frames
+        if self.accumulator >= self.dt:
+            self.dropped += self.accumulator - self.accumulator % self.dt
+            self.accumulator %= self.dt
+
+        self.pending += steps
+        return steps
+
+    def alpha(self):
+        # How far between the last two states the display is, from 0 to 1
+        return self.accumulator / self.dt
+
+    def ready(self):
+        # Whether this frame should be drawn
+        return self.render_every <= 1 or self.pending >= self.render_every
+
+    def show(self, screen, camera=None):
+        # Draw the colony with every ant between its previous and current position
+        alpha = self.alpha()
+        if camera is not None:
+            ants = self.colony.sprites.query_bounds(*camera.bounds(self.colony.cell_size))
+        else:
+            ants = self.colony.sprites.sprites()
+        for ant in ants:
+            previous = self.previous.get(ant)
+            if previous is not None:
+                ant.rect.center = previous.lerp(ant.position, alpha)
+
+        self.colony.show(screen, camera)
+
+        # The rects are used for collisions, put them back on the real positions
+        for ant in ants:
+            ant.rect.center = ant.position
+        self.pending = 0
@@ -0,0 +1,249 @@
+import multiprocessing
+import numpy as np
+from parameters import fps, world_size
+from simclock import SimClock
+from swarm import SwarmEnvironment
+
+'''
+Spatially sharded simulation. The world is split into a grid of rectangular
+tiles and every tile runs its own SwarmEnvironment in a worker process.
+
+Ants only sense pheromones and food, never each other, so the ghost zone of
+a tile is a ring of field and food cells as wide as the sensing reach. Every
+tick is run in two halves. After placing its pheromones each tile sends the
+strips of its own cells that fall inside its neighbours' ghost zones, so
+ants see this tick's deposits across the border just as in one process.
+After moving, it hands over the ants that walked into another tile. The
+master only routes these messages.
+'''
+
+
+def _sender_slice(d, n, h):
+    # Own cells of a tile that a neighbour in direction d needs, in local grid coordinates
+    if d < 0:
+        return slice(h, 2 * h)
+    if d > 0:
+        return slice(n, n + h)
+    return slice(h, h + n)
+
+
+def _ghost_slice(d, n, h):
+    # Ghost cells of a tile filled by a neighbour that sent in direction d
+    if d < 0:
+        return slice(h + n, 2 * h + n)
+    if d > 0:
+        return slice(0, h)
+    return slice(h, h + n)
+
+
+class TileGrid:
+    """ Geometry of the tiles, in field cells and in world coordinates """
+
+    def __init__(self, tiles, size, cell_size):
+        self.tx, self.ty = tiles
+        self.cell_size = cell_size
+        width = int(np.ceil(size[0] / cell_size))
+        height = int(np.ceil(size[1] / cell_size))
+
+        # Tile boundaries in cells, and the inner ones in world coordinates
+        self.cols = np.linspace(0, width, self.tx + 1).astype(int)
+        self.rows = np.linspace(0, height, self.ty + 1).astype(int)
+        self.x_edges = self.cols[1:-1] * cell_size
+        self.y_edges = self.rows[1:-1] * cell_size
+
+    def tiles(self):
+        return [(r, c) for r in range(self.ty) for c in range(self.tx)]
+
+    def shape(self, tile):
+        # Own cells of a tile as (rows, columns)
+        r, c = tile
+        return self.rows[r + 1] - self.rows[r], self.cols[c + 1] - self.cols[c]
+
+    def owner(self, positions):
+        # Row and column of the tile owning each position. Ants outside the
+        # world belong to the nearest edge tile
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        c = np.searchsorted(self.x_edges, positions[:, 0], side='right')
+        r = np.searchsorted(self.y_edges, positions[:, 1], side='right')
+        return r, c
+
+    def neighbours(self, tile):
+        r, c = tile
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                if (dy or dx) and 0 <= r + dy < self.ty and 0 <= c + dx < self.tx:
+                    yield dy, dx
+
+
+def _tile_worker(conn, grid, tile, position, num_ants, dt, seed, halo):
+    # Runs one tile until told to close
+    r, c = tile
+    nr, nc = grid.shape(tile)
+    cs = grid.cell_size
+    origin = ((grid.cols[c] - halo) * cs, (grid.rows[r] - halo) * cs)
+    size = ((nc + 2 * halo) * cs, (nr + 2 * halo) * cs)
+    env = SwarmEnvironment(position, num_ants, SimClock(dt), seed, cs, size, origin)
+    neighbours = list(grid.neighbours(tile))
+    # Ghost cells past the edge of the world, where a single field has no cells at all
+    outside = [(_ghost_slice(-dy, nr, halo), _ghost_slice(-dx, nc, halo))
+               for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dy or dx) and (dy, dx) not in neighbours]
+
+    while True:
+        cmd, payload = conn.recv()
+
+        if cmd == 'step':
+            # First half of the tick: take in the ants handed over, then place pheromones
+            for state in payload:
+                env.ants.extend(state)
+            env.clock.step()
+            env.deposit()
+            for rows, cols in outside:
+                env.field.grid[:, rows, cols] = 0
+
+            # Strips of own cells inside each neighbour's ghost zone, with this tick's deposits in them
+            strips = []
+            for dy, dx in neighbours:
+                rows, cols = _sender_slice(dy, nr, halo), _sender_slice(dx, nc, halo)
+                strips.append(((dy, dx), (env.field.grid[:, rows, cols].copy(), env.food[rows, cols].copy())))
+            conn.send(strips)
+
+        elif cmd == 'ghosts':
+            # Second half: fill the ghost zone from the neighbours, then sense and move
+            for (dy, dx), (cells, food) in payload:
+                rows, cols = _ghost_slice(dy, nr, halo), _ghost_slice(dx, nc, halo)
+                env.field.grid[:, rows, cols] = cells
+                env.field.touch(rows, cols)
+                env.food[rows, cols] = food
+            env.advance()
+
+            # Hand over ants that left the tile
+            tr, tc = grid.owner(env.ants.position)
+            leaving = (tr != r) | (tc != c)
+            emigrants = []
+            if leaving.any():
+                dest = (tr[leaving], tc[leaving])
+                state = env.ants.remove(leaving)
+                for t in set(zip(*dest)):
+                    to = (dest[0] == t[0]) & (dest[1] == t[1])
+                    emigrants.append((t, {name: value[to] for name, value in state.items()}))
+
+            conn.send((emigrants, env.delivered, env.ants.n))
+
+        elif cmd == 'food':
+            positions, amount = payload
+            env.add_food(positions, amount)
+
+        elif cmd == 'state':
+            conn.send((env.ants.position.copy(), env.ants.holding_food.copy()))
+
+        elif cmd == 'close':
+            conn.close()
+            return
+
+
+class ShardedSimulation:
+    """
+    A SwarmEnvironment split over tiles, one worker process per tile.
+    Use as a context manager, or call close() when done.
+    """
+
+    def __init__(self, position, num_ants, tiles=(2, 2), size=world_size, dt=1.0 / fps, seed=0,
+                 field_cell=4, sense_radius=25):
+        self.grid = TileGrid(tiles, size, field_cell)
+        self.n = num_ants
+        self.tick = 0
+        self.delivered = 0
+
+        # Ghost zone width in cells, enough for the sensing stencil
+        self.halo = int(np.ceil(sense_radius / field_cell)) + 1
+        for tile in self.grid.tiles():
+            if min(self.grid.shape(tile)) < self.halo:
+                raise ValueError("tiles are smaller than the sensing range, use fewer tiles")
+
+        # All ants start in the tile holding the ant hill
+        hr, hc = self.grid.owner(position)
+        home = (int(hr[0]), int(hc[0]))
+
+        # Tiles share the seed: each ant's random stream is keyed by its id, so
+        # it draws the same numbers whichever tile it is in
+        self.conns = {}
+        self.workers = []
+        for tile in self.grid.tiles():
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=_tile_worker, daemon=True,
+                args=(child, self.grid, tile, position, num_ants if tile == home else 0, dt, seed, self.halo))
+            worker.start()
+            self.conns[tile] = parent
+            self.workers.append(worker)
+
+        self.counts = {tile: (num_ants if tile == home else 0) for tile in self.grid.tiles()}
+        self._incoming = {tile: [] for tile in self.grid.tiles()}
+
+    def __len__(self):
+        return self.n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_food(self, positions, amount=1):
+        # Send food to the tiles owning each position, amount is a number or one per position
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        amount = np.broadcast_to(amount, len(positions))
+        r, c = self.grid.owner(positions)
+        for tile, conn in self.conns.items():
+            mine = (r == tile[0]) & (c == tile[1])
+            if mine.any():
+                conn.send(('food', (positions[mine], amount[mine])))
+
+    def step(self):
+        # All tiles place their pheromones in parallel, trade the strips of their ghost
+        # zones, then sense and move in parallel. Ants that changed tile are handed over
+        # at the start of the next tick
+        for tile, conn in self.conns.items():
+            conn.send(('step', self._incoming[tile]))
+
+        ghosts = {tile: [] for tile in self.conns}
+        for (r, c), conn in self.conns.items():
+            for (dy, dx), data in conn.recv():
+                ghosts[(r + dy, c + dx)].append(((dy, dx), data))
+        for tile, conn in self.conns.items():
+            conn.send(('ghosts', ghosts[tile]))
+
+        incoming = {tile: [] for tile in self.conns}
+        delivered = 0
+        for tile, conn in self.conns.items():
+            emigrants, tile_delivered, count = conn.recv()
+            for dest, state in emigrants:
+                incoming[dest].append(state)
+            delivered += tile_delivered
+            self.counts[tile] = count
+
+        self._incoming = incoming
+        self.delivered = delivered
+        self.tick += 1
+
+    def state(self):
+        # Positions and holding-food flags of every ant, gathered from all tiles
+        for conn in self.conns.values():
+            conn.send(('state', None))
+        parts = [conn.recv() for conn in self.conns.values()]
+        # Ants in flight between tiles are part of the colony too
+        for states in self._incoming.values():
+            parts.extend((s['position'], s['holding_food']) for s in states)
+        return (np.concatenate([p[0] for p in parts]).reshape(-1, 2),
+                np.concatenate([p[1] for p in parts]))
+
+    def close(self):
+        for conn in self.conns.values():
+            try:
+                conn.send(('close', None))
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.join(timeout=5)
+        self.conns = {}
+        self.workers = []
@@ -0,0 +1,41 @@
+'''
+Clocks that drive the simulation. Everything that used to read
+pygame.time.get_ticks() asks one of these for the time instead, so the
+simulation can be stepped by a fixed dt without a window.
+'''
+
+
+class WallClock:
+    """ Real time clock, backed by the pygame tick counter """
+
+    def __init__(self):
+        # Imported here so the simulation clock and headless runs don't load pygame
+        import pygame.time
+        self._ticks = pygame.time.get_ticks
+        self.tick = 0
+
+    def now(self):
+        # Time in seconds since pygame was initialized
+        return self._ticks() / 1000.0
+
+    def step(self, dt=None):
+        # Real time moves on its own, only count the frames
+        self.tick += 1
+
+
+class SimClock:
+    """ Simulation clock that only moves forward when stepped """
+
+    def __init__(self, dt=0.01, t=0.0):
+        self.dt = dt  # Default step length in seconds
+        self.t = t
+        self.tick = 0
+
+    def now(self):
+        return self.t
+
+    def step(self, dt=None):
+        if dt is None:
+            dt = self.dt
+        self.t += dt
+        self.tick += 1
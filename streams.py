@@ -0,0 +1,45 @@
+import random
+import numpy as np
+
+'''
+Seeded random number streams. Every ant gets its own stream, so a run
+depends only on the seed and not on the order ants are updated in.
+
+Sprite ants get a random.Random per ant. Batched engines use a counter-based
+generator instead: each draw is a hash of (seed, ant id, counter), so an
+ant's numbers do not depend on which batch or which process it is in.
+'''
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def seed_key(seed, *stream):
+    # 64 bit key for a seed and an optional stream path, e.g. (ant id,)
+    return int(np.random.SeedSequence(seed, spawn_key=stream).generate_state(1, np.uint64)[0])
+
+
+def ant_random(seed, ant_id):
+    # Independent random.Random stream for one ant
+    return random.Random(seed_key(seed, ant_id))
+
+
+def _splitmix64(x):
+    with np.errstate(over='ignore'):
+        z = x + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * _MIX1
+        z = (z ^ (z >> np.uint64(27))) * _MIX2
+    return z ^ (z >> np.uint64(31))
+
+
+def counter_uniform(key, ids, counter, low=0.0, high=1.0):
+    """
+    Uniform numbers in [low, high), one per id, for draw number counter.
+    The same (key, id, counter) always gives the same number.
+    """
+    ids = np.asarray(ids, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        x = _splitmix64(ids * _GOLDEN + np.uint64(counter)) ^ np.uint64(key)
+    x = _splitmix64(x)
+    return low + (high - low) * ((x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53)
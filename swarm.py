@@ -0,0 +1,356 @@
+import numpy as np
+from parameters import world_size
+from simclock import WallClock
+from field import PheromoneField, HOME, FOOD, channel
+from obstacles import ObstacleMap
+from streams import seed_key, counter_uniform
+
+'''
+Struct-of-arrays ant engine. Holds the state of every ant in NumPy arrays
+and runs the same wander / follow_target / update_position rules as
+objects.Ant, but for the whole colony in a handful of array operations.
+'''
+
+
+class AntSwarm:
+    """ All ants of a colony, one row per ant """
+
+    # Per-ant arrays, the full state of an ant
+    STATE = ('ids', 'colony', 'position', 'velocity', 'desired_direction', 'target', 'has_target', 'holding_food',
+             't_last_p')
+
+    def __init__(self, position, num_ants, clock=None, seed=None, first_id=0, colony=0):
+        self.clock = clock if clock is not None else WallClock()
+        self.n = num_ants
+        self._scratch()
+
+        # Every ant draws from its own counter-based stream, keyed by the seed and its id.
+        # Draws 0-3 set up the ant, wandering uses one draw per tick after that
+        self.key = seed_key(seed)
+        self.ids = np.arange(first_id, first_id + num_ants, dtype=np.int64)
+        self.draws = 4
+
+        # Same constants as objects.Ant
+        self.max_speed = 3.5
+        self.wander_strength = 10  # Maximum degrees of change possible for updating desired direction
+        self.steer_strength = 1.5
+        self.p_interval = 0.25  # Time between each pheromone drop
+        self.radius = 6  # Collision radius
+        self.f_radius = 25  # Food detection radius
+        self.p_radius = 25  # Pheromone detection radius
+        self.viewAngle = 60  # Food detection view angle
+        self.avoid_distance = 10  # Ants steer away from walls closer than this
+
+        # Colony of each ant, when several share a world
+        self.colony = np.zeros(num_ants, dtype=np.int32)
+        self.colony[:] = colony
+
+        # Position, speed and direction. position is one point or one per ant
+        self.position = np.empty((num_ants, 2))
+        self.position[:] = position
+        self.velocity = np.column_stack([self.uniform(-1.0, 1.0, i) for i in (0, 1)])
+
+        # Wandering parameters
+        self.desired_direction = np.column_stack([self.uniform(-1.0, 1.0, i) for i in (2, 3)])
+        self._clamp(self.desired_direction, self.max_speed, scale_up=True)
+
+        # For grabbing food from the map. has_target plays the role of Ant.target is not None
+        self.target = np.zeros((num_ants, 2))
+        self.has_target = np.zeros(num_ants, dtype=bool)
+        self.holding_food = np.zeros(num_ants, dtype=bool)
+
+        # Last time updated and last time each ant placed a pheromone
+        self.t0 = self.clock.now()
+        self.t_last_p = np.full(num_ants, self.clock.now())
+
+    def __len__(self):
+        return self.n
+
+    def uniform(self, low, high, draw):
+        # One number per ant from each ant's stream
+        return counter_uniform(self.key, self.ids, draw, low, high)
+
+    def _scratch(self):
+        # Scratch buffers reused every tick
+        n = self.n
+        self._force = np.empty((n, 2))
+        self._norm = np.empty(n)
+        self._scale = np.empty(n)
+        self._cos = np.empty(n)
+        self._sin = np.empty(n)
+
+    def remove(self, mask):
+        # Take the ants in mask out of the swarm and return their state
+        state = {name: getattr(self, name)[mask] for name in self.STATE}
+        for name in self.STATE:
+            setattr(self, name, getattr(self, name)[~mask])
+        self.n = len(self.position)
+        self._scratch()
+        return state
+
+    def extend(self, state):
+        # Add ants from a state returned by remove
+        if len(state['position']) == 0:
+            return
+        for name in self.STATE:
+            setattr(self, name, np.concatenate((getattr(self, name), state[name])))
+        self.n = len(self.position)
+        self._scratch()
+
+    def _clamp(self, v, max_m, scale_up=False):
+        # Clamp the magnitude of every row of v to max_m in place.
+        # With scale_up every row is scaled to exactly max_m instead
+        norm = self._norm
+        np.hypot(v[:, 0], v[:, 1], out=norm)
+        scale = self._scale
+        scale.fill(1.0)
+        np.divide(max_m, norm, out=scale, where=(norm > 0) if scale_up else (norm > max_m))
+        v *= scale[:, None]
+
+    def time_to_place_pheromone(self):
+        return self.clock.now() - self.t_last_p >= self.p_interval
+
+    def place_pheromone(self):
+        # Mask of the ants that drop a pheromone this tick. Ants holding food
+        # drop food pheromones, the others drop home pheromones
+        drop = self.time_to_place_pheromone()
+        self.t_last_p[drop] = self.clock.now()
+        return drop
+
+    def wander(self, mask=None):
+        # Rotate desired direction by a random angle in degrees, range set by wander strength
+        angle = self.uniform(-self.wander_strength, self.wander_strength, self.draws)
+        self.draws += 1
+        if mask is not None:
+            angle[~mask] = 0.0
+        np.radians(angle, out=angle)
+        np.cos(angle, out=self._cos)
+        np.sin(angle, out=self._sin)
+
+        x = self.desired_direction[:, 0].copy()
+        y = self.desired_direction[:, 1]
+        self.desired_direction[:, 0] = x * self._cos - y * self._sin
+        self.desired_direction[:, 1] = x * self._sin + y * self._cos
+
+    def follow_target(self, mask=None):
+        if mask is None:
+            mask = self.has_target
+        np.copyto(self.desired_direction, self.target - self.position, where=mask[:, None])
+
+    def update_position(self, obstacles=None):
+        # Motion is scaled in tenths of a second. obstacles is an obstacles.ObstacleMap or None
+        t = self.clock.now()
+        dt = (t - self.t0) * 10.0
+        self.t0 = t
+
+        np.multiply(self.desired_direction, self.steer_strength, out=self._force)
+        self._clamp(self._force, self.max_speed)
+
+        if obstacles is not None:
+            # Steer away from walls in range, harder the closer they are
+            distance, normal = obstacles.lookup(self.position)
+            push = np.maximum(1 - distance / self.avoid_distance, 0) * self.max_speed
+            self._force += normal * push[:, None]
+
+        self._force *= dt
+        self.velocity += self._force
+        self._clamp(self.velocity, self.max_speed)
+        if obstacles is None:
+            self.position += self.velocity * dt
+            return
+
+        # Ants walking into a wall stay put and bounce off it
+        position = self.position + self.velocity * dt
+        distance, normal = obstacles.lookup(position)
+        hit = distance < 0
+        if hit.any():
+            self._bounce(np.nonzero(hit)[0], normal[hit])
+        self.position[~hit] = position[~hit]
+
+    def _bounce(self, idx, normal):
+        # Reflect the motion of the ants in idx off walls with the given normals.
+        # Deep inside a wall there is no normal, so those ants turn back
+        flat = ~normal.any(axis=1)
+        for v in (self.velocity, self.desired_direction):
+            rows = v[idx]
+            dot = np.minimum(np.einsum('ij,ij->i', rows, normal), 0)
+            rows -= 2 * dot[:, None] * normal
+            rows[flat] *= -1
+            v[idx] = rows
+
+    def steer(self, obstacles=None):
+        # Ants with a target follow it, the others wander, then all of them move
+        self.follow_target(self.has_target)
+        self.wander(~self.has_target)
+        self.update_position(obstacles)
+
+    def drop_food(self, hill_position, hill_radius):
+        # Ants holding food inside the hill drop it and target the centre of the hill.
+        # hill_position is one hill for all ants or the hill of each ant
+        hill = np.broadcast_to(np.asarray(hill_position, dtype=float), self.position.shape)
+        d = self.position - hill
+        r = hill_radius + self.radius
+        home = self.holding_food & (np.einsum('ij,ij->i', d, d) <= r * r)
+        self.holding_food[home] = False
+        self.target[home] = hill[home]
+        self.has_target[home] = True
+        return home
+
+
+class SwarmEnvironment:
+    """
+    The Environment rules on top of AntSwarm: pheromones in a PheromoneField
+    and food as a count per field cell, so a whole tick is array operations.
+
+    Several colonies can share the world: position is then a list of hills
+    and num_ants the ants of each colony, or one count for all of them.
+    Every colony lays and follows its own pair of pheromone channels, and
+    all of them compete for the same food.
+    """
+
+    def __init__(self, position, num_ants, clock=None, seed=None, field_cell=4, size=world_size, origin=(0, 0)):
+        self.clock = clock if clock is not None else WallClock()
+
+        # Ant Hill features, one hill per colony
+        self.hills = np.array(position, dtype=float).reshape(-1, 2)
+        self.colonies = len(self.hills)
+        self.radius = 15
+
+        colony = np.repeat(np.arange(self.colonies), np.broadcast_to(num_ants, (self.colonies,)))
+        self.ants = AntSwarm(self.hills[colony], colony.size, self.clock, seed, colony=colony)
+        self.n = colony.size
+
+        # Food brought back to the hills, in total and per colony
+        self.delivered = 0
+        self.delivered_by = np.zeros(self.colonies, dtype=np.int64)
+
+        # Pheromones and food share one grid, with a home and a food channel per colony
+        self.p_time = 10.0  # time in seconds that pheromones last
+        self.field = PheromoneField(size, field_cell, self.p_time, channels=2 * self.colonies, origin=origin)
+        self.food = np.zeros((self.field.height, self.field.width), dtype=np.int32)
+        self.t0 = self.clock.now()
+
+        # Walls, an obstacles.ObstacleMap with cells of obstacle_cell made on the first one placed
+        self.obstacles = None
+        self.obstacle_cell = 2
+
+        # Set to a trajectory.TrajectoryRecorder to stream ant positions to disk after each update
+        self.trajectory = None
+
+    @property
+    def position(self):
+        # Hill of the first colony
+        return self.hills[0]
+
+    def channels(self, kind, idx):
+        # Field channel of kind for the ants in idx, a single channel when there is one colony
+        if self.colonies == 1:
+            return kind
+        return channel(self.ants.colony[idx], kind)
+
+    def add_food(self, positions, amount=1):
+        # Add amount of food at each (x, y) position, amount is a number or one per position
+        ix, iy, inside = self.field.cells(np.asarray(positions, dtype=np.float64).reshape(-1, 2))
+        amount = np.broadcast_to(amount, ix.shape)[inside]
+        np.add.at(self.food, (iy[inside], ix[inside]), amount)
+
+    def add_food_map(self, amounts, origin=(0, 0)):
+        # Load a food map, one field cell per entry with its top left cell at origin
+        rows, cols = np.nonzero(amounts)
+        cs = self.field.cell_size
+        positions = np.column_stack((origin[0] + (cols + 0.5) * cs, origin[1] + (rows + 0.5) * cs))
+        self.add_food(positions, np.asarray(amounts)[rows, cols])
+
+    def obstacle_map(self):
+        # The ObstacleMap over the field, made if there is none yet
+        if self.obstacles is None:
+            f = self.field
+            self.obstacles = ObstacleMap((f.width * f.cell_size, f.height * f.cell_size), self.obstacle_cell,
+                                         origin=f.origin)
+        return self.obstacles
+
+    def paint_obstacle(self, position, radius, solid=True):
+        # Make a disc of the world a wall, or open it again with solid=False
+        self.obstacle_map().paint(position, radius, solid)
+
+    def add_obstacle_map(self, mask, origin=(0, 0)):
+        # Load walls from a mask of obstacle cells with its top left cell at origin, see foodmap.load_mask
+        self.obstacle_map().paint_mask(mask, origin)
+
+    def __len__(self):
+        return self.n
+
+    def food_count(self):
+        return int(self.food.sum())
+
+    def update(self):
+        self.deposit()
+        self.advance()
+
+    def deposit(self):
+        # First half of update: place pheromones on each ant's own colony channels
+        ants = self.ants
+        drop = np.nonzero(ants.place_pheromone())[0]
+        kind = np.where(ants.holding_food[drop], FOOD, HOME)
+        self.field.deposit(channel(ants.colony[drop], kind), ants.position[drop])
+
+    def advance(self):
+        # Second half of update: sense, pick up and drop food, move and let the pheromones fade.
+        # shard.py fills in the ghost cells of a tile between the two halves
+        ants = self.ants
+
+        # Ants holding food drop it at their hill, or follow home pheromones.
+        # Like Environment, they keep their old target when they sense nothing
+        holding = ants.holding_food.copy()
+        hills = self.hills[0] if self.colonies == 1 else self.hills[ants.colony]
+        home = ants.drop_food(hills, self.radius)
+        self.delivered += int(home.sum())
+        self.delivered_by += np.bincount(ants.colony[home], minlength=self.colonies)
+        searching = holding & ants.holding_food
+        if searching.any():
+            idx = np.nonzero(searching)[0]
+            targets, found = self.field.sense(self.channels(HOME, idx), ants.position[idx], ants.velocity[idx],
+                                              ants.p_radius, ants.viewAngle)
+            ants.target[idx[found]] = targets[found]
+            ants.has_target[idx[found]] = True
+
+        # Ants without food target food, then food pheromones, then wander
+        idx = np.nonzero(~holding)[0]
+        if idx.size:
+            pos = ants.position[idx]
+            vel = ants.velocity[idx]
+            targets, found = self.field.sense_grid(self.food, pos, vel, ants.f_radius, ants.viewAngle, 1)
+            p_targets, p_found = self.field.sense(self.channels(FOOD, idx), pos, vel, ants.p_radius, ants.viewAngle)
+            targets[~found] = p_targets[~found]
+            ants.target[idx] = targets
+            ants.has_target[idx] = found | p_found
+
+            # Pick up food from the cell the ant is standing in
+            ix, iy, inside = self.field.cells(pos)
+            idx, ix, iy = idx[inside], ix[inside], iy[inside]
+            here = self.food[iy, ix] > 0
+            # Several ants in one cell can each take one piece while it lasts, lowest id
+            # first, so who gets it does not depend on the order of the rows, which
+            # changes as ants move between the tiles of shard.py
+            cell = iy[here] * self.field.width + ix[here]
+            order = np.lexsort((ants.ids[idx[here]], cell))
+            cell = cell[order]
+            rank = np.arange(cell.size) - np.searchsorted(cell, cell)
+            take = rank < self.food.ravel()[cell]
+            pick = idx[here][order][take]
+            np.subtract.at(self.food.ravel(), cell[take], 1)
+            ants.holding_food[pick] = True
+
+        ants.steer(self.obstacles)
+
+        t = self.clock.now()
+        self.field.decay(t - self.t0)
+        self.t0 = t
+
+        if self.trajectory is not None:
+            self.trajectory.capture(self)
+
+    def step(self, dt=None):
+        # Advance the clock by dt seconds and run one update
+        self.clock.step(dt)
+        self.update()
@@ -0,0 +1,251 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import numpy as np
+from bench import ENGINES, FOOD_LAYOUTS, build
+
+'''
+Parameter sweeps. Every run builds a headless colony with one combination
+of ant and colony parameters, runs it for a fixed number of ticks and
+measures how well it forages. Runs are spread over a process pool and each
+result is appended to a column store as soon as it arrives, so a sweep
+that is stopped can be resumed where it left off.
+
+    python sweep.py out.sweep --set wander_strength=5,10,20 --set p_time=5,10,20
+    python sweep.py out.sweep --sample 200 --range viewAngle=20:90 --range p_time=2:30 --engine swarm
+
+A column store is a directory holding sweep.json, with the settings and
+every run of the sweep, and one file of raw little endian values per column.
+'''
+
+# Parameters that can be swept, and the range they are sampled from by default.
+# All but p_time are set on every ant
+PARAMETERS = {
+    'wander_strength': (2.0, 30.0),
+    'steer_strength': (0.5, 3.0),
+    'p_interval': (0.05, 1.0),
+    'viewAngle': (15.0, 90.0),
+    'f_radius': (10.0, 50.0),
+    'p_time': (2.0, 30.0),
+}
+METRICS = ('delivered', 'delivered_per_min', 'mean_trip_s', 'mean_return_s', 'seconds')
+
+
+def grid(values):
+    # Every combination of a dict of name -> list of values
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def sample(ranges, count, seed=0):
+    # count uniform random draws from a dict of name -> (low, high)
+    rng = np.random.default_rng(seed)
+    draws = {name: rng.uniform(low, high, count) for name, (low, high) in ranges.items()}
+    return [{name: float(draws[name][i]) for name in ranges} for i in range(count)]
+
+
+def configure(colony, params):
+    # Apply swept parameters to a colony built by bench.build
+    ants = getattr(colony, 'ants', None)
+    targets = [ants] if ants is not None else colony.sprites.sprites()
+    for name, value in params.items():
+        if name == 'p_time':
+            colony.p_time = value
+            if colony.field is not None:
+                colony.field.set_decay(value)
+        elif name in PARAMETERS:
+            for target in targets:
+                setattr(target, name, value)
+        else:
+            raise ValueError("unknown parameter {!r}".format(name))
+
+
+def _holding(colony):
+    ants = getattr(colony, 'ants', None)
+    if ants is not None:
+        return ants.holding_food.copy()
+    return np.fromiter((ant.holding_food for ant in colony.sprites), dtype=bool, count=len(colony.sprites))
+
+
+def measure(colony, ticks):
+    """
+    Run colony for ticks steps and return its foraging metrics. A trip runs
+    from an ant's last delivery (or the start) to its next delivery, the
+    return leg from picking food up to delivering it. Times are simulated.
+    """
+    start = colony.clock.now()
+    holding = _holding(colony)
+    t_trip = np.full(holding.shape, start)
+    t_pick = np.full(holding.shape, start)
+    trips = returns = 0.0
+    delivered = 0
+
+    for _ in range(ticks):
+        colony.step()
+        now = colony.clock.now()
+        current = _holding(colony)
+        picked = current & ~holding
+        dropped = holding & ~current
+        if dropped.any():
+            delivered += int(dropped.sum())
+            trips += float((now - t_trip[dropped]).sum())
+            returns += float((now - t_pick[dropped]).sum())
+            t_trip[dropped] = now
+        t_pick[picked] = now
+        holding = current
+
+    seconds = colony.clock.now() - start
+    return {
+        'delivered': delivered,
+        'delivered_per_min': delivered * 60.0 / seconds if seconds else 0.0,
+        'mean_trip_s': trips / delivered if delivered else np.nan,
+        'mean_return_s': returns / delivered if delivered else np.nan,
+        'seconds': seconds,
+    }
+
+
+def run_one(job):
+    # One run of a sweep, in a pool worker
+    run, params, settings = job
+    colony = build(settings['engine'], settings['ants'], settings['food'], 0, settings['seed'])
+    configure(colony, params)
+    result = measure(colony, settings['ticks'])
+    result.update(params)
+    result['run'] = run
+    return result
+
+
+class ColumnStore:
+    """
+    Append-only table with one file per column. Rows are written one value
+    per column file at a time, and a row only counts once every column has
+    it, so a store cut short mid-row is trimmed back to whole rows on open.
+    """
+
+    def __init__(self, path, meta=None, columns=None):
+        self.path = path
+        meta_path = os.path.join(path, 'sweep.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                stored = json.load(f)
+            if meta is not None and stored['meta'] != meta:
+                raise ValueError("{} holds a sweep with different settings".format(path))
+            self.meta, self.columns = stored['meta'], stored['columns']
+        else:
+            if meta is None:
+                raise ValueError("{} is not a sweep".format(path))
+            os.makedirs(path, exist_ok=True)
+            self.meta, self.columns = meta, columns
+            with open(meta_path, 'w') as f:
+                json.dump({'meta': meta, 'columns': columns}, f, indent=2)
+
+        # Trim every column to the rows all of them have
+        sizes = [self._size(name) for name in self.columns]
+        self.rows = min(sizes) if sizes else 0
+        for name in self.columns:
+            with open(self._file(name), 'ab') as f:
+                f.truncate(self.rows * np.dtype(self.columns[name]).itemsize)
+        self.files = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.col')
+
+    def _size(self, name):
+        path = self._file(name)
+        return os.path.getsize(path) // np.dtype(self.columns[name]).itemsize if os.path.exists(path) else 0
+
+    def append(self, row):
+        if self.files is None:
+            self.files = {name: open(self._file(name), 'ab') for name in self.columns}
+        for name, dtype in self.columns.items():
+            self.files[name].write(np.array(row[name], dtype=dtype).tobytes())
+            self.files[name].flush()
+        self.rows += 1
+
+    def read(self):
+        # Dict of column name -> array of all whole rows
+        return {name: np.fromfile(self._file(name), dtype=dtype, count=self.rows)
+                for name, dtype in self.columns.items()}
+
+    def close(self):
+        if self.files is not None:
+            for f in self.files.values():
+                f.close()
+            self.files = None
+
+
+def sweep(path, runs, engine='sprites', ants=100, food='clusters', ticks=2000, seed=0, workers=None):
+    """
+    Run every parameter dict in runs and append the results to the column
+    store at path. Runs already in the store are skipped, so calling sweep
+    again with the same arguments resumes it. Returns the store.
+    """
+    meta = {'engine': engine, 'ants': ants, 'food': food, 'ticks': ticks, 'seed': seed, 'runs': runs}
+    names = sorted({name for params in runs for name in params})
+    columns = {'run': '<i8'}
+    columns.update((name, '<f8') for name in names)
+    columns.update((name, '<i8' if name == 'delivered' else '<f8') for name in METRICS)
+    store = ColumnStore(path, meta, columns)
+
+    done = set(store.read()['run'].tolist())
+    settings = {key: meta[key] for key in ('engine', 'ants', 'food', 'ticks', 'seed')}
+    jobs = [(run, params, settings) for run, params in enumerate(runs) if run not in done]
+
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        with ctx.Pool(workers) as pool:
+            for result in pool.imap_unordered(run_one, jobs):
+                store.append(result)
+                print("run {:5} {:6} delivered, {:7.2f}/min, mean trip {:6.1f}s".format(
+                    result['run'], result['delivered'], result['delivered_per_min'], result['mean_trip_s']),
+                    file=sys.stderr)
+    finally:
+        store.close()
+    return store
+
+
+def _parse(items, parse):
+    # name=spec command line arguments into a dict
+    parsed = {}
+    for item in items:
+        name, _, spec = item.partition('=')
+        if name not in PARAMETERS:
+            raise ValueError("unknown parameter {!r}, choose from {}".format(name, ", ".join(PARAMETERS)))
+        parsed[name] = parse(spec)
+    return parsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep over headless colonies")
+    parser.add_argument("path", help="column store to write, resumed if it exists")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="values of a parameter, every combination is run")
+    parser.add_argument("--sample", type=int, help="run this many random parameter draws instead of a grid")
+    parser.add_argument("--range", action="append", default=[], metavar="NAME=LOW:HIGH",
+                        help="range to sample a parameter from (default: all parameters, default ranges)")
+    parser.add_argument("--engine", choices=ENGINES, default='sprites')
+    parser.add_argument("--ants", type=int, default=100)
+    parser.add_argument("--food", choices=FOOD_LAYOUTS, default='clusters')
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="pool size (default: one per CPU)")
+    args = parser.parse_args()
+
+    try:
+        if args.sample:
+            ranges = _parse(args.range, lambda spec: tuple(float(v) for v in spec.split(':')))
+            runs = sample(ranges or PARAMETERS, args.sample, args.seed)
+        else:
+            values = _parse(args.set, lambda spec: [float(v) for v in spec.split(',')])
+            runs = grid(values) if values else [{}]
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        store = sweep(args.path, runs, args.engine, args.ants, args.food, args.ticks, args.seed, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    print("{} of {} runs in {}".format(store.rows, len(runs), args.path))
@@ -0,0 +1,76 @@
+import numpy as np
+from parameters import fps
+from simclock import SimClock
+from classes import Environment
+from swarm import SwarmEnvironment
+import checkpoint
+
+'''
+Resuming a checkpoint against the same colony run without a stop, run with pytest
+'''
+
+
+def _food(colony):
+    for position in np.random.default_rng(1).uniform(150, 350, (40, 2)):
+        colony.add_food(position)
+
+
+def _sprites():
+    colony = Environment((250, 250), 30, clock=SimClock(1.0 / fps), seed=0, headless=True)
+    colony.p_time = 4.0
+    for ant in colony.sprites:
+        ant.viewAngle = 40
+    _food(colony)
+    return colony
+
+
+def _swarm():
+    colony = SwarmEnvironment((250, 250), 30, SimClock(1.0 / fps), 0)
+    colony.p_time = 4.0
+    colony.field.set_decay(colony.p_time)
+    colony.ants.viewAngle = 40
+    _food(colony)
+    return colony
+
+
+def _state(colony):
+    if isinstance(colony, SwarmEnvironment):
+        return colony.ants.position.copy(), colony.ants.holding_food.copy()
+    ants = colony.sprites.sprites()
+    return (np.array([tuple(ant.position) for ant in ants]),
+            np.array([ant.holding_food for ant in ants]))
+
+
+def _resume_matches(make, tmp_path):
+    straight = make()
+    stopped = make()
+    for _ in range(150):
+        straight.step()
+        stopped.step()
+
+    path = str(tmp_path / 'colony.antckp')
+    checkpoint.save(stopped, path)
+    resumed = checkpoint.load(path)
+    assert resumed.p_time == 4.0
+    for _ in range(150):
+        straight.step()
+        resumed.step()
+
+    positions, holding = _state(straight)
+    resumed_positions, resumed_holding = _state(resumed)
+    assert np.array_equal(positions, resumed_positions)
+    assert np.array_equal(holding, resumed_holding)
+    return straight, resumed
+
+
+def test_resume_sprites(tmp_path):
+    straight, resumed = _resume_matches(_sprites, tmp_path)
+    assert all(ant.viewAngle == 40 for ant in resumed.sprites)
+    assert len(resumed.pheromones) == len(straight.pheromones)
+
+
+def test_resume_swarm(tmp_path):
+    straight, resumed = _resume_matches(_swarm, tmp_path)
+    assert resumed.ants.viewAngle == 40
+    assert resumed.delivered == straight.delivered
+    assert np.array_equal(resumed.field.grid, straight.field.grid)
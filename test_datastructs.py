@@ -0,0 +1,54 @@
+import numpy as np
+from datastructs import Box, Vector, QTree, PointQueue
+
+'''
+Tests for the spatial structures in datastructs, run with pytest
+'''
+
+
+def test_move_onto_a_split_line():
+    tree = QTree(Box(Vector(0, 0), Vector(100, 100)), capacity=1)
+    a = tree.insert((10, 10))
+    tree.insert((90, 10))
+    assert tree.root.children is not None
+
+    # x == 50 is the split, quadrant() puts it in the right leaf
+    assert tree.move(a, (50, 10))
+    assert tree.search((50, 10))
+    assert tree.leaf[a] is tree._find_leaf(50, 10)
+
+    # The far edge of the tree stays in the last leaf
+    assert tree.move(a, (100, 100))
+    assert tree.search((100, 100))
+    assert tree.query_radius((100, 100), 1) == [a]
+
+
+def test_queue_bounds_match_every_point():
+    rng = np.random.default_rng(0)
+    indexed = PointQueue(max_count=50, capacity=8, index_cell=25)
+    plain = PointQueue(max_count=50, capacity=8)
+    t = 0.0
+    for tick in range(200):
+        # Pushed one by one and in batches, through growing, wrapping and dropping over max_count
+        for queue in (indexed, plain):
+            queue.expire(t)
+        points = rng.uniform(0, 200, (int(rng.integers(0, 6)), 2))
+        tags = rng.integers(0, 2, len(points))
+        for queue in (indexed, plain):
+            if tick % 2:
+                queue.extend(points, t + 3.0, tags)
+            else:
+                for point, tag in zip(points, tags):
+                    queue.push(point, t + 3.0, tag)
+        t += 0.1
+
+        x0, y0 = rng.uniform(-20, 150, 2)
+        for tag in (None, 0, 1):
+            found, end = indexed.query_bounds(x0, y0, x0 + 60, y0 + 40, tag)
+            expected, expected_end = plain.query_bounds(x0, y0, x0 + 60, y0 + 40, tag)
+            inside = ((found[:, 0] >= x0) & (found[:, 0] <= x0 + 60) &
+                      (found[:, 1] >= y0) & (found[:, 1] <= y0 + 40))
+            assert np.array_equal(found[inside], expected)
+            assert np.array_equal(end[inside], expected_end)
+    assert plain.evicted > 0
+    assert len(indexed.index) == len(indexed)
@@ -0,0 +1,44 @@
+import numpy as np
+from simclock import SimClock
+from classes import Environment
+from datastructs import PointIndex
+
+'''
+Regression tests for the sprite Environment, run with pytest
+'''
+
+
+def test_cone_skips_points_under_the_ant():
+    index = PointIndex([(10.0, 10.0), (14.0, 10.0)], 4)
+    targets, found, _ = index.query_cone([(10.0, 10.0)], [(1.0, 0.0)], 25.0, 60.0)
+    assert found[0]
+    assert tuple(targets[0]) == (14.0, 10.0)
+
+    targets, found, _ = index.query_cone([(14.0, 10.0)], [(1.0, 0.0)], 25.0, 60.0)
+    assert not found[0]
+
+
+def test_food_on_the_hill():
+    # Pile centres land exactly on the hill, where every ant starts
+    for field_cell in (None, 4):
+        colony = Environment((250, 250), 20, clock=SimClock(1.0 / 60), seed=1, headless=True, field_cell=field_cell)
+        colony.add_food((250, 250), amount=5)
+        for _ in range(30):
+            colony.step()
+        positions = np.array([tuple(ant.position) for ant in colony.sprites])
+        assert np.isfinite(positions).all()
+
+
+def test_no_expired_pheromones_when_sensing():
+    colony = Environment((250, 250), 20, clock=SimClock(1.0 / 60), seed=1, headless=True)
+    sense = colony.sense
+
+    def checked(ants):
+        points, end = colony.pheromones.items()
+        assert (end > colony.clock.now()).all()
+        return sense(ants)
+
+    colony.sense = checked
+    for _ in range(int(2 * colony.p_time * 60)):
+        colony.step()
+    assert colony.pheromones.expired > 0
@@ -0,0 +1,53 @@
+import numpy as np
+import pygame
+import assets
+from simclock import SimClock
+from classes import Environment
+from objects import Ant
+from record import Recorder, replay
+
+'''
+Replaying a recording against the run it was recorded from, run with pytest
+'''
+
+
+def _positions(colony):
+    return np.array([tuple(ant.position) for ant in colony.sprites])
+
+
+def _record(path, headless):
+    colony = Environment((250, 250), 40, clock=SimClock(), seed=0, headless=headless)
+    Recorder.attach(colony, path, (250, 250))
+    for position in np.random.default_rng(1).uniform(200, 300, (60, 2)):
+        colony.add_food(tuple(position))
+    colony.paint_obstacle((180, 250), 10)
+    for _ in range(400):
+        colony.step()
+    colony.recorder.close()
+    return colony
+
+
+def test_replay_matches_headless_run(tmp_path):
+    path = str(tmp_path / 'run.antrec')
+    recorded = _record(path, headless=True)
+    replayed = replay(path)
+    assert np.array_equal(_positions(replayed), _positions(recorded))
+    assert [ant.holding_food for ant in replayed.sprites] == [ant.holding_food for ant in recorded.sprites]
+
+
+def test_replay_matches_run_with_graphics(tmp_path, monkeypatch):
+    # Ant images of a different size than the collision square, so the image
+    # rects of the recorded run are not the rects of the headless replay
+    for name in assets.SPRITES:
+        image = pygame.Surface((10, 20))
+        image.fill((0, 0, 0))
+        pygame.image.save(image, str(tmp_path / (name + '.png')))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(assets, 'atlas', assets.Atlas())
+    monkeypatch.setattr(Ant, 'rotations', type(Ant.rotations)())
+
+    path = str(tmp_path / 'run.antrec')
+    recorded = _record(path, headless=False)
+    replayed = replay(path)
+    assert np.array_equal(_positions(replayed), _positions(recorded))
+    assert [ant.holding_food for ant in replayed.sprites] == [ant.holding_food for ant in recorded.sprites]
@@ -0,0 +1,31 @@
+import numpy as np
+from parameters import fps
+from simclock import SimClock
+from swarm import SwarmEnvironment
+from shard import ShardedSimulation
+
+'''
+The sharded simulation against the same colony in one process, run with pytest
+'''
+
+
+def _sorted(positions):
+    return positions[np.lexsort(positions.T)]
+
+
+def test_sharded_matches_single_process():
+    rng = np.random.default_rng(0)
+    food = rng.uniform(20, 480, (300, 2))
+    amount = rng.integers(1, 10, len(food))
+    single = SwarmEnvironment((250, 250), 200, SimClock(1.0 / fps), 0)
+    single.add_food(food, amount)
+    with ShardedSimulation((250, 250), 200, tiles=(2, 2), seed=0) as sharded:
+        sharded.add_food(food, amount)
+        for tick in range(400):
+            single.step()
+            sharded.step()
+            if tick % 50 == 49:
+                positions, holding = sharded.state()
+                assert np.array_equal(_sorted(positions), _sorted(single.ants.position)), tick
+                assert holding.sum() == single.ants.holding_food.sum(), tick
+        assert sharded.delivered == single.delivered
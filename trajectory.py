@@ -0,0 +1,175 @@
+import os
+import struct
+import numpy as np
+
+'''
+Ant trajectories streamed to disk. The colony hands its ants to a
+TrajectoryRecorder after every update, which writes one fixed width row per
+ant into a memory-mapped file. The file holds a fixed number of ticks: once
+full it either wraps around over the oldest ticks, or with rollover moves
+on to a new file.
+
+File layout, little endian:
+    header  b'ANTTRJ', version u16, ants per tick u32, ticks u32, ticks written u64
+    counts  u32 per tick slot, the number of rows written in it
+    rows    ticks x ants rows of ROW, starting on a 64 byte boundary
+
+read gives the rows back as NumPy views of the file, nothing is copied.
+'''
+
+MAGIC = b'ANTTRJ'
+VERSION = 1
+HEADER = struct.Struct('<6sHIIQ')
+ALIGN = 64
+
+# One row per ant per tick. state bit 0 is holding food, bit 1 having a target
+ROW = np.dtype([('tick', '<u4'), ('id', '<u4'), ('x', '<f4'), ('y', '<f4'),
+                ('vx', '<f4'), ('vy', '<f4'), ('state', 'u1')])
+HOLDING_FOOD = 1
+HAS_TARGET = 2
+
+
+def _layout(ants, ticks):
+    # Byte offsets of the counts and the rows, and the file size
+    counts = HEADER.size
+    rows = -(-(counts + 4 * ticks) // ALIGN) * ALIGN
+    return counts, rows, rows + ticks * ants * ROW.itemsize
+
+
+def part_path(path, part):
+    # File of the given rollover part, the first part is path itself
+    return path if part == 0 else '{}.{}'.format(path, part)
+
+
+def parts(path):
+    # All rollover parts of a recording that exist, in order
+    found = []
+    while os.path.exists(part_path(path, len(found))):
+        found.append(part_path(path, len(found)))
+    return found
+
+
+class Trajectory:
+    """ Views of a trajectory file """
+
+    def __init__(self, data):
+        self.data = data
+        magic, version, self.ants, self.capacity, self.written = HEADER.unpack(bytes(data[:HEADER.size]))
+        if magic != MAGIC:
+            raise ValueError("not a trajectory file")
+        if version != VERSION:
+            raise ValueError("unsupported trajectory version {}".format(version))
+        counts, rows, end = _layout(self.ants, self.capacity)
+        self.counts = data[counts:counts + 4 * self.capacity].view('<u4')
+        self.rows = data[rows:end].view(ROW).reshape(self.capacity, self.ants)
+
+    def __len__(self):
+        # Number of ticks held
+        return min(self.written, self.capacity)
+
+    def slots(self):
+        # Slots of the ticks held, oldest first
+        first = self.written - len(self)
+        return [(first + i) % self.capacity for i in range(len(self))]
+
+    def frame(self, i):
+        """
+        Rows of the i-th tick held, oldest first. Negative i counts from the
+        newest tick.
+        """
+        slot = self.slots()[i]
+        return self.rows[slot, :self.counts[slot]]
+
+    def chunks(self):
+        """
+        The ticks held as at most two (ticks, ants) blocks of rows, oldest
+        first. A ring that has wrapped is split where it wraps.
+        """
+        if self.written <= self.capacity:
+            return [self.rows[:self.written]]
+        head = self.written % self.capacity
+        return [block for block in (self.rows[head:], self.rows[:head]) if len(block)]
+
+
+def read(path):
+    # Trajectory of one file, mapped read only
+    return Trajectory(np.memmap(path, dtype=np.uint8, mode='r'))
+
+
+class TrajectoryRecorder:
+    """
+    Writes the ants of a colony to a memory-mapped trajectory file every
+    tick. The file holds ants rows per tick for ticks ticks. When it is full
+    the oldest ticks are overwritten, or with rollover the file is closed and
+    the next part, path.1, path.2 and so on, is started.
+    """
+
+    def __init__(self, path, ants, ticks=1000, rollover=False):
+        self.path = path
+        self.ants = ants
+        self.capacity = ticks
+        self.rollover = rollover
+        self.part = 0
+        self._open()
+
+    def _open(self):
+        counts, rows, size = _layout(self.ants, self.capacity)
+        path = part_path(self.path, self.part)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.ants, self.capacity, 0))
+            f.truncate(size)
+
+        self.data = np.memmap(path, dtype=np.uint8, mode='r+')
+        self.header = self.data[:HEADER.size]
+        self.counts = self.data[counts:counts + 4 * self.capacity].view('<u4')
+        self.rows = self.data[rows:size].view(ROW).reshape(self.capacity, self.ants)
+        self.written = 0
+
+    def write(self, tick, ids, position, velocity, state):
+        """
+        Add one tick. ids, state and the (N, 2) position and velocity arrays
+        hold one entry per ant.
+        """
+        n = len(ids)
+        if n > self.ants:
+            raise ValueError("{} ants do not fit in rows of {}".format(n, self.ants))
+        if self.rollover and self.written == self.capacity:
+            self.close()
+            self.part += 1
+            self._open()
+
+        slot = self.written % self.capacity
+        rows = self.rows[slot, :n]
+        rows['tick'] = tick
+        rows['id'] = ids
+        rows['x'] = position[:, 0]
+        rows['y'] = position[:, 1]
+        rows['vx'] = velocity[:, 0]
+        rows['vy'] = velocity[:, 1]
+        rows['state'] = state
+        self.counts[slot] = n
+
+        self.written += 1
+        struct.pack_into('<Q', self.header, HEADER.size - 8, self.written)
+
+    def capture(self, colony):
+        # Write the ants of an Environment or a SwarmEnvironment for the current tick
+        tick = colony.clock.tick
+        swarm = getattr(colony, 'ants', None)
+        if swarm is not None:
+            state = swarm.holding_food * HOLDING_FOOD + swarm.has_target * HAS_TARGET
+            self.write(tick, swarm.ids, swarm.position, swarm.velocity, state)
+            return
+
+        ants = colony.sprites.sprites()
+        n = len(ants)
+        position = np.array([ant.position for ant in ants], dtype=np.float32).reshape(n, 2)
+        velocity = np.array([ant.velocity for ant in ants], dtype=np.float32).reshape(n, 2)
+        state = np.array([ant.holding_food * HOLDING_FOOD + (ant.target is not None) * HAS_TARGET
+                          for ant in ants], dtype=np.uint8)
+        self.write(tick, np.arange(n), position, velocity, state)
+
+    def close(self):
+        if self.data is not None:
+            self.data.flush()
+            self.data = None